@@ -0,0 +1,187 @@
+"""
+Commit storm stress test: many clients commit versions of the same asset to a
+running server at once, sharing most of their files, then checks that every
+commit that succeeded got its own semver and can still be downloaded intact,
+e.g.:
+
+    python -m benchmarks.commit_storm --commits 200 --concurrency 32
+
+Creates a `bench-commits` user the first time it runs, and a new asset each time.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import time
+import zipfile
+
+import httpx
+
+PENNKEY = "bench-commits"
+PASSWORD = "bench-password"
+
+
+def make_archive(shared: dict[str, bytes], i: int) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path, data in shared.items():
+            archive.writestr(path, data)
+        # so every commit is a new archive
+        archive.writestr("commit.txt", f"commit {i} {os.urandom(8).hex()}")
+    return buffer.getvalue()
+
+
+async def log_in(client: httpx.AsyncClient) -> str:
+    response = await client.post(
+        "/api/v1/users/",
+        json={
+            "pennkey": PENNKEY,
+            "first_name": "Bench",
+            "last_name": "Commits",
+            "school": "seas",
+            "password": PASSWORD,
+        },
+    )
+    # 400 means the user was created by an earlier run
+    if response.status_code not in (200, 400):
+        response.raise_for_status()
+    response = await client.post(
+        "/api/v1/users/token", data={"username": PENNKEY, "password": PASSWORD}
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def commit(
+    client: httpx.AsyncClient,
+    asset_id: str,
+    archive: bytes,
+    semaphore: asyncio.Semaphore,
+    stats: dict,
+):
+    async with semaphore:
+        started = time.monotonic()
+        try:
+            response = await client.post(
+                f"/api/v1/assets/{asset_id}/versions/stream",
+                params={"message": "commit storm"},
+                content=archive,
+            )
+            status = response.status_code
+        except httpx.HTTPError:
+            status = None
+        stats["latencies"].append(time.monotonic() - started)
+    if status == 200:
+        stats["ok"][response.json()["semver"]] = hashlib.sha256(archive).hexdigest()
+    elif status == 409:
+        # gave up retrying, which clients are told to retry themselves
+        stats["conflicts"] += 1
+    else:
+        stats["failed"] += 1
+
+
+async def read_versions(client: httpx.AsyncClient, asset_id: str) -> list[dict]:
+    (versions, cursor) = ([], None)
+    while True:
+        params = {"limit": 100} if cursor is None else {"limit": 100, "cursor": cursor}
+        response = await client.get(
+            f"/api/v1/assets/{asset_id}/versions", params=params
+        )
+        response.raise_for_status()
+        versions += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return versions
+
+
+async def check(client: httpx.AsyncClient, asset_id: str, stats: dict) -> list[str]:
+    """
+    Returns:
+        list: The problems found, if any.
+    """
+    problems = []
+    versions = await read_versions(client, asset_id)
+    semvers = [version["semver"] for version in versions]
+    if len(semvers) != len(set(semvers)):
+        problems.append("semvers were allocated twice")
+    if set(semvers) != set(stats["ok"]):
+        problems.append(
+            f"{len(semvers)} versions stored, but {len(stats['ok'])} commits succeeded"
+        )
+    for semver, sha256 in stats["ok"].items():
+        response = await client.get(f"/api/v1/assets/{asset_id}/versions/{semver}/file")
+        if (
+            response.status_code != 200
+            or hashlib.sha256(response.content).hexdigest() != sha256
+        ):
+            problems.append(f"{semver} can't be downloaded intact")
+    return problems
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=120
+    ) as client:
+        client.headers["Authorization"] = f"Bearer {await log_in(client)}"
+        response = await client.post(
+            "/api/v1/assets/",
+            json={"asset_name": "commitStorm", "keywords": "bench", "image_uri": None},
+        )
+        response.raise_for_status()
+        asset_id = response.json()["id"]
+
+        # shared by every commit, so they contend for the same chunks
+        shared = {
+            f"shared/{i}.bin": os.urandom(args.file_size) for i in range(args.files)
+        }
+        archives = [make_archive(shared, i) for i in range(args.commits)]
+        semaphore = asyncio.Semaphore(args.concurrency)
+        stats = {"ok": {}, "conflicts": 0, "failed": 0, "latencies": []}
+        started = time.monotonic()
+        await asyncio.gather(
+            *(
+                commit(client, asset_id, archive, semaphore, stats)
+                for archive in archives
+            )
+        )
+        elapsed = time.monotonic() - started
+        problems = await check(client, asset_id, stats)
+
+    latencies = sorted(stats["latencies"])
+    total = len(latencies)
+    print(
+        f"{len(stats['ok'])} commits in {elapsed:.1f}s"
+        f" ({stats['conflicts']} gave up on conflicts, {stats['failed']} failed)"
+    )
+    print(f"{len(stats['ok']) / elapsed:.1f} commits/s")
+    print(
+        f"latency p50 {latencies[total // 2] * 1000:.1f}ms,"
+        f" p99 {latencies[min(total * 99 // 100, total - 1)] * 1000:.1f}ms"
+    )
+    for problem in problems:
+        print(f"FAILED: {problem}")
+    if problems or stats["failed"]:
+        raise SystemExit(1)
+    print("all commits got their own version and download intact")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--commits", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--files", type=int, default=20, help="files shared by every commit"
+    )
+    parser.add_argument(
+        "--file-size", type=int, default=64 * 1024, help="bytes per shared file"
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Load benchmark: hammers a running server with concurrent requests for a while
+and reports the requests per second it served.
+
+Run it against a single worker (`uvicorn main:app --workers 1`) before and after
+a change to compare throughput per worker, e.g.:
+
+    python -m benchmarks.load --path "/api/v1/assets/?search=chair" --concurrency 64
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def run_client(
+    client: httpx.AsyncClient, paths: list[str], deadline: float, stats: dict
+):
+    i = 0
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            response = await client.get(paths[i % len(paths)])
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        stats["latencies"].append(time.monotonic() - started)
+        stats["ok" if ok else "failed"] += 1
+        i += 1
+
+
+async def run(args):
+    headers = {}
+    if args.token is not None:
+        headers["Authorization"] = f"Bearer {args.token}"
+    limits = httpx.Limits(max_connections=args.concurrency)
+    stats = {"ok": 0, "failed": 0, "latencies": []}
+    async with httpx.AsyncClient(
+        base_url=args.url, headers=headers, limits=limits, timeout=30
+    ) as client:
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(
+                run_client(client, args.path, deadline, stats)
+                for _ in range(args.concurrency)
+            )
+        )
+        elapsed = time.monotonic() - started
+
+    latencies = sorted(stats["latencies"])
+    total = len(latencies)
+    print(f"{total} requests in {elapsed:.1f}s ({stats['failed']} failed)")
+    print(f"{total / elapsed:.1f} requests/s")
+    if total > 0:
+        print(
+            f"latency p50 {latencies[total // 2] * 1000:.1f}ms,"
+            f" p99 {latencies[min(total * 99 // 100, total - 1)] * 1000:.1f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--path",
+        action="append",
+        help="path to request, repeat to cycle through several (default: /api/v1/assets/)",
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--token", help="access token for authenticated endpoints")
+    args = parser.parse_args()
+    if not args.path:
+        args.path = ["/api/v1/assets/"]
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
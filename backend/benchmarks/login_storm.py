@@ -0,0 +1,140 @@
+"""
+Login storm benchmark: measures the latency of other requests to a running
+server on their own and then while many clients log in at once, to check that
+password hashing doesn't starve the rest of the server, e.g.:
+
+    python -m benchmarks.login_storm --logins 200
+
+Creates `--users` bench users (`bench-0`, `bench-1`, ...) the first time it runs.
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+PASSWORD = "bench-password"
+
+
+async def create_users(client: httpx.AsyncClient, count: int):
+    for i in range(count):
+        response = await client.post(
+            "/api/v1/users/",
+            json={
+                "pennkey": f"bench-{i}",
+                "first_name": "Bench",
+                "last_name": str(i),
+                "school": "seas",
+                "password": PASSWORD,
+            },
+        )
+        # 400 means the user was created by an earlier run
+        if response.status_code not in (200, 400):
+            response.raise_for_status()
+
+
+async def log_in(client: httpx.AsyncClient, pennkey: str, stats: dict):
+    started = time.monotonic()
+    try:
+        response = await client.post(
+            "/api/v1/users/token", data={"username": pennkey, "password": PASSWORD}
+        )
+        ok = response.status_code < 400
+    except httpx.HTTPError:
+        ok = False
+    stats["latencies"].append(time.monotonic() - started)
+    stats["ok" if ok else "failed"] += 1
+
+
+async def request_until(
+    client: httpx.AsyncClient, path: str, done: asyncio.Event, latencies: list
+):
+    while not done.is_set():
+        started = time.monotonic()
+        try:
+            await client.get(path)
+        except httpx.HTTPError:
+            pass
+        latencies.append(time.monotonic() - started)
+
+
+async def measure(client: httpx.AsyncClient, args, storm=None) -> list[float]:
+    """
+    Returns:
+        list: The sorted latencies of requests to `--path` made for `--duration`
+        seconds, or until `storm` finishes if it is given.
+    """
+    done = asyncio.Event()
+    latencies = []
+    clients = asyncio.gather(
+        *(
+            request_until(client, args.path, done, latencies)
+            for _ in range(args.concurrency)
+        )
+    )
+    if storm is None:
+        await asyncio.sleep(args.duration)
+    else:
+        await storm
+    done.set()
+    await clients
+    return sorted(latencies)
+
+
+def report(name: str, latencies: list[float]):
+    total = len(latencies)
+    if total == 0:
+        print(f"{name}: no requests finished")
+        return
+    print(
+        f"{name}: {total} requests, p50 {latencies[total // 2] * 1000:.1f}ms,"
+        f" p99 {latencies[min(total * 99 // 100, total - 1)] * 1000:.1f}ms,"
+        f" max {latencies[-1] * 1000:.1f}ms"
+    )
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.logins + args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=120
+    ) as client:
+        await create_users(client, args.users)
+        report("baseline", await measure(client, args))
+
+        logins = {"ok": 0, "failed": 0, "latencies": []}
+        started = time.monotonic()
+        storm = asyncio.gather(
+            *(
+                log_in(client, f"bench-{i % args.users}", logins)
+                for i in range(args.logins)
+            )
+        )
+        during = await measure(client, args, storm=storm)
+        elapsed = time.monotonic() - started
+
+    report("during logins", during)
+    report(
+        f"{args.logins} logins in {elapsed:.1f}s ({logins['failed']} failed)",
+        sorted(logins["latencies"]),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--path",
+        default="/api/v1/assets/",
+        help="path whose latency is measured (default: /api/v1/assets/)",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
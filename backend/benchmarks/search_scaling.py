@@ -0,0 +1,149 @@
+"""
+Search scaling benchmark: fills the database with more and more generated
+assets and measures the latency of searches at each size, to check it stays
+flat as the library grows, e.g.:
+
+    python -m benchmarks.search_scaling --sizes 1000,10000,100000,1000000
+
+Searches go through `read_assets` like the API's, straight against the database
+in DATABASE_URL, so run it against a scratch database. The generated assets
+(by `bench-search`) are deleted again at the end unless `--keep` is given.
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import random
+import time
+from uuid import uuid4
+
+from database.connection import AsyncSessionLocal, engine
+from util.crud.assets import read_assets
+
+AUTHOR = "bench-search"
+
+# assets are copied into the database this many at a time
+INSERT_BATCH_SIZE = 50000
+
+
+def make_words(count: int, seed: int) -> list[str]:
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "do"]
+    generator = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(generator.choices(syllables, k=generator.randint(2, 4))))
+    return sorted(words)
+
+
+def insert_assets(count: int, words: list[str], generator: random.Random):
+    connection = engine.raw_connection()
+    try:
+        for start in range(0, count, INSERT_BATCH_SIZE):
+            data = io.StringIO()
+            writer = csv.writer(data)
+            for _ in range(min(INSERT_BATCH_SIZE, count - start)):
+                (first, second) = generator.sample(words, 2)
+                writer.writerow(
+                    [
+                        uuid4(),
+                        f"{first}{second.capitalize()}",
+                        AUTHOR,
+                        ",".join(generator.sample(words, 2)),
+                        "now",
+                    ]
+                )
+            data.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    "COPY assets"
+                    " (id, asset_name, author_pennkey, keywords, latest_version_date)"
+                    " FROM STDIN WITH (FORMAT csv)",
+                    data,
+                )
+            connection.commit()
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE assets")
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def delete_assets():
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM assets WHERE author_pennkey = %s", (AUTHOR,))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+async def measure(searches: list[str], fuzzy: bool) -> list[float]:
+    latencies = []
+    async with AsyncSessionLocal() as db:
+        for search in searches:
+            started = time.monotonic()
+            await read_assets(db, search=search, fuzzy=fuzzy)
+            latencies.append(time.monotonic() - started)
+    return sorted(latencies)
+
+
+def report(name: str, latencies: list[float]):
+    total = len(latencies)
+    print(
+        f"  {name}: p50 {latencies[total // 2] * 1000:.1f}ms,"
+        f" p95 {latencies[min(total * 95 // 100, total - 1)] * 1000:.1f}ms"
+    )
+
+
+async def run(args):
+    generator = random.Random(args.seed)
+    words = make_words(args.words, args.seed)
+    # a word is a keyword of about 2 in --words assets (camelCase names are a
+    # single word to full-text search), so one-word searches find more matches
+    # to rank as the library grows; two words must both match, so find few,
+    # and prefixes (matching the start of any word) find the most
+    kinds = {
+        "one word": lambda: generator.choice(words),
+        "two words": lambda: " ".join(generator.sample(words, 2)),
+        "prefix": lambda: generator.choice(words)[:3],
+    }
+
+    inserted = 0
+    try:
+        for size in sorted(int(size) for size in args.sizes.split(",")):
+            insert_assets(size - inserted, words, generator)
+            inserted = size
+            print(f"{size} assets:")
+            for name, make_search in kinds.items():
+                searches = [make_search() for _ in range(args.searches)]
+                report(name, await measure(searches, fuzzy=False))
+            if args.fuzzy:
+                searches = [generator.choice(words) for _ in range(args.searches)]
+                report("fuzzy", await measure(searches, fuzzy=True))
+    finally:
+        if not args.keep:
+            delete_assets()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,100000,1000000",
+        help="comma-separated numbers of assets to measure at",
+    )
+    parser.add_argument("--searches", type=int, default=200, help="per kind and size")
+    parser.add_argument(
+        "--words", type=int, default=5000, help="words names and keywords use"
+    )
+    parser.add_argument("--fuzzy", action="store_true", help="also fuzzy searches")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the assets")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
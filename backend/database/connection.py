@@ -1,16 +1,242 @@
-from settings import DATABASE_URL
+import asyncio
+from itertools import count
+import logging
+import math
+import time
+from uuid import uuid4
+from settings import (
+    ALGORITHM,
+    CACHE_REDIS_URL,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_PGBOUNCER,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_REPLICA_RETRY_SECONDS,
+    DATABASE_REPLICA_URLS,
+    DATABASE_URL,
+    READ_YOUR_WRITES_SECONDS,
+    SECRET_KEY,
+)
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from jose import JWTError, jwt
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
 
+from database.pool import MeasuredQueuePool
+from util.cache import REDIS_TIMEOUT
 
-engine = create_engine(DATABASE_URL, connect_args={})
+logger = logging.getLogger(__name__)
+
+# seconds to wait for a replica to accept a connection before skipping it
+REPLICA_CONNECT_TIMEOUT = 5
+
+# blocking engine, for alembic and sqladmin
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={},
+    pool_pre_ping=DATABASE_POOL_PRE_PING,
+    pool_recycle=DATABASE_POOL_RECYCLE,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-def get_db():
-    db = SessionLocal()
+def create_pooled_engine(url: str, connect_args: dict = {}):
+    """
+    Creates an engine connecting to `url` through asyncpg, so requests don't
+    block the event loop.
+    """
+    connect_args = dict(connect_args)
+    if DATABASE_PGBOUNCER:
+        # statements prepared on one server connection can't be used on another,
+        # and unnamed ones would clash between clients sharing a server connection
+        connect_args.update(
+            statement_cache_size=0,
+            prepared_statement_cache_size=0,
+            prepared_statement_name_func=lambda: f"__asyncpg_{uuid4()}__",
+        )
+
+    return create_async_engine(
+        make_url(url).set(drivername="postgresql+asyncpg"),
+        connect_args=connect_args,
+        poolclass=MeasuredQueuePool,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT,
+        pool_recycle=DATABASE_POOL_RECYCLE,
+        pool_pre_ping=DATABASE_POOL_PRE_PING,
+    )
+
+
+def create_sessionmaker(bind):
+    # objects stay loaded after a commit, as they can't be lazily reloaded when used
+    return async_sessionmaker(bind, autoflush=False, expire_on_commit=False)
+
+
+async_engine = create_pooled_engine(DATABASE_URL)
+AsyncSessionLocal = create_sessionmaker(async_engine)
+# reads that fall back to the primary are read-only like those on replicas
+ReadSessionLocal = create_sessionmaker(
+    async_engine.execution_options(postgresql_readonly=True)
+)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_pooled_engine(
+            url, connect_args={"timeout": REPLICA_CONNECT_TIMEOUT}
+        )
+        self.sessionmaker = create_sessionmaker(
+            self.engine.execution_options(postgresql_readonly=True)
+        )
+        # when to try connecting to the replica again after it failed
+        self.unhealthy_until = 0.0
+
+
+replicas = [Replica(url) for url in DATABASE_REPLICA_URLS]
+next_replica = count()
+
+
+class RecentWrites:
+    """
+    Remembers which clients wrote in the last READ_YOUR_WRITES_SECONDS, so their
+    reads go to the primary. A client's next read may be served by another
+    worker, so with CACHE_REDIS_URL set they are shared between workers through
+    redis; otherwise they are only kept in this process, which is enough for a
+    single worker. While redis can't be reached every client is treated as
+    having written recently.
+    """
+
+    PREFIX = "griddle:wrote:"
+
+    def __init__(self, redis_url: str | None):
+        # when the reads of each client may go to replicas again
+        self.until: dict[str, float] = {}
+        self.redis = None
+        if redis_url is not None:
+            import redis.asyncio
+            import redis.exceptions
+
+            self.redis = redis.asyncio.from_url(
+                redis_url,
+                socket_connect_timeout=REDIS_TIMEOUT,
+                socket_timeout=REDIS_TIMEOUT,
+            )
+            self.errors = (redis.exceptions.RedisError, OSError)
+
+    async def add(self, keys: list[str]):
+        if self.redis is None:
+            now = time.monotonic()
+            if len(self.until) > 10000:
+                for key, until in list(self.until.items()):
+                    if until <= now:
+                        del self.until[key]
+            for key in keys:
+                self.until[key] = now + READ_YOUR_WRITES_SECONDS
+            return
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for key in keys:
+                    pipeline.set(
+                        self.PREFIX + key,
+                        1,
+                        px=math.ceil(READ_YOUR_WRITES_SECONDS * 1000),
+                    )
+                await pipeline.execute()
+        except self.errors:
+            logger.warning("Couldn't remember a write in redis", exc_info=True)
+
+    async def contains_any(self, keys: list[str]) -> bool:
+        if not keys:
+            return False
+        if self.redis is None:
+            now = time.monotonic()
+            return any(self.until.get(key, 0) > now for key in keys)
+
+        try:
+            return await self.redis.exists(*(self.PREFIX + key for key in keys)) > 0
+        except self.errors:
+            logger.warning("Couldn't check for recent writes in redis", exc_info=True)
+            return True
+
+    def clear(self):
+        self.until.clear()
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+
+
+recent_writes = RecentWrites(CACHE_REDIS_URL)
+
+
+def get_client_keys(request: Request) -> list[str]:
+    """
+    Identifies the user making a request by the subject of its access token, if
+    it sent a valid one, so their reads see their writes whichever token or
+    address they send them from. Other requests aren't identified.
+    """
+    authorization = request.headers.get("Authorization")
+    if authorization is None:
+        return []
+    (scheme, _, token) = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        return []
     try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return []
+    pennkey = payload.get("sub")
+    return [pennkey] if isinstance(pennkey, str) else []
+
+
+@event.listens_for(Session, "after_commit")
+def remember_write(session: Session):
+    # recorded by get_db once the request is done with the session
+    if replicas and session.info.get("client_keys"):
+        session.info["wrote"] = True
+
+
+async def get_db(request: Request):
+    async with AsyncSessionLocal(info={"client_keys": get_client_keys(request)}) as db:
+        try:
+            yield db
+        finally:
+            # before the response is sent, so the client's next read sees it
+            if db.info.get("wrote"):
+                await recent_writes.add(db.info["client_keys"])
+
+
+async def get_read_db(request: Request):
+    """
+    Yields a read-only session, on one of the replicas if there are any. Clients
+    that wrote recently read from the primary, as do all clients if none of
+    the replicas can be connected to.
+    """
+    now = time.monotonic()
+    if replicas and not await recent_writes.contains_any(get_client_keys(request)):
+        start = next(next_replica)
+        for i in range(len(replicas)):
+            replica = replicas[(start + i) % len(replicas)]
+            if replica.unhealthy_until > now:
+                continue
+            db = replica.sessionmaker()
+            try:
+                await db.connection()
+            except (DBAPIError, OSError, asyncio.TimeoutError):
+                await db.close()
+                replica.unhealthy_until = (
+                    time.monotonic() + DATABASE_REPLICA_RETRY_SECONDS
+                )
+                continue
+            async with db:
+                yield db
+            return
+
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -3,11 +3,26 @@ import enum
 from typing import Literal, Optional, get_args
 from uuid import UUID, uuid4
 
-from sqlalchemy import Enum, ForeignKey, Uuid, func, literal
+from sqlalchemy import (
+    BigInteger,
+    Computed,
+    DateTime,
+    Enum,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    Uuid,
+    func,
+    literal,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, declarative_base, relationship
 
 Base = declarative_base()
 
+# text search configuration assets are indexed (and must be searched) with
+SEARCH_CONFIG = "english"
+
 
 def random_uuid():
     return str(uuid4())
@@ -15,6 +30,25 @@ def random_uuid():
 
 class Asset(Base):
     __tablename__ = "assets"
+    __table_args__ = (
+        Index("ix_assets_search_vector", "search_vector", postgresql_using="gin"),
+        # for paging through assets by name or date
+        Index("ix_assets_asset_name_id", "asset_name", "id"),
+        Index("ix_assets_latest_version_date_id", "latest_version_date", "id"),
+        # trigram indexes for fuzzy search
+        Index(
+            "ix_assets_asset_name_trgm",
+            "asset_name",
+            postgresql_using="gin",
+            postgresql_ops={"asset_name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_assets_keywords_trgm",
+            "keywords",
+            postgresql_using="gin",
+            postgresql_ops={"keywords": "gin_trgm_ops"},
+        ),
+    )
 
     # TODO: move these to Mapped[str] for easier manipulation
     id: Mapped[UUID] = mapped_column(
@@ -24,22 +58,144 @@ class Asset(Base):
     author_pennkey: Mapped[str]
     keywords: Mapped[str]
     image_uri: Mapped[Optional[str]]
+    # when the latest version was added (or the asset, until it has a version) and
+    # its semver, kept up to date by add_next_version to sort by without a join
+    latest_version_date: Mapped[datetime] = mapped_column(insert_default=func.now())
+    latest_semver: Mapped[Optional[str]]
+    # kept up to date by postgres, with matches in the name ranking highest
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', asset_name), 'A')"
+            f" || setweight(to_tsvector('{SEARCH_CONFIG}', keywords), 'B')",
+            persisted=True,
+        ),
+        deferred=True,
+    )
 
     versions: Mapped[list["Version"]] = relationship(back_populates="asset")
 
 
+class AssetKeyword(Base):
+    """
+    A keyword of an asset, kept in sync with `Asset.keywords` so assets can be
+    filtered by exact keyword through an index.
+    """
+
+    __tablename__ = "asset_keywords"
+
+    asset_id: Mapped[UUID] = mapped_column(ForeignKey("assets.id"), primary_key=True)
+    keyword: Mapped[str] = mapped_column(primary_key=True, index=True)
+
+
+class AssetChanges(Base):
+    """
+    A single row counting committed changes to assets, their keywords and their
+    versions, so responses about them can be revalidated by reading just this
+    row. Kept up to date by triggers (see the migration adding it), which run
+    as transactions commit so concurrent writes only wait on each other then.
+    """
+
+    __tablename__ = "asset_changes"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    counter: Mapped[int] = mapped_column(BigInteger)
+    modified: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
 class Version(Base):
     __tablename__ = "versions"
+    __table_args__ = (
+        # for paging through an asset's versions by date
+        Index("ix_versions_asset_id_date", "asset_id", "date", "semver"),
+        # for finding an asset's latest version by number
+        Index(
+            "ix_versions_asset_id_major_minor",
+            "asset_id",
+            "major",
+            "minor",
+            unique=True,
+        ),
+    )
 
     asset_id: Mapped[UUID] = mapped_column(ForeignKey("assets.id"), primary_key=True)
     asset: Mapped["Asset"] = relationship(back_populates="versions")
     semver: Mapped[str] = mapped_column(insert_default="0.1", primary_key=True)
+    # the numbers of the semver, which sort as numbers rather than strings
+    major: Mapped[int]
+    minor: Mapped[int]
 
     author_pennkey: Mapped[str]
     date: Mapped[datetime] = mapped_column(insert_default=func.now())
     message: Mapped[str]
 
+    # unset if the version is stored as its individual files (see VersionFile)
+    file_key: Mapped[Optional[str]]
+    # sha256 of the archive as uploaded, also naming its blob if it has a file_key
+    sha256: Mapped[Optional[str]] = mapped_column(index=True)
+    # the end of the archive after its last file, i.e. its central directory, if
+    # the version is stored as its individual files
+    central_directory: Mapped[Optional[bytes]] = mapped_column(deferred=True)
+
+
+class Blob(Base):
+    """
+    A version file stored in S3, addressed by the sha256 of its contents so
+    identical files are only stored once.
+    """
+
+    __tablename__ = "blobs"
+
+    sha256: Mapped[str] = mapped_column(primary_key=True)
     file_key: Mapped[str]
+    size: Mapped[int] = mapped_column(BigInteger)
+    # number of versions referencing this blob
+    ref_count: Mapped[int] = mapped_column(insert_default=0)
+
+
+class Chunk(Base):
+    """
+    The data of a single file from inside version archives, stored in S3 by
+    itself so identical files are only stored once. It is kept (and addressed by
+    the sha256 of) exactly as stored in the archive, i.e. usually compressed, so
+    archives can be reassembled byte for byte.
+    """
+
+    __tablename__ = "chunks"
+
+    sha256: Mapped[str] = mapped_column(primary_key=True)
+    file_key: Mapped[str]
+    compress_type: Mapped[int]
+    compress_size: Mapped[int] = mapped_column(BigInteger)
+    file_size: Mapped[int] = mapped_column(BigInteger)
+    crc32: Mapped[int] = mapped_column(BigInteger)
+    # number of version files referencing this chunk
+    ref_count: Mapped[int] = mapped_column(insert_default=0)
+
+
+class VersionFile(Base):
+    """
+    A file in the archive of a version stored as its individual files.
+    """
+
+    __tablename__ = "version_files"
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["asset_id", "semver"], ["versions.asset_id", "versions.semver"]
+        ),
+    )
+
+    asset_id: Mapped[UUID] = mapped_column(primary_key=True)
+    semver: Mapped[str] = mapped_column(primary_key=True)
+    path: Mapped[str] = mapped_column(primary_key=True)
+    # order of the file within the archive
+    position: Mapped[int]
+    date_time: Mapped[datetime]
+    # sha256 of the file's (uncompressed) contents
+    sha256: Mapped[str]
+    chunk_sha256: Mapped[str] = mapped_column(ForeignKey("chunks.sha256"), index=True)
+    # the archive's bytes before the file's data, i.e. its local file header
+    header: Mapped[bytes]
 
 
 # school for user model
@@ -60,6 +216,33 @@ class User(Base):
             *get_args(School),
             name="school",
             create_constraint=True,
-            validate_strings=True
+            validate_strings=True,
         )
     )
+    # bumped whenever the user's password changes, which revokes every refresh
+    # token issued before (see RefreshTokenFamily)
+    token_generation: Mapped[int] = mapped_column(insert_default=0)
+
+
+class RefreshTokenFamily(Base):
+    """
+    The refresh tokens issued from one login, each replacing the one before it,
+    so refreshing on one device doesn't log out the user's others.
+    """
+
+    __tablename__ = "refresh_token_families"
+
+    id: Mapped[UUID] = mapped_column(
+        Uuid(as_uuid=True), primary_key=True, insert_default=uuid4
+    )
+    pennkey: Mapped[str] = mapped_column(
+        ForeignKey("users.pennkey", ondelete="CASCADE"), index=True
+    )
+    # the user's token generation at login; the family is revoked once the
+    # user's moves on
+    user_generation: Mapped[int]
+    # generation of the family's latest refresh token, and when it was issued
+    generation: Mapped[int] = mapped_column(insert_default=0)
+    issued_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), insert_default=func.now()
+    )
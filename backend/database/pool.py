@@ -0,0 +1,50 @@
+"""
+A connection pool that keeps track of how long requests wait for connections,
+so the pool (and the number of workers) can be sized against what postgres
+allows.
+"""
+
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class PoolStats:
+    """
+    Totals since the pool was created, in this worker process only.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        # connections opened beyond the pool size, and checkouts that gave up
+        self.overflows = 0
+        self.timeouts = 0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+class MeasuredQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - started)
+
+    def _create_connection(self):
+        # only counts past the pool size once it is full
+        if self._overflow > 0:
+            self.stats.overflows += 1
+        return super()._create_connection()
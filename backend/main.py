@@ -6,7 +6,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from alembic.config import Config
 from alembic import command
 
+from database.connection import async_engine, recent_writes, replicas
 from routers.api_v1 import router as api_v1_router
+from util.crud.assets import asset_cache
+from util.passwords import shutdown_executor
 from util.sqladmin import config_sqladmin
 
 
@@ -22,7 +25,12 @@ async def lifespan(app: FastAPI):
     init_db()
     yield
     # Post-shutdown code
-    pass
+    await async_engine.dispose()
+    for replica in replicas:
+        await replica.engine.dispose()
+    await recent_writes.close()
+    shutdown_executor()
+    await asset_cache.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -36,6 +44,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # lets the frontend page through listings
+    expose_headers=["X-Next-Cursor"],
 )
 
 if is_dev:
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 
 from .assets import router as assets_router
+from .status import router as status_router
 from .users import router as users_router
 
 router = APIRouter(
@@ -9,3 +10,4 @@ router = APIRouter(
 
 router.include_router(assets_router)
 router.include_router(users_router)
+router.include_router(status_router)
@@ -1,34 +1,99 @@
+from collections import defaultdict
+from datetime import timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+import json
 from typing import Annotated, Literal, Sequence
+from uuid import uuid4
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Depends,
     File,
     Form,
+    Header,
     HTTPException,
+    Query,
+    Request,
+    Response,
     UploadFile,
 )
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from botocore.exceptions import ClientError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.models import User
 from util.crud.assets import (
+    MAX_EXPORT_SIZE,
     AssetInfo,
+    copy_version,
     create_asset,
     create_version,
+    read_asset_changes,
     read_asset_exists,
-    read_asset_versions,
-    read_assets,
-    read_assets_names,
-    read_asset_info,
+    read_assets_info,
+    read_export,
+    read_name_index,
+    read_cached_asset_info,
+    read_cached_asset_versions,
+    read_cached_assets,
+    read_keyword_counts,
+    read_file_key_exists,
+    read_version,
+    read_version_by_sha256,
+    read_version_diff,
+    read_version_patch,
     read_version_file,
+    read_versions,
+    register_version,
+    retry_version_commit,
     update_asset,
     remove_asset,
 )
-from database.connection import get_db
-from schemas.models import Asset, AssetCreate, Version, VersionCreate
-from util.files import save_upload_file_temp
-from util.auth import get_current_user, oauth2_scheme
+from database.connection import get_db, get_read_db
+from schemas.models import (
+    MAX_BATCH_SIZE,
+    SHA256_PATTERN,
+    Asset,
+    AssetBatchGet,
+    AssetCreate,
+    AssetExport,
+    AssetNameSuggestion,
+    KeywordCount,
+    User,
+    Version,
+    VersionBatchGet,
+    VersionCreate,
+    VersionDiff,
+    VersionDownload,
+    VersionUpload,
+    VersionUploadFinalize,
+    VersionUploadStart,
+)
+from settings import PRESIGNED_TRANSFERS
+from util.files import (
+    complete_multipart_upload,
+    delete_s3_objects,
+    etag_matches,
+    presign_download,
+    presign_multipart_upload,
+    presign_upload,
+    iter_upload_file,
+    s3_object_size,
+)
+from util.pagination import MAX_PAGE_SIZE, PAGE_SIZE
+from util.auth import (
+    create_upload_token,
+    decode_upload_token,
+    get_current_user,
+    oauth2_scheme,
+)
+
+UPLOAD_TOKEN_EXPIRE_HOURS = 24
+
+# S3 allows at most 10,000 parts in a multipart upload
+MAX_UPLOAD_PARTS = 10000
+
+# asset names written to the response at a time
+NAMES_CHUNK_SIZE = 1000
 
 router = APIRouter(
     prefix="/assets",
@@ -37,35 +102,187 @@ router = APIRouter(
 )
 
 
+def require_presigned_transfers():
+    if not PRESIGNED_TRANSFERS:
+        raise HTTPException(status_code=400, detail="Presigned transfers are disabled")
+
+
+async def check_asset_changes(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    response: Response,
+    if_none_match: Annotated[str | None, Header()] = None,
+    if_modified_since: Annotated[str | None, Header()] = None,
+):
+    """
+    Validates responses about assets against the count of changes made to them,
+    so a client whose copy is still current gets a 304 without the response
+    being read or serialized. Must run before the response is read, so that a
+    change made meanwhile makes its ETag stale rather than current.
+
+    Returns:
+        dict: The validator headers, which are also set on `response` unless the
+        endpoint returns its own.
+    """
+    (counter, modified) = await read_asset_changes(db)
+    # e.g. for the name index to be made current as of it
+    db.info["asset_changes"] = counter
+    etag = f'"assets-{counter}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(modified, usegmt=True),
+        # revalidated every time, as any change to assets may change the response
+        "Cache-Control": "no-cache",
+    }
+    response.headers.update(headers)
+
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            raise HTTPException(status_code=304, headers=headers)
+    elif if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return headers
+        if since.tzinfo is not None and modified.replace(microsecond=0) <= since:
+            raise HTTPException(status_code=304, headers=headers)
+    return headers
+
+
+async def get_versions_to_compare(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    uuid: str,
+    from_semver: str,
+    to_semver: str,
+):
+    """
+    Reads the two versions of an asset to compare, which must both be stored as
+    their individual files.
+    """
+    from_version = await read_version(db, uuid, from_semver)
+    to_version = await read_version(db, uuid, to_semver)
+    if from_version is None or to_version is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    if from_version.file_key is not None or to_version.file_key is not None:
+        # e.g. presigned uploads, which are only stored as whole archives
+        raise HTTPException(
+            status_code=400,
+            detail="Only versions stored as individual files can be compared",
+        )
+    return (from_version, to_version)
+
+
 @router.get(
     "/",
     summary="Get a list of assets",
+    dependencies=[Depends(check_asset_changes)],
     description="""Used for fetching a (paginated) list of assets stored in the database.
 
-Allows searching by arbitrary strings, sorting by date or name, adding keyword filters, and adding offset for pagination.""",
+Allows searching by arbitrary strings, sorting by date or name, and adding keyword filters. Pages hold `limit` assets; if there are more, the `X-Next-Cursor` response header holds a `cursor` to fetch the next page with the same parameters.
+
+A search matches assets with all of its words (or words starting with them) in their name or keywords, and a comma-separated search matches any of its parts. Unless sorted by name, the best matches come first.
+
+With `fuzzy` set, a search instead matches assets with words similar to it, so misspelled searches still find what was meant.
+
+`keywords` is a comma-separated list of exact keywords to filter by, which assets must have all of, or any of if `keywords_mode` is `any`.
+
+Responses have an `ETag` and `Last-Modified` which change whenever any asset does, so they can be revalidated with `If-None-Match` or `If-Modified-Since`.""",
+    responses={304: {"description": "No asset has changed since the client's copy"}},
 )
-def get_assets(
-    db: Annotated[Session, Depends(get_db)],
+async def get_assets(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    response: Response,
     search: str | None = None,
     keywords: str | None = None,
     sort: Literal["date_asc", "name_asc", "date_dsc", "name_dsc"] = "date_dsc",
-    offset: int = 0,
+    offset: Annotated[int, Query(deprecated=True)] = 0,
+    fuzzy: bool = False,
+    keywords_mode: Literal["all", "any"] = "all",
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE,
 ) -> Sequence[Asset]:
-    # TODO: add fuzzy search somehow
-    return read_assets(
-        db, search=(search if search != "" else None), offset=offset, sort=sort
+    (assets, next_cursor) = await read_cached_assets(
+        db,
+        search=(search if search != "" else None),
+        offset=offset,
+        sort=sort,
+        fuzzy=fuzzy,
+        keywords=keywords,
+        keywords_mode=keywords_mode,
+        cursor=cursor,
+        limit=limit,
     )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return assets
 
 
 @router.get(
     "/names",
     summary="Get a list of asset names",
-    description="Used for fetching a list of the names of assets stored in the database.",
+    description="""Used for fetching a list of the names of all assets stored in the database, alphabetically. The list is streamed as it is written, and can be revalidated like `/assets/`.
+
+To look up names as they are typed, use `/assets/names/suggest` instead.""",
+    response_model=Sequence[str],
+    responses={304: {"description": "No asset has changed since the client's copy"}},
 )
-def get_assets_names(
-    db: Session = Depends(get_db),
-) -> Sequence[str]:
-    return read_assets_names(db)
+async def get_assets_names(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    validators: Annotated[dict, Depends(check_asset_changes)],
+) -> StreamingResponse:
+    index = await read_name_index(db, db.info["asset_changes"])
+
+    def iter_names(names: list[str]):
+        yield b"["
+        for i in range(0, len(names), NAMES_CHUNK_SIZE):
+            chunk = ",".join(map(json.dumps, names[i : i + NAMES_CHUNK_SIZE]))
+            yield (chunk if i == 0 else "," + chunk).encode()
+        yield b"]"
+
+    return StreamingResponse(
+        iter_names(index.sorted_names()),
+        media_type="application/json",
+        headers=validators,
+    )
+
+
+@router.get(
+    "/names/suggest",
+    summary="Suggest asset names starting with a prefix",
+    description="""Returns up to `limit` assets whose names start with `prefix` (ignoring case) alphabetically, followed by those with a word in their name starting with it, e.g. `chair` for `redChair`.
+
+Names are looked up in memory, so suggestions can be fetched as a name is typed. Assets changed through another server process may take a little while to be suggested.""",
+)
+async def suggest_asset_names(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    prefix: Annotated[str, Query(min_length=1)],
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = 10,
+) -> Sequence[AssetNameSuggestion]:
+    index = await read_name_index(db)
+    return [
+        AssetNameSuggestion(id=asset_id, asset_name=name)
+        for (asset_id, name) in index.suggest(prefix, limit)
+    ]
+
+
+@router.get(
+    "/keywords",
+    summary="Get keyword counts for a search",
+    description="""Counts the assets with each keyword among those matching the given search and keyword filters, as in `/assets/`, most common first.""",
+)
+async def get_keyword_counts(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    search: str | None = None,
+    keywords: str | None = None,
+    fuzzy: bool = False,
+    keywords_mode: Literal["all", "any"] = "all",
+) -> Sequence[KeywordCount]:
+    return await read_keyword_counts(
+        db,
+        search=(search if search != "" else None),
+        fuzzy=fuzzy,
+        keywords=keywords,
+        keywords_mode=keywords_mode,
+    )
 
 
 @router.post(
@@ -74,21 +291,95 @@ def get_assets_names(
     description="Creating a new asset in the database. Does not include initial version -- followed up with POST to `/assets/{uuid}` to upload an initial version.",
 )
 async def new_asset(
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
     user: Annotated[User, Depends(get_current_user)],
     asset: AssetCreate,
 ) -> Asset:
-    return create_asset(db, asset, user.pennkey)
+    return await create_asset(db, asset, user.pennkey)
+
+
+@router.post(
+    "/batch-get",
+    summary="Get info about many assets at once",
+    description=f"""Fetches the same information as `/assets/{{uuid}}` for each of up to {MAX_BATCH_SIZE} `ids`, keyed by id in the order they were given. An id given more than once is fetched once. If any of the assets doesn't exist, responds with 404.""",
+    responses={404: {"description": "An asset was not found"}},
+)
+async def batch_get_asset_info(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    batch: AssetBatchGet,
+) -> dict[str, AssetInfo]:
+    info = await read_assets_info(db, batch.ids)
+    ids = [str(asset_id) for asset_id in batch.ids]
+    if any(asset_id not in info for asset_id in ids):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return {asset_id: info[asset_id] for asset_id in ids}
+
+
+@router.post(
+    "/versions/batch-get",
+    summary="Get many versions at once",
+    description=f"""Fetches up to {MAX_BATCH_SIZE} `versions`, each given by its `asset_id` and `semver`, keyed by asset id and then semver in the order they were given. A version given more than once is fetched once. If any of the versions doesn't exist, responds with 404.""",
+    responses={404: {"description": "A version was not found"}},
+)
+async def batch_get_versions(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    batch: VersionBatchGet,
+) -> dict[str, dict[str, Version]]:
+    found = await read_versions(
+        db, [(version.asset_id, version.semver) for version in batch.versions]
+    )
+    versions = defaultdict(dict)
+    for ref in batch.versions:
+        version = found.get(str(ref.asset_id), {}).get(ref.semver)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Version not found")
+        versions[str(ref.asset_id)][ref.semver] = version
+    return versions
+
+
+@router.post(
+    "/export",
+    summary="Download many assets as a single zip archive",
+    description=f"""Streams a zip archive containing the version file of each selected asset, named after the asset and semver, as downloaded from `/assets/{{uuid}}/versions/{{semver}}/file`.
+
+Assets are selected by a `search` and `keywords` as in `/assets/` (matching at most {MAX_EXPORT_SIZE} assets), and by their `ids`. Their latest versions are exported, except for assets given in `versions`, whose version is pinned to its `semver`. Assets without versions are left out.""",
+    responses={
+        200: {
+            "content": {"application/zip": {}},
+            "description": "Download the version files as a zip archive",
+        },
+        404: {"description": "A pinned version was not found"},
+    },
+)
+async def export_assets(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    token: Annotated[str, Depends(oauth2_scheme)],
+    export: AssetExport,
+) -> StreamingResponse:
+    (chunks, headers) = await read_export(
+        db,
+        search=(export.search if export.search != "" else None),
+        keywords=(export.keywords if export.keywords != "" else None),
+        keywords_mode=export.keywords_mode,
+        asset_ids=export.ids,
+        pinned={str(version.asset_id): version.semver for version in export.versions},
+    )
+    headers["Content-Disposition"] = 'attachment; filename="assets.zip"'
+    return StreamingResponse(chunks, media_type="application/zip", headers=headers)
 
 
 # TODO: add relatedAssets maybe
 @router.get(
     "/{uuid}",
     summary="Get info about a specific asset",
-    description="Based on `uuid`, fetches information on a specific asset.",
+    description="Based on `uuid`, fetches information on a specific asset. Can be revalidated like `/assets/`.",
+    dependencies=[Depends(check_asset_changes)],
+    responses={304: {"description": "No asset has changed since the client's copy"}},
 )
-def get_asset_info(uuid: str, db: Annotated[Session, Depends(get_db)]) -> AssetInfo:
-    result = read_asset_info(db, uuid)
+async def get_asset_info(
+    uuid: str, db: Annotated[AsyncSession, Depends(get_read_db)]
+) -> AssetInfo:
+    result = await read_cached_asset_info(db, uuid)
     if result is None:
         raise HTTPException(status_code=404, detail="Asset not found")
     return result
@@ -100,12 +391,12 @@ def get_asset_info(uuid: str, db: Annotated[Session, Depends(get_db)]) -> AssetI
     description="Based on `uuid`, updates information for a specific asset.",
 )
 async def put_asset(
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
     token: Annotated[str, Depends(oauth2_scheme)],
     uuid: str,
     asset: AssetCreate,
 ):
-    result = update_asset(db, uuid, asset)
+    result = await update_asset(db, uuid, asset)
     if result is None:
         raise HTTPException(status_code=404, detail="Asset not found")
     return result
@@ -118,76 +409,333 @@ async def put_asset(
 )
 async def delete_asset(
     uuid: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    result = remove_asset(db, uuid)
+    result = await remove_asset(db, uuid)
     if result is False:
         raise HTTPException(status_code=404, detail="Asset not found")
     return
 
 
-@router.get("/{uuid}/versions", summary="Get a list of versions for a given asset")
-def get_asset_versions(
-    db: Annotated[Session, Depends(get_db)],
+@router.get(
+    "/{uuid}/versions",
+    summary="Get a list of versions for a given asset",
+    description="Pages hold `limit` versions; if there are more, the `X-Next-Cursor` response header holds a `cursor` to fetch the next page with the same `sort`. Can be revalidated like `/assets/`.",
+    dependencies=[Depends(check_asset_changes)],
+    responses={304: {"description": "No asset has changed since the client's copy"}},
+)
+async def get_asset_versions(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    response: Response,
     uuid: str,
     sort: Literal["asc", "desc"] = "desc",
-    offset: int = 0,
+    offset: Annotated[int, Query(deprecated=True)] = 0,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = PAGE_SIZE,
 ) -> Sequence[Version]:
-    return read_asset_versions(db, uuid, sort, offset)
+    (versions, next_cursor) = await read_cached_asset_versions(
+        db, uuid, sort=sort, offset=offset, cursor=cursor, limit=limit
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return versions
 
 
 @router.post("/{uuid}/versions", summary="Upload a new version for a given asset")
-def new_asset_version(
-    db: Annotated[Session, Depends(get_db)],
+async def new_asset_version(
+    db: Annotated[AsyncSession, Depends(get_db)],
     user: Annotated[User, Depends(get_current_user)],
     uuid: str,
     file: Annotated[UploadFile, File()],
     message: Annotated[str, Form()],
     is_major: Annotated[bool, Form()] = False,
-):
+    sha256: Annotated[str | None, Form(pattern=SHA256_PATTERN)] = None,
+) -> Version:
     # TODO: reenable this sometime
     # if file.content_type != "application/zip":
     #     raise HTTPException(status_code=400, detail="File must be a ZIP archive")
 
-    file_path = save_upload_file_temp(file)
-    if file_path is None:
+    if (file.filename is None) or (file.filename == ""):
         raise HTTPException(status_code=400, detail="File uploaded incorrectly")
 
-    if not read_asset_exists(db, uuid):
+    if not await read_asset_exists(db, uuid):
         raise HTTPException(status_code=404, detail="Asset not found")
 
-    return create_version(
+    return await create_version(
         db,
-        file_path,
+        iter_upload_file(file),
         uuid,
         user.pennkey,
         VersionCreate(message=message, is_major=is_major),
+        sha256,
     )
 
 
+@router.post(
+    "/{uuid}/versions/stream",
+    summary="Upload a new version for a given asset as a raw request body",
+    description="""The request body is the version's zip archive, which is streamed into S3 as it arrives instead of being buffered first. Prefer this over the form upload for large files.
+
+The archive is stored as its individual files, and files already stored (e.g. unchanged since the previous version) aren't stored again. Optionally, pass the archive's hex-encoded `sha256` to skip the upload entirely if an identical archive was already uploaded, or otherwise to have it rejected if it arrives corrupted.""",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/zip": {"schema": {"type": "string", "format": "binary"}}
+            },
+            "required": True,
+        }
+    },
+)
+async def stream_asset_version(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    user: Annotated[User, Depends(get_current_user)],
+    request: Request,
+    uuid: str,
+    message: str,
+    is_major: bool = False,
+    sha256: Annotated[str | None, Query(pattern=SHA256_PATTERN)] = None,
+) -> Version:
+    if not await read_asset_exists(db, uuid):
+        raise HTTPException(status_code=404, detail="Asset not found")
+
+    return await create_version(
+        db,
+        request.stream(),
+        uuid,
+        user.pennkey,
+        VersionCreate(message=message, is_major=is_major),
+        sha256,
+    )
+
+
+@router.post(
+    "/{uuid}/versions/upload",
+    summary="Start a presigned upload of a new version for a given asset",
+    description="""Returns a presigned S3 URL to `PUT` the version file to directly, or presigned URLs for each part of a multipart upload if `part_count` is set.
+
+Once the upload is done, POST the returned `upload_token` to `/assets/{uuid}/versions/upload/finalize` to register the version.
+
+If the file's `sha256` is given and an identical file is already stored, no URLs are returned and the version can be finalized right away. For a single `PUT`, S3 then also requires a matching `x-amz-checksum-sha256` header.""",
+    dependencies=[Depends(require_presigned_transfers)],
+)
+async def start_version_upload(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    user: Annotated[User, Depends(get_current_user)],
+    uuid: str,
+    upload: VersionUploadStart,
+) -> VersionUpload:
+    if not await read_asset_exists(db, uuid):
+        raise HTTPException(status_code=404, detail="Asset not found")
+
+    if upload.part_count is not None and not (
+        1 <= upload.part_count <= MAX_UPLOAD_PARTS
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"part_count must be between 1 and {MAX_UPLOAD_PARTS}",
+        )
+
+    expires_delta = timedelta(hours=UPLOAD_TOKEN_EXPIRE_HOURS)
+    sha256 = None if upload.sha256 is None else upload.sha256.lower()
+    if sha256 is not None and await read_version_by_sha256(db, sha256) is not None:
+        # an identical file was already uploaded, so there is nothing to upload
+        upload_token = create_upload_token(
+            user.pennkey, uuid, None, None, sha256, expires_delta
+        )
+        return VersionUpload(upload_token=upload_token)
+
+    if upload.part_count is None:
+        # S3 verifies the checksum of a single PUT, so the file can be keyed by it
+        file_key = f"{uuid4()}" if sha256 is None else f"blobs/{sha256}"
+        (url, upload_id, part_urls) = (presign_upload(file_key, sha256), None, [])
+    else:
+        # multipart uploads can't be verified against the hash, so it isn't kept
+        (file_key, sha256) = (f"{uuid4()}", None)
+        url = None
+        (upload_id, part_urls) = await run_in_threadpool(
+            presign_multipart_upload, file_key, upload.part_count
+        )
+
+    upload_token = create_upload_token(
+        user.pennkey, uuid, file_key, upload_id, sha256, expires_delta
+    )
+    return VersionUpload(
+        upload_token=upload_token, url=url, upload_id=upload_id, part_urls=part_urls
+    )
+
+
+@router.post(
+    "/{uuid}/versions/upload/finalize",
+    summary="Register a new version from a finished presigned upload",
+    dependencies=[Depends(require_presigned_transfers)],
+)
+async def finalize_version_upload(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    user: Annotated[User, Depends(get_current_user)],
+    uuid: str,
+    upload: VersionUploadFinalize,
+) -> Version:
+    token_data = decode_upload_token(upload.upload_token)
+    if (
+        token_data is None
+        or token_data.asset_id != uuid
+        or token_data.pennkey != user.pennkey
+    ):
+        raise HTTPException(status_code=400, detail="Invalid upload token")
+
+    info = VersionCreate(message=upload.message, is_major=upload.is_major)
+    if token_data.file_key is None:
+        existing_version = await read_version_by_sha256(db, token_data.sha256)
+        if existing_version is None:
+            raise HTTPException(
+                status_code=400, detail="File is no longer stored, please upload it"
+            )
+        return await retry_version_commit(
+            db, copy_version, existing_version, uuid, user.pennkey, info
+        )
+
+    # files with a known hash are shared, so only unhashed uploads are single-use
+    if token_data.sha256 is None and await read_file_key_exists(
+        db, token_data.file_key
+    ):
+        raise HTTPException(status_code=400, detail="Upload already finalized")
+
+    if token_data.upload_id is not None:
+        if not upload.parts:
+            raise HTTPException(status_code=400, detail="Missing uploaded parts")
+        parts = [
+            {"PartNumber": part.part_number, "ETag": part.etag}
+            for part in sorted(upload.parts, key=lambda part: part.part_number)
+        ]
+        try:
+            await run_in_threadpool(
+                complete_multipart_upload,
+                token_data.file_key,
+                token_data.upload_id,
+                parts,
+            )
+        except ClientError:
+            raise HTTPException(status_code=400, detail="Upload could not be completed")
+
+    size = await run_in_threadpool(s3_object_size, token_data.file_key)
+    if size is None:
+        raise HTTPException(status_code=400, detail="File has not been uploaded")
+
+    try:
+        db_version = await retry_version_commit(
+            db,
+            register_version,
+            token_data.file_key,
+            uuid,
+            user.pennkey,
+            info,
+            token_data.sha256,
+            size,
+        )
+    except BaseException:
+        await db.rollback()
+        # keep the file if a version has it, e.g. an identical file uploaded before
+        if not await read_file_key_exists(db, token_data.file_key):
+            await run_in_threadpool(delete_s3_objects, [token_data.file_key])
+        raise
+    if db_version.file_key != token_data.file_key:
+        # an identical file was stored in the meantime, so this copy isn't needed
+        await run_in_threadpool(delete_s3_objects, [token_data.file_key])
+    return db_version
+
+
+@router.get(
+    "/{uuid}/versions/diff",
+    summary="Compare the files of two versions of a given asset",
+    description="""Lists the paths of files added, removed and modified in `to_semver` since `from_semver`.
+
+Together with `/assets/{uuid}/versions/diff/file`, this lets a client holding `from_semver` update to `to_semver` by downloading only the files that changed.""",
+)
+async def get_version_diff(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    versions: Annotated[tuple, Depends(get_versions_to_compare)],
+) -> VersionDiff:
+    return await read_version_diff(db, *versions)
+
+
+@router.get(
+    "/{uuid}/versions/diff/file",
+    summary="Download the files changed between two versions of a given asset",
+    description="""Streams a zip archive of only the files added or modified in `to_semver` since `from_semver`. Removed files are listed by `/assets/{uuid}/versions/diff`.""",
+    responses={
+        200: {
+            "content": {"application/zip": {}},
+            "description": "Download the changed files as a zip archive",
+        },
+    },
+)
+async def download_version_diff_file(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    token: Annotated[str, Depends(oauth2_scheme)],
+    versions: Annotated[tuple, Depends(get_versions_to_compare)],
+) -> StreamingResponse:
+    (chunks, headers) = await read_version_patch(db, *versions)
+    return StreamingResponse(chunks, media_type="application/zip", headers=headers)
+
+
 @router.get(
     "/{uuid}/versions/{semver}/file",
     responses={
         200: {
             "content": {"application/zip": {}},
             "description": "Download the version file as a zip archive",
-        }
+        },
+        206: {
+            "content": {"application/zip": {}},
+            "description": "Download the requested byte range of the version file",
+        },
+        304: {"description": "The client's copy of the version file is up to date"},
+        416: {"description": "Requested range not satisfiable"},
     },
 )
-def download_version_file(
-    db: Annotated[Session, Depends(get_db)],
+async def download_version_file(
+    db: Annotated[AsyncSession, Depends(get_db)],
     token: Annotated[str, Depends(oauth2_scheme)],
-    background_tasks: BackgroundTasks,
     uuid: str,
     semver: str,
-) -> FileResponse:
-    (file_path, cleanup) = read_version_file(db, uuid, semver)
-    background_tasks.add_task(cleanup)
+    range: Annotated[str | None, Header()] = None,
+    if_range: Annotated[str | None, Header()] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> StreamingResponse:
+    (chunks, headers) = await read_version_file(
+        db, uuid, semver, range, if_range, if_none_match
+    )
 
-    if file_path is None:
+    if chunks is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(
-        path=file_path,
+    return StreamingResponse(
+        chunks,
+        status_code=206 if "Content-Range" in headers else 200,
         media_type="application/zip",
+        headers=headers,
     )
+
+
+@router.get(
+    "/{uuid}/versions/{semver}/file/url",
+    summary="Get a presigned URL to download a version file directly from S3",
+    dependencies=[Depends(require_presigned_transfers)],
+)
+async def get_version_file_url(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    token: Annotated[str, Depends(oauth2_scheme)],
+    uuid: str,
+    semver: str,
+) -> VersionDownload:
+    version = await read_version(db, uuid, semver)
+    if version is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    if version.file_key is None:
+        # the archive only exists once reassembled from its individual files
+        raise HTTPException(
+            status_code=400,
+            detail="Version can only be downloaded from /assets/{uuid}/versions/{semver}/file",
+        )
+
+    return VersionDownload(url=presign_download(version.file_key))
@@ -0,0 +1,67 @@
+import time
+from typing import Annotated
+from fastapi import APIRouter, Depends
+
+from database.connection import async_engine, replicas
+from database.pool import MeasuredQueuePool
+from schemas.models import CacheStatus, PoolStatus, ReplicaPoolStatus
+from util.auth import oauth2_scheme
+from util.cache import RedisBackend
+from util.crud.assets import asset_cache
+
+router = APIRouter(
+    prefix="/status",
+    tags=["status"],
+)
+
+
+def read_pool_status(pool: MeasuredQueuePool):
+    """
+    Returns:
+        dict: The fields of a `ConnectionPoolStatus` for `pool`.
+    """
+    return dict(
+        pool_size=pool.size(),
+        checked_out=pool.checkedout(),
+        overflow=max(pool.overflow(), 0),
+        checkouts=pool.stats.checkouts,
+        wait_seconds=pool.stats.wait_seconds,
+        max_wait_seconds=pool.stats.max_wait_seconds,
+        overflows=pool.stats.overflows,
+        timeouts=pool.stats.timeouts,
+    )
+
+
+@router.get(
+    "/pool",
+    summary="Get database connection pool stats",
+    description="""Reports the connections of this worker's database pool in use, and totals of checkouts, time spent waiting for a connection, connections opened beyond the pool size and checkouts that timed out since the worker started. The same is reported for the pool of each read replica in `replicas`, along with whether the replica is currently skipped after failing to connect.
+
+Each worker has its own pools, so the `max_connections` of postgres (and of each replica) must allow for `pool_size` plus `DATABASE_MAX_OVERFLOW` connections per worker.""",
+)
+def get_pool_status(token: Annotated[str, Depends(oauth2_scheme)]) -> PoolStatus:
+    now = time.monotonic()
+    return PoolStatus(
+        **read_pool_status(async_engine.pool),
+        replicas=[
+            ReplicaPoolStatus(
+                **read_pool_status(replica.engine.pool),
+                url=replica.engine.url.render_as_string(hide_password=True),
+                healthy=replica.unhealthy_until <= now,
+            )
+            for replica in replicas
+        ],
+    )
+
+
+@router.get(
+    "/cache",
+    summary="Get browsing and search cache stats",
+    description="""Reports whether cached results of browsing and searching assets are kept in this worker's memory or shared through redis, and how many reads this worker found cached (hits) or had to make (misses) since it started.""",
+)
+def get_cache_status(token: Annotated[str, Depends(oauth2_scheme)]) -> CacheStatus:
+    return CacheStatus(
+        backend="redis" if isinstance(asset_cache.backend, RedisBackend) else "memory",
+        hits=asset_cache.hits,
+        misses=asset_cache.misses,
+    )
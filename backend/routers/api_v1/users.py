@@ -6,21 +6,30 @@ from fastapi import (
     HTTPException,
 )
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from util.auth import create_access_token, get_current_user
+from util.auth import (
+    create_access_token,
+    create_refresh_token,
+    decode_refresh_token,
+    get_current_user,
+)
 from util.crud.users import (
     authenticate_user,
+    create_refresh_token_family,
     create_user,
     read_user_exists,
     read_user,
     read_users,
+    rotate_refresh_token,
 )
-from database.connection import get_db
-from schemas.models import UserCreate, User, Token
+from database.connection import get_db, get_read_db
+from database.models import RefreshTokenFamily
+from schemas.models import UserCreate, User, Token, TokenRefresh
 
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = 30
 
 
 router = APIRouter(
@@ -30,30 +39,47 @@ router = APIRouter(
 )
 
 
+def create_tokens(pennkey: str, family: RefreshTokenFamily):
+    access_token = create_access_token(
+        data={"sub": pennkey},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    refresh_token = create_refresh_token(
+        family.id,
+        family.generation,
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    return Token(
+        access_token=access_token, token_type="bearer", refresh_token=refresh_token
+    )
+
+
 @router.get(
     "/",
     summary="Get a list of users",
     description="Fetches a list of users from the database. Optionally, add a search parameter to filter results.",
 )
-def get_users(
-    db: Annotated[Session, Depends(get_db)],
+async def get_users(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
     query: str | None = None,
     offset: int = 0,
 ) -> Sequence[User]:
-    return read_users(db, query=query, offset=offset)
+    return await read_users(db, query=query, offset=offset)
 
 
 @router.post(
     "/",
     summary="Create a new user in the database",
 )
-async def new_user(user: UserCreate, db: Annotated[Session, Depends(get_db)]) -> User:
+async def new_user(
+    user: UserCreate, db: Annotated[AsyncSession, Depends(get_db)]
+) -> User:
     # make sure user doesn't already exist
-    if read_user_exists(db, user.pennkey):
+    if await read_user_exists(db, user.pennkey):
         raise HTTPException(400, "User already exists")
 
     try:
-        result = create_user(db, user)
+        result = await create_user(db, user)
         if result is None:
             raise HTTPException(status_code=400, detail="User could not be created")
     except Exception as e:
@@ -67,22 +93,42 @@ async def new_user(user: UserCreate, db: Annotated[Session, Depends(get_db)]) ->
     "/token",
     summary="Login with PennKey and password",
 )
-def login_for_access_token(
+async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
 ) -> Token:
     # authenticate user
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if user is None:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    # create JWT access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.pennkey}, expires_delta=access_token_expires
+    # create JWT access and refresh tokens, the latter starting a new family
+    family = await create_refresh_token_family(
+        db, user, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     )
+    return create_tokens(user.pennkey, family)
+
+
+@router.post(
+    "/token/refresh",
+    summary="Exchange a refresh token for new tokens",
+    description="""Returns a new access token and refresh token for the `refresh_token` returned when logging in (or last refreshing), so clients stay logged in without sending the password again. Each refresh token can be used once, though it can be exchanged again for the latest tokens for a few seconds after, so concurrent refreshes from one client all succeed. Reusing it later logs out the login it came from. Refreshing doesn't affect the user's other logins, but changing the password logs out all of them.""",
+)
+async def refresh_access_token(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    body: TokenRefresh,
+) -> Token:
+    token_data = decode_refresh_token(body.refresh_token)
+    if token_data is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
 
-    return Token(access_token=access_token, token_type="bearer")
+    # fails for users that no longer exist, and for tokens that were used or
+    # revoked already
+    family = await rotate_refresh_token(db, *token_data)
+    if family is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    return create_tokens(family.pennkey, family)
 
 
 @router.get(
@@ -101,8 +147,10 @@ def read_users_me(
     summary="Get info about a specific user",
     description="Based on `pennkey`, fetches information on a specific user.",
 )
-def get_user_info(db: Annotated[Session, Depends(get_db)], pennkey: str) -> User:
-    result = read_user(db, pennkey)
+async def get_user_info(
+    db: Annotated[AsyncSession, Depends(get_db)], pennkey: str
+) -> User:
+    result = await read_user(db, pennkey)
     if result is None:
         raise HTTPException(status_code=404, detail="User not found")
     return result
@@ -1,8 +1,13 @@
 from typing import Literal, Optional
 from uuid import UUID
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 
+SHA256_PATTERN = "^[0-9a-fA-F]{64}$"
+
+# most assets or versions fetched by one batch request
+MAX_BATCH_SIZE = 500
+
 
 class AssetBase(BaseModel):
     asset_name: str
@@ -17,11 +22,30 @@ class AssetCreate(AssetBase):
 class Asset(AssetBase):
     id: UUID
     author_pennkey: str
+    latest_version_date: datetime
+    latest_semver: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class KeywordCount(BaseModel):
+    keyword: str
+    count: int
 
     class Config:
         from_attributes = True
 
 
+class AssetBatchGet(BaseModel):
+    ids: list[UUID] = Field(max_length=MAX_BATCH_SIZE)
+
+
+class AssetNameSuggestion(BaseModel):
+    id: UUID
+    asset_name: str
+
+
 class VersionBase(BaseModel):
     message: str
 
@@ -30,16 +54,76 @@ class VersionCreate(VersionBase):
     is_major: bool
 
 
+class VersionUploadStart(BaseModel):
+    # leave unset for a single PUT, otherwise the number of multipart parts
+    part_count: int | None = None
+    # hex sha256 of the file, which lets identical files skip the upload
+    sha256: str | None = Field(default=None, pattern=SHA256_PATTERN)
+
+
+class VersionUpload(BaseModel):
+    upload_token: str
+    # unset if an identical file is already stored and nothing needs uploading
+    url: str | None = None
+    upload_id: str | None = None
+    part_urls: list[str] = []
+
+
+class VersionUploadPart(BaseModel):
+    part_number: int
+    etag: str
+
+
+class VersionUploadFinalize(VersionCreate):
+    upload_token: str
+    parts: list[VersionUploadPart] | None = None
+
+
+class VersionDownload(BaseModel):
+    url: str
+
+
+class VersionDiff(BaseModel):
+    from_semver: str
+    to_semver: str
+    # paths of files only in `to_semver`, only in `from_semver`, and in both but
+    # with different contents
+    added: list[str]
+    removed: list[str]
+    modified: list[str]
+
+
 class Version(VersionBase):
     asset_id: UUID
     semver: str
     author_pennkey: str
     date: datetime
+    sha256: Optional[str] = None
 
     class Config:
         from_attributes = True
 
 
+class VersionRef(BaseModel):
+    asset_id: UUID
+    semver: str
+
+
+class VersionBatchGet(BaseModel):
+    versions: list[VersionRef] = Field(max_length=MAX_BATCH_SIZE)
+
+
+class AssetExport(BaseModel):
+    # assets matching a search and keywords, as in GET /assets/
+    search: Optional[str] = None
+    keywords: Optional[str] = None
+    keywords_mode: Literal["all", "any"] = "all"
+    # and assets given by id
+    ids: list[UUID] = Field([], max_length=MAX_BATCH_SIZE)
+    # versions to export instead of the latest, whose assets are exported too
+    versions: list[VersionRef] = Field([], max_length=MAX_BATCH_SIZE)
+
+
 # User class
 class UserBase(BaseModel):
     pennkey: str
@@ -60,7 +144,53 @@ class User(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
     pennkey: str | None = None
+
+
+class UploadTokenData(BaseModel):
+    pennkey: str
+    asset_id: str
+    # unset if an identical version exists, so nothing needs to be uploaded
+    file_key: str | None = None
+    upload_id: str | None = None
+    sha256: str | None = None
+
+
+class ConnectionPoolStatus(BaseModel):
+    # size of the pool, and the connections now in use and opened beyond it
+    pool_size: int
+    checked_out: int
+    overflow: int
+    # totals since the worker started
+    checkouts: int
+    wait_seconds: float
+    max_wait_seconds: float
+    overflows: int
+    timeouts: int
+
+
+class ReplicaPoolStatus(ConnectionPoolStatus):
+    # without its password
+    url: str
+    # false while the replica is skipped after failing to connect
+    healthy: bool
+
+
+class PoolStatus(ConnectionPoolStatus):
+    # the primary's pool, and those of the read replicas
+    replicas: list[ReplicaPoolStatus]
+
+
+class CacheStatus(BaseModel):
+    backend: Literal["memory", "redis"]
+    # totals since the worker started
+    hits: int
+    misses: int
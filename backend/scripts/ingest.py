@@ -0,0 +1,336 @@
+"""
+Bulk import: adds a back-catalogue of asset folders as assets with a single
+version each, without going through the API one asset at a time.
+
+Asset folders are either listed in a JSON manifest, e.g.
+
+    [{"path": "props/redChair", "asset_name": "redChair", "keywords": "chair,red"}]
+
+with paths relative to the manifest, or found by walking a directory: every
+folder holding files (outside of another such folder) is an asset, named after
+the folder and with the folders above it as keywords. For example:
+
+    python -m scripts.ingest ~/catalogue --author jdoe
+
+Folders are zipped by a pool of processes and uploaded by a pool of threads,
+and each batch of assets is inserted in one transaction with `COPY`. Assets are
+identified by their folder's path, so an interrupted import can be run again
+to pick up where it stopped.
+
+Versions are stored as whole archives (like presigned uploads), so they can be
+downloaded but not compared until a new version is uploaded through the API.
+"""
+
+import argparse
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import csv
+from dataclasses import dataclass
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+from uuid import UUID, uuid5
+import zipfile
+
+from psycopg2.extras import execute_values
+
+from database.connection import engine
+from util.crud.assets import parse_keywords
+from util.s3 import assets_bucket
+
+# asset ids are derived from this and the folder's path, so importing the same
+# folder again finds the asset it was imported as
+INGEST_NAMESPACE = UUID("6f1c3a52-93b4-4c1e-8d0a-2b7e5f9c4a17")
+
+# size of the chunks archives are hashed in
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class AssetFolder:
+    path: Path
+    # relative to the catalogue, identifying the asset
+    key: str
+    asset_name: str
+    keywords: str
+
+    @property
+    def asset_id(self) -> UUID:
+        return uuid5(INGEST_NAMESPACE, self.key)
+
+
+@dataclass
+class Archive:
+    path: str
+    sha256: str
+    size: int
+
+
+def find_asset_folders(root: Path) -> list[AssetFolder]:
+    folders = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if not filenames or Path(dirpath) == root:
+            continue
+        # everything below a folder with files belongs to its asset
+        dirnames.clear()
+        relative = Path(dirpath).relative_to(root)
+        folders.append(
+            AssetFolder(
+                path=Path(dirpath),
+                key=relative.as_posix(),
+                asset_name=relative.name,
+                keywords=",".join(relative.parent.parts),
+            )
+        )
+    return folders
+
+
+def read_manifest(manifest: Path) -> list[AssetFolder]:
+    entries = json.loads(manifest.read_text())
+    return [
+        AssetFolder(
+            path=manifest.parent / entry["path"],
+            key=Path(entry["path"]).as_posix(),
+            asset_name=entry.get("asset_name") or Path(entry["path"]).name,
+            keywords=entry.get("keywords") or "",
+        )
+        for entry in entries
+    ]
+
+
+def zip_folder(folder: Path, out_dir: str) -> Archive:
+    """
+    Zips a folder into a new file in `out_dir`. Runs in a worker process.
+    """
+    (fd, path) = tempfile.mkstemp(suffix=".zip", dir=out_dir)
+    with os.fdopen(fd, "wb") as file:
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as archive:
+            for dirpath, dirnames, filenames in os.walk(folder):
+                # sorted, so the same files always make the same archive
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    file_path = Path(dirpath) / filename
+                    archive.write(file_path, file_path.relative_to(folder).as_posix())
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return Archive(path=path, sha256=sha256.hexdigest(), size=os.path.getsize(path))
+
+
+def read_imported_ids(connection, asset_ids: list[UUID]) -> set[UUID]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT id FROM assets WHERE id = ANY(%s::uuid[])",
+            ([str(asset_id) for asset_id in asset_ids],),
+        )
+        return {UUID(str(row[0])) for row in cursor.fetchall()}
+
+
+def read_stored_blobs(connection, sha256s: list[str]) -> set[str]:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sha256 FROM blobs WHERE sha256 = ANY(%s)", (sha256s,))
+        return {row[0] for row in cursor.fetchall()}
+
+
+def copy_rows(cursor, table: str, columns: list[str], rows: list[list]):
+    data = io.StringIO()
+    csv.writer(data).writerows(rows)
+    data.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", data
+    )
+
+
+def insert_batch(
+    connection,
+    folders: list[AssetFolder],
+    archives: list[Archive],
+    author_pennkey: str,
+    message: str,
+):
+    """
+    Inserts a batch of assets with their first versions, referencing their
+    archives as blobs, in one transaction.
+    """
+    blob_refs: dict[str, list] = {}
+    for archive in archives:
+        (_, size, count) = blob_refs.get(archive.sha256, (None, archive.size, 0))
+        blob_refs[archive.sha256] = [f"blobs/{archive.sha256}", size, count + 1]
+
+    with connection.cursor() as cursor:
+        # identical archives share a blob, which may have been stored already
+        file_keys = dict(
+            execute_values(
+                cursor,
+                "INSERT INTO blobs (sha256, file_key, size, ref_count) VALUES %s"
+                " ON CONFLICT (sha256) DO UPDATE"
+                " SET ref_count = blobs.ref_count + EXCLUDED.ref_count"
+                " RETURNING sha256, file_key",
+                [[sha256, *values] for sha256, values in blob_refs.items()],
+                fetch=True,
+            )
+        )
+
+        copy_rows(
+            cursor,
+            "assets",
+            [
+                "id",
+                "asset_name",
+                "author_pennkey",
+                "keywords",
+                "latest_version_date",
+                "latest_semver",
+            ],
+            [
+                [folder.asset_id, folder.asset_name, author_pennkey, folder.keywords]
+                + ["now", "0.1"]
+                for folder in folders
+            ],
+        )
+        copy_rows(
+            cursor,
+            "asset_keywords",
+            ["asset_id", "keyword"],
+            [
+                [folder.asset_id, keyword]
+                for folder in folders
+                for keyword in parse_keywords(folder.keywords)
+            ],
+        )
+        copy_rows(
+            cursor,
+            "versions",
+            [
+                "asset_id",
+                "semver",
+                "major",
+                "minor",
+                "author_pennkey",
+                "date",
+                "message",
+                "file_key",
+                "sha256",
+            ],
+            [
+                [folder.asset_id, "0.1", 0, 1, author_pennkey, "now", message]
+                + [file_keys[archive.sha256], archive.sha256]
+                for folder, archive in zip(folders, archives)
+            ],
+        )
+    connection.commit()
+
+
+def ingest_batch(
+    connection,
+    folders: list[AssetFolder],
+    zippers: ProcessPoolExecutor,
+    uploaders: ThreadPoolExecutor,
+    out_dir: str,
+    args,
+) -> int:
+    """
+    Zips, uploads and inserts a batch of assets.
+
+    Returns:
+        int: The total size of the batch's archives.
+    """
+    archives = list(
+        zippers.map(
+            zip_folder, [folder.path for folder in folders], [out_dir] * len(folders)
+        )
+    )
+    try:
+        # archives already stored (e.g. before an interruption) aren't uploaded again
+        stored = read_stored_blobs(
+            connection, list({archive.sha256 for archive in archives})
+        )
+        uploads = {
+            archive.sha256: archive.path
+            for archive in archives
+            if archive.sha256 not in stored
+        }
+        (done, _) = wait(
+            [
+                uploaders.submit(assets_bucket.upload_file, path, f"blobs/{sha256}")
+                for sha256, path in uploads.items()
+            ],
+            return_when=FIRST_EXCEPTION,
+        )
+        for future in done:
+            future.result()
+
+        insert_batch(connection, folders, archives, args.author, args.message)
+    finally:
+        for archive in archives:
+            os.remove(archive.path)
+    return sum(archive.size for archive in archives)
+
+
+def run(args):
+    source = Path(args.source)
+    if source.is_file():
+        folders = read_manifest(source)
+    else:
+        folders = find_asset_folders(source)
+
+    connection = engine.raw_connection()
+    try:
+        imported = read_imported_ids(
+            connection, [folder.asset_id for folder in folders]
+        )
+        pending = [folder for folder in folders if folder.asset_id not in imported]
+        print(
+            f"{len(folders)} assets found, {len(folders) - len(pending)} already imported"
+        )
+
+        started = time.monotonic()
+        (count, size) = (0, 0)
+        with ProcessPoolExecutor(args.zip_workers) as zippers, ThreadPoolExecutor(
+            args.upload_workers
+        ) as uploaders, tempfile.TemporaryDirectory() as out_dir:
+            for i in range(0, len(pending), args.batch_size):
+                batch = pending[i : i + args.batch_size]
+                size += ingest_batch(
+                    connection, batch, zippers, uploaders, out_dir, args
+                )
+                count += len(batch)
+                elapsed = time.monotonic() - started
+                print(
+                    f"{count}/{len(pending)} assets imported,"
+                    f" {count / elapsed:.1f} assets/s,"
+                    f" {size / elapsed / 1e6:.1f} MB/s"
+                )
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "source", help="directory of asset folders, or a JSON manifest of them"
+    )
+    parser.add_argument(
+        "--author", required=True, help="pennkey the assets are imported as"
+    )
+    parser.add_argument("--message", default="Imported", help="message of versions")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--zip-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--upload-workers", type=int, default=8)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,3 +19,49 @@ if DATABASE_URL == "unset":
 SECRET_KEY = os.getenv("SECRET_KEY") or "unset"
 if SECRET_KEY == "unset":
     raise Exception("SECRET_KEY is not set")
+
+# tokens are signed with SECRET_KEY using this algorithm
+ALGORITHM = "HS256"
+
+# Opt-in: hand out presigned S3 URLs so version files skip the API server
+PRESIGNED_TRANSFERS = os.getenv("PRESIGNED_TRANSFERS") == "true"
+PRESIGNED_URL_EXPIRE_SECONDS = int(os.getenv("PRESIGNED_URL_EXPIRE_SECONDS") or 3600)
+
+# Connection pool of each worker, so workers * (size + overflow) connections must
+# fit in postgres' max_connections. Connections are checked before use and
+# replaced after DATABASE_POOL_RECYCLE seconds (-1 to keep them).
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE") or 5)
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW") or 10)
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT") or 30)
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE") or 1800)
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING") != "false"
+# Set when connecting through PgBouncer in transaction mode, which can't keep
+# prepared statements between transactions
+DATABASE_PGBOUNCER = os.getenv("DATABASE_PGBOUNCER") == "true"
+
+# Optional comma-separated read replicas of DATABASE_URL, which browsing and
+# search are spread over. A replica that can't be connected to is skipped for
+# DATABASE_REPLICA_RETRY_SECONDS, and a client's reads go to the primary for
+# READ_YOUR_WRITES_SECONDS after it writes, so replication lag doesn't hide it.
+# With more than one worker, set CACHE_REDIS_URL so all of them know of writes.
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in (os.getenv("DATABASE_REPLICA_URLS") or "").split(",")
+    if url.strip() != ""
+]
+DATABASE_REPLICA_RETRY_SECONDS = float(
+    os.getenv("DATABASE_REPLICA_RETRY_SECONDS") or 30
+)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS") or 5)
+
+# Passwords are hashed by a pool of this many processes, so logins can't starve
+# requests of CPU, with 2^BCRYPT_ROUNDS iterations (existing hashes keep theirs)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or 2)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS") or 12)
+
+# Browsing and search results are cached for RESPONSE_CACHE_SECONDS, in each
+# process (up to RESPONSE_CACHE_SIZE of them) or, to share them between
+# processes, in redis at CACHE_REDIS_URL
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE") or 1024)
+RESPONSE_CACHE_SECONDS = float(os.getenv("RESPONSE_CACHE_SECONDS") or 30)
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL") or None
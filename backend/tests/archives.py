@@ -0,0 +1,35 @@
+import io
+import zipfile
+
+
+class Unseekable(io.RawIOBase):
+    """
+    A write-only stream, which makes `zipfile` write data descriptors as a
+    streaming zip writer would.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+
+def make_archive(
+    files: dict[str, bytes],
+    compression: int = zipfile.ZIP_DEFLATED,
+    streamed: bool = False,
+    force_zip64: bool = False,
+) -> bytes:
+    stream = Unseekable() if streamed else io.BytesIO()
+    with zipfile.ZipFile(stream, "w", compression) as archive:
+        for path, data in files.items():
+            info = zipfile.ZipInfo(path, date_time=(2024, 5, 17, 12, 30, 0))
+            info.compress_type = compression
+            with archive.open(info, "w", force_zip64=force_zip64) as file:
+                file.write(data)
+    return bytes(stream.buffer) if streamed else stream.getvalue()
@@ -0,0 +1,170 @@
+import threading
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import util.chunks
+import util.files
+
+
+class FakeBody:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def iter_chunks(self, chunk_size: int):
+        for i in range(0, len(self._data), chunk_size):
+            yield self._data[i : i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeObject:
+    def __init__(self, bucket: "FakeBucket", key: str):
+        self._bucket = bucket
+        self._key = key
+
+    def get(self, Range: str | None = None):
+        data = self._bucket.objects[self._key]
+        if Range is not None:
+            (first, last) = Range.removeprefix("bytes=").split("-")
+            data = data[int(first) : int(last) + 1]
+        self._bucket.gets.append((self._key, Range))
+        return {"Body": FakeBody(data), "ContentLength": len(data)}
+
+
+class FakeClient:
+    def __init__(self, bucket: "FakeBucket"):
+        self._bucket = bucket
+        self._uploads: dict[str, dict[int, bytes]] = {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes):
+        with self._bucket.lock:
+            self._bucket.objects[Key] = bytes(Body)
+
+    def create_multipart_upload(self, Bucket: str, Key: str):
+        upload_id = f"upload-{len(self._uploads)}"
+        self._uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._bucket.lock:
+            self._uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self._uploads.pop(UploadId)
+        self.put_object(
+            Bucket,
+            Key,
+            b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"]),
+        )
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._uploads.pop(UploadId, None)
+
+
+class FakeMeta:
+    def __init__(self, client: FakeClient):
+        self.client = client
+
+
+class FakeBucket:
+    """
+    Just enough of a boto3 bucket for storing and reading chunks, in memory.
+    """
+
+    name = "griddle-assets"
+
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+        # the key and range of every read, in order
+        self.gets: list[tuple[str, str | None]] = []
+        self.lock = threading.Lock()
+        self.meta = FakeMeta(FakeClient(self))
+
+    def Object(self, key: str):
+        return FakeObject(self, key)
+
+    def delete_objects(self, Delete: dict):
+        for item in Delete["Objects"]:
+            self.objects.pop(item["Key"], None)
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    bucket = FakeBucket()
+    monkeypatch.setattr(util.files, "assets_bucket", bucket)
+    monkeypatch.setattr(util.chunks, "assets_bucket", bucket)
+    return bucket
+
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    The app, migrated and running against the database in DATABASE_URL, which
+    should be a scratch one. Tests using it are skipped without a database.
+    """
+    from database.connection import engine
+
+    try:
+        with engine.connect():
+            pass
+    except OperationalError:
+        pytest.skip("no database at DATABASE_URL")
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def pennkey(client):
+    pennkey = f"test-{uuid4().hex[:8]}"
+    response = client.post(
+        "/api/v1/users/",
+        json={
+            "pennkey": pennkey,
+            "first_name": "Test",
+            "last_name": "User",
+            "school": "seas",
+            "password": "password",
+        },
+    )
+    assert response.status_code == 200
+    return pennkey
+
+
+@pytest.fixture(scope="session")
+def headers(client, pennkey):
+    response = client.post(
+        "/api/v1/users/token", data={"username": pennkey, "password": "password"}
+    )
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def make_asset(client, headers):
+    """
+    Returns:
+        function: Creates an asset with a unique name (starting with the given
+        one), returning its id.
+    """
+
+    def make_asset(name: str = "testAsset", keywords: str = "test"):
+        response = client.post(
+            "/api/v1/assets/",
+            json={
+                "asset_name": f"{name}{uuid4().hex[:8]}",
+                "keywords": keywords,
+                "image_uri": None,
+            },
+            headers=headers,
+        )
+        assert response.status_code == 200
+        return response.json()["id"]
+
+    return make_asset
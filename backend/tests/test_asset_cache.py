@@ -0,0 +1,85 @@
+from util.crud.assets import asset_cache
+
+
+def counts():
+    return (asset_cache.hits, asset_cache.misses)
+
+
+def test_write_invalidates_only_its_asset(client, headers, make_asset):
+    (first, second) = (make_asset("cachedFirst"), make_asset("cachedSecond"))
+    reads = [
+        f"/api/v1/assets/{first}",
+        f"/api/v1/assets/{first}/versions",
+        f"/api/v1/assets/{second}",
+        f"/api/v1/assets/{second}/versions",
+        "/api/v1/assets/?search=cached",
+    ]
+    for path in reads:
+        assert client.get(path).status_code == 200
+
+    before = counts()
+    for path in reads:
+        client.get(path)
+    assert counts() == (before[0] + len(reads), before[1])
+
+    response = client.put(
+        f"/api/v1/assets/{first}",
+        json={"asset_name": "cachedRenamed", "keywords": "test", "image_uri": None},
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+    # the second asset's entries are still cached; the first's and the listing
+    # are read again
+    before = counts()
+    assert client.get(f"/api/v1/assets/{second}").status_code == 200
+    assert client.get(f"/api/v1/assets/{second}/versions").status_code == 200
+    assert counts() == (before[0] + 2, before[1])
+    info = client.get(f"/api/v1/assets/{first}").json()
+    assert info["asset"]["asset_name"] == "cachedRenamed"
+    client.get(f"/api/v1/assets/{first}/versions")
+    page = client.get("/api/v1/assets/?search=cached").json()
+    assert "cachedRenamed" in [asset["asset_name"] for asset in page]
+    assert counts() == (before[0] + 2, before[1] + 3)
+
+
+def test_if_none_match(client, headers, make_asset):
+    asset_id = make_asset("etag")
+    response = client.get(f"/api/v1/assets/{asset_id}")
+    etag = response.headers["ETag"]
+
+    for path in [f"/api/v1/assets/{asset_id}", "/api/v1/assets/"]:
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+    response = client.get(
+        f"/api/v1/assets/{asset_id}", headers={"If-None-Match": '"other", ' + etag}
+    )
+    assert response.status_code == 304
+    response = client.get(
+        f"/api/v1/assets/{asset_id}", headers={"If-None-Match": '"other"'}
+    )
+    assert response.status_code == 200
+
+    # any change to assets makes the copy stale
+    make_asset("etagOther")
+    response = client.get(f"/api/v1/assets/{asset_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_if_modified_since(client, make_asset):
+    asset_id = make_asset("modified")
+    response = client.get(f"/api/v1/assets/{asset_id}")
+    modified = response.headers["Last-Modified"]
+
+    response = client.get(
+        f"/api/v1/assets/{asset_id}", headers={"If-Modified-Since": modified}
+    )
+    assert response.status_code == 304
+    response = client.get(
+        f"/api/v1/assets/{asset_id}",
+        headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"},
+    )
+    assert response.status_code == 200
@@ -0,0 +1,88 @@
+from uuid import uuid4
+
+from schemas.models import MAX_BATCH_SIZE
+from tests.archives import make_archive
+
+
+def commit_version(client, headers, asset_id: str):
+    response = client.post(
+        f"/api/v1/assets/{asset_id}/versions/stream",
+        params={"message": "batch"},
+        content=make_archive({"asset.txt": uuid4().bytes}),
+        headers=headers,
+    )
+    assert response.status_code == 200
+    return response.json()["semver"]
+
+
+def test_batch_get(client, make_asset):
+    ids = [make_asset("batch") for _ in range(3)]
+    # in the order given, with a duplicate fetched once
+    requested = [ids[2], ids[0], ids[2], ids[1]]
+    response = client.post("/api/v1/assets/batch-get", json={"ids": requested})
+    assert response.status_code == 200
+    info = response.json()
+    assert list(info) == [ids[2], ids[0], ids[1]]
+    for asset_id in ids:
+        assert info[asset_id] == client.get(f"/api/v1/assets/{asset_id}").json()
+
+    response = client.post("/api/v1/assets/batch-get", json={"ids": []})
+    assert (response.status_code, response.json()) == (200, {})
+
+
+def test_batch_get_missing(client, make_asset):
+    response = client.post(
+        "/api/v1/assets/batch-get", json={"ids": [make_asset("batch"), str(uuid4())]}
+    )
+    assert response.status_code == 404
+
+
+def test_batch_get_limit(client):
+    ids = [str(uuid4()) for _ in range(MAX_BATCH_SIZE + 1)]
+    response = client.post("/api/v1/assets/batch-get", json={"ids": ids})
+    assert response.status_code == 422
+
+
+def test_versions_batch_get(client, bucket, headers, make_asset):
+    (first, second) = (make_asset("batch"), make_asset("batch"))
+    (one, two) = (commit_version(client, headers, first) for _ in range(2))
+    other = commit_version(client, headers, second)
+    refs = [
+        {"asset_id": second, "semver": other},
+        {"asset_id": first, "semver": two},
+        {"asset_id": second, "semver": other},
+        {"asset_id": first, "semver": one},
+    ]
+    response = client.post("/api/v1/assets/versions/batch-get", json={"versions": refs})
+    assert response.status_code == 200
+    versions = response.json()
+    assert [(asset_id, list(semvers)) for (asset_id, semvers) in versions.items()] == [
+        (second, [other]),
+        (first, [two, one]),
+    ]
+    for ref in refs:
+        version = versions[ref["asset_id"]][ref["semver"]]
+        assert (version["asset_id"], version["semver"]) == (
+            ref["asset_id"],
+            ref["semver"],
+        )
+
+
+def test_versions_batch_get_missing(client, bucket, headers, make_asset):
+    asset_id = make_asset("batch")
+    semver = commit_version(client, headers, asset_id)
+    for missing in [
+        {"asset_id": asset_id, "semver": "9.9"},
+        {"asset_id": str(uuid4()), "semver": semver},
+    ]:
+        refs = [{"asset_id": asset_id, "semver": semver}, missing]
+        response = client.post(
+            "/api/v1/assets/versions/batch-get", json={"versions": refs}
+        )
+        assert response.status_code == 404
+
+
+def test_versions_batch_get_limit(client):
+    refs = [{"asset_id": str(uuid4()), "semver": "0.1"}] * (MAX_BATCH_SIZE + 1)
+    response = client.post("/api/v1/assets/versions/batch-get", json={"versions": refs})
+    assert response.status_code == 422
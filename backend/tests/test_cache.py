@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+from pydantic import TypeAdapter
+
+from util.cache import MemoryBackend, ReadThroughCache, RedisBackend, TTLCache
+
+ADAPTER = TypeAdapter(str)
+
+
+class Loads:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, value):
+        async def load():
+            self.count += 1
+            return value
+
+        return load
+
+
+def test_ttl_cache(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("util.cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(2, 10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    # the least recently used is dropped first
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    now[0] = 10
+    assert cache.get("a") is None
+
+
+def test_read_through():
+    cache = ReadThroughCache(MemoryBackend(100, 60))
+    loads = Loads()
+
+    async def run():
+        assert await cache.read(["a"], "key", ADAPTER, loads("one")) == "one"
+        assert await cache.read(["a"], "key", ADAPTER, loads("two")) == "one"
+        assert await cache.read(["a"], "other", ADAPTER, loads("three")) == "three"
+
+    asyncio.run(run())
+    assert (loads.count, cache.hits, cache.misses) == (2, 1, 2)
+
+
+def test_invalidate_only_its_namespaces():
+    cache = ReadThroughCache(MemoryBackend(100, 60))
+    loads = Loads()
+
+    async def run():
+        await cache.read(["assets"], "page", ADAPTER, loads("page"))
+        await cache.read(["asset:1"], "info 1", ADAPTER, loads("info 1"))
+        await cache.read(["asset:2"], "info 2", ADAPTER, loads("info 2"))
+        await cache.invalidate("assets", "asset:1")
+        return [
+            await cache.read(["assets"], "page", ADAPTER, loads("new page")),
+            await cache.read(["asset:1"], "info 1", ADAPTER, loads("new info 1")),
+            await cache.read(["asset:2"], "info 2", ADAPTER, loads("new info 2")),
+        ]
+
+    assert asyncio.run(run()) == ["new page", "new info 1", "info 2"]
+    assert loads.count == 5
+
+
+def test_none_is_not_cached():
+    cache = ReadThroughCache(MemoryBackend(100, 60))
+    loads = Loads()
+
+    async def run():
+        await cache.read(["a"], "key", ADAPTER, loads(None))
+        await cache.read(["a"], "key", ADAPTER, loads(None))
+
+    asyncio.run(run())
+    assert loads.count == 2
+
+
+def test_unreachable_redis(caplog):
+    loads = Loads()
+
+    async def run():
+        cache = ReadThroughCache(RedisBackend("redis://127.0.0.1:1", 60))
+        try:
+            await cache.invalidate("a")
+            return [
+                await cache.read(["a"], "key", ADAPTER, loads("one")),
+                await cache.read(["a"], "key", ADAPTER, loads("two")),
+            ]
+        finally:
+            await cache.close()
+
+    with caplog.at_level(logging.WARNING, logger="util.cache"):
+        # every read is a miss, and the errors are logged
+        assert asyncio.run(run()) == ["one", "two"]
+    assert loads.count == 2
+    assert len(caplog.records) == 3
+    assert all(record.exc_info for record in caplog.records)
@@ -0,0 +1,180 @@
+from datetime import datetime
+import hashlib
+import io
+import os
+import zipfile
+
+from fastapi import HTTPException
+import pytest
+
+from tests.archives import make_archive
+from util.chunks import (
+    SMALL_FILE_SIZE,
+    ChunkedArchiveUpload,
+    stream_chunked_archive,
+    stream_chunked_zip,
+)
+
+FILES = {
+    "model.obj": b"v 0 0 0\n" * 5000,
+    "textures/noise.bin": os.urandom(50000),
+    "textures/copy.bin": b"v 0 0 0\n" * 5000,
+    "empty.txt": b"",
+}
+
+ETAG = '"etag"'
+DATE = datetime(2024, 5, 17, 12, 30)
+
+
+def upload(archive: bytes, stored: set[str] = set(), piece_size: int = 1000):
+    chunks = ChunkedArchiveUpload(lambda sha256s: stored & set(sha256s))
+    for i in range(0, len(archive), piece_size):
+        chunks.write(archive[i : i + piece_size])
+    chunks.complete()
+    return chunks
+
+
+def segments_of(chunks: ChunkedArchiveUpload, file_keys: dict[str, str]):
+    """
+    Returns:
+        list: The segments the archive is reassembled from, as stored in the
+        database by `register_chunked_version`.
+    """
+    segments = []
+    for file in chunks.files:
+        segments.append(file.header)
+        segments.append((file_keys[file.chunk_sha256], file.member.compress_size))
+    segments.append(chunks.central_directory)
+    return segments
+
+
+def read(segments, range_header=None):
+    (iterator, headers) = stream_chunked_archive(segments, ETAG, DATE, range_header)
+    return (b"".join(iterator), headers)
+
+
+@pytest.mark.parametrize(
+    "compression, streamed, force_zip64",
+    [
+        (zipfile.ZIP_STORED, False, False),
+        (zipfile.ZIP_DEFLATED, False, False),
+        (zipfile.ZIP_STORED, True, False),
+        (zipfile.ZIP_DEFLATED, True, True),
+    ],
+)
+def test_round_trip(bucket, compression, streamed, force_zip64):
+    archive = make_archive(FILES, compression, streamed, force_zip64)
+    chunks = upload(archive)
+
+    # identical files are stored once
+    assert len(chunks.stored_chunks) == len(FILES) - 1
+    assert len(bucket.objects) == len(FILES) - 1
+    (data, headers) = read(segments_of(chunks, chunks.stored_chunks))
+    assert data == archive
+    assert headers["Content-Length"] == str(len(archive))
+    assert chunks.sha256 == hashlib.sha256(archive).hexdigest()
+
+
+def test_large_file(bucket):
+    # streamed into S3 as a multipart upload rather than buffered
+    files = {"big.bin": os.urandom(SMALL_FILE_SIZE + 1000), "small.txt": b"small"}
+    archive = make_archive(files, zipfile.ZIP_STORED)
+    chunks = upload(archive, piece_size=1024 * 1024)
+
+    (data, _) = read(segments_of(chunks, chunks.stored_chunks))
+    assert data == archive
+
+
+def test_stored_chunks_are_skipped(bucket):
+    archive = make_archive(FILES)
+    first = upload(archive)
+    objects = dict(bucket.objects)
+
+    # the same files in another archive, e.g. the next version
+    second_archive = make_archive({**FILES, "new.txt": b"new"})
+    second = upload(second_archive, stored=set(first.stored_chunks))
+
+    assert list(second.stored_chunks) == [second.files[-1].chunk_sha256]
+    assert len(bucket.objects) == len(objects) + 1
+    file_keys = {**first.stored_chunks, **second.stored_chunks}
+    (data, _) = read(segments_of(second, file_keys))
+    assert data == second_archive
+
+
+def test_range_reads(bucket):
+    archive = make_archive(FILES)
+    chunks = upload(archive)
+    segments = segments_of(chunks, chunks.stored_chunks)
+    size = len(archive)
+
+    for range_header, (start, end) in [
+        ("bytes=0-0", (0, 0)),
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, size - 1)),
+        ("bytes=-10", (size - 10, size - 1)),
+        (f"bytes=5000-{size + 100}", (5000, size - 1)),
+        (f"bytes={size // 3}-{2 * size // 3}", (size // 3, 2 * size // 3)),
+    ]:
+        (data, headers) = read(segments, range_header)
+        assert data == archive[start : end + 1], range_header
+        assert headers["Content-Range"] == f"bytes {start}-{end}/{size}"
+        assert headers["Content-Length"] == str(end - start + 1)
+
+    # only the chunks a range overlaps are read, and only the part it overlaps
+    bucket.gets.clear()
+    read(segments, "bytes=-10")
+    assert bucket.gets == []
+    offset = len(segments[0])
+    read(segments, f"bytes={offset + 1}-{offset + 10}")
+    assert bucket.gets == [(segments[1][0], "bytes=1-10")]
+
+
+def test_unsatisfiable_range(bucket):
+    chunks = upload(make_archive(FILES))
+    segments = segments_of(chunks, chunks.stored_chunks)
+    with pytest.raises(HTTPException) as error:
+        read(segments, "bytes=100000000-")
+    assert error.value.status_code == 416
+
+
+def test_subset_zip(bucket):
+    archive = make_archive(FILES)
+    chunks = upload(archive)
+    entries = [
+        (file.member, chunks.stored_chunks[file.chunk_sha256])
+        for file in chunks.files
+        if file.member.path.startswith("textures/")
+    ]
+    (iterator, headers) = stream_chunked_zip(entries)
+    data = b"".join(iterator)
+
+    assert headers["Content-Length"] == str(len(data))
+    with zipfile.ZipFile(io.BytesIO(data)) as subset:
+        assert subset.testzip() is None
+        assert {path: subset.read(path) for path in subset.namelist()} == {
+            path: FILES[path] for path in FILES if path.startswith("textures/")
+        }
+
+
+def test_invalid_archive(bucket):
+    with pytest.raises(HTTPException) as error:
+        upload(b"not a zip archive at all")
+    assert error.value.status_code == 400
+
+
+def test_duplicate_paths(bucket):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("a.txt", b"one")
+        with pytest.warns(UserWarning):
+            archive.writestr("a.txt", b"two")
+    with pytest.raises(HTTPException) as error:
+        upload(buffer.getvalue())
+    assert error.value.status_code == 400
+
+
+def test_abort_deletes_stored_chunks(bucket):
+    chunks = upload(make_archive(FILES))
+    assert bucket.objects
+    chunks.abort()
+    assert bucket.objects == {}
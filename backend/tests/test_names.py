@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+import util.crud.assets
+from util.crud.assets import update_name_index
+from util.names import NameIndex
+
+ASSETS = [
+    ("1", "redChair"),
+    ("2", "Chair"),
+    ("3", "chair_leg"),
+    ("4", "old table"),
+    ("5", "armchair"),
+    ("6", "Tablecloth"),
+]
+
+
+def make_index(assets=ASSETS, counter=0):
+    index = NameIndex()
+    index.build(assets, counter)
+    return index
+
+
+def test_suggest():
+    index = make_index()
+
+    # names starting with the prefix come first, alphabetically and ignoring
+    # case, then names with a word starting with it
+    assert index.suggest("chair", 10) == [
+        ("2", "Chair"),
+        ("3", "chair_leg"),
+        ("1", "redChair"),
+    ]
+    assert index.suggest("TAB", 10) == [("6", "Tablecloth"), ("4", "old table")]
+    assert index.suggest("leg", 10) == [("3", "chair_leg")]
+    # only the start of a word matches
+    assert index.suggest("hair", 10) == []
+    assert index.suggest("chair", 2) == [("2", "Chair"), ("3", "chair_leg")]
+    assert index.sorted_names() == [
+        "armchair",
+        "Chair",
+        "chair_leg",
+        "old table",
+        "redChair",
+        "Tablecloth",
+    ]
+
+
+def test_add_rename_and_remove():
+    index = make_index()
+    index.add("7", "blueChair")
+    assert index.suggest("chair", 10) == [
+        ("2", "Chair"),
+        ("3", "chair_leg"),
+        ("7", "blueChair"),
+        ("1", "redChair"),
+    ]
+    assert index.suggest("blue", 10) == [("7", "blueChair")]
+
+    index.add("1", "redStool")
+    assert ("1", "redChair") not in index.suggest("chair", 10)
+    assert index.suggest("stool", 10) == [("1", "redStool")]
+
+    index.remove("3")
+    index.remove("unknown")
+    assert index.suggest("leg", 10) == []
+    # the same as an index built from the assets there are now
+    assets = [
+        ("1", "redStool"),
+        ("2", "Chair"),
+        ("4", "old table"),
+        ("5", "armchair"),
+        ("6", "Tablecloth"),
+        ("7", "blueChair"),
+    ]
+    rebuilt = make_index(assets)
+    assert (index.names, index.words) == (rebuilt.names, rebuilt.words)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = make_index(counter=5)
+    index.checked_at = 0
+    monkeypatch.setattr(util.crud.assets, "name_index", index)
+    return index
+
+
+def set_counter(monkeypatch, counter: int):
+    async def read_asset_changes(db):
+        return (counter, None)
+
+    monkeypatch.setattr(util.crud.assets, "read_asset_changes", read_asset_changes)
+
+
+def test_update_name_index(monkeypatch, index):
+    set_counter(monkeypatch, 6)
+    asyncio.run(update_name_index(None, "7", "stool"))
+    assert index.suggest("stool", 10) == [("7", "stool")]
+    assert (index.counter, index.checked_at) == (6, 0)
+
+    set_counter(monkeypatch, 7)
+    asyncio.run(update_name_index(None, "7", "barStool"))
+    assert index.suggest("stool", 10) == [("7", "barStool")]
+
+    set_counter(monkeypatch, 8)
+    asyncio.run(update_name_index(None, "7", None))
+    assert index.suggest("stool", 10) == []
+    assert index.counter == 8
+
+
+def test_update_after_unseen_changes(monkeypatch, index):
+    # another process committed a change between this one's and the last read
+    set_counter(monkeypatch, 7)
+    asyncio.run(update_name_index(None, "7", "stool"))
+    assert index.suggest("stool", 10) == []
+    # so the index is rebuilt when next read
+    assert (index.counter, index.checked_at) == (5, float("-inf"))
+
+
+def test_suggest_endpoint(client, headers, make_asset):
+    def suggest(prefix):
+        response = client.get(
+            "/api/v1/assets/names/suggest", params={"prefix": prefix, "limit": 100}
+        )
+        assert response.status_code == 200
+        return [(s["id"], s["asset_name"]) for s in response.json()]
+
+    asset_id = make_asset("suggestedName")
+    name = client.get(f"/api/v1/assets/{asset_id}").json()["asset"]["asset_name"]
+    assert (asset_id, name) in suggest("suggested")
+    assert (asset_id, name) in suggest(name[len("suggested") :])
+
+    client.put(
+        f"/api/v1/assets/{asset_id}",
+        json={"asset_name": "renamed" + name, "keywords": "test", "image_uri": None},
+        headers=headers,
+    )
+    assert asset_id not in [id for (id, _) in suggest("suggested")]
+    assert (asset_id, "renamed" + name) in suggest("renamedSuggested")
+
+    client.delete(f"/api/v1/assets/{asset_id}", headers=headers)
+    assert asset_id not in [id for (id, _) in suggest("renamed")]
+    assert "renamed" + name not in client.get("/api/v1/assets/names").json()
@@ -0,0 +1,113 @@
+import asyncio
+
+from fastapi import HTTPException
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+
+from database.connection import AsyncSessionLocal
+from database.models import Asset, Version
+from schemas.models import VersionCreate
+from tests.archives import make_archive
+import util.crud.assets
+from util.crud.assets import create_version, retry_version_commit
+
+COMMITS = 20
+
+
+class PostgresError(Exception):
+    def __init__(self, pgcode: str):
+        self.pgcode = pgcode
+
+
+class FakeSession:
+    def __init__(self):
+        self.rollbacks = 0
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+async def body(data: bytes):
+    yield data
+
+
+def test_concurrent_commits(client, bucket, pennkey, make_asset):
+    asset_id = make_asset("commits")
+
+    async def commit(i: int):
+        # every archive shares files with the others, so their commits reference
+        # the same chunks at once
+        archive = make_archive({"shared.txt": b"shared", f"{i}.txt": str(i).encode()})
+        info = VersionCreate(message=str(i), is_major=False)
+        async with AsyncSessionLocal() as db:
+            version = await create_version(db, body(archive), asset_id, pennkey, info)
+            return version.semver
+
+    async def commit_all():
+        return await asyncio.gather(*(commit(i) for i in range(COMMITS)))
+
+    semvers = client.portal.call(commit_all)
+
+    assert sorted(semvers, key=lambda semver: int(semver.split(".")[1])) == [
+        f"0.{minor}" for minor in range(1, COMMITS + 1)
+    ]
+
+    async def read_stored():
+        async with AsyncSessionLocal() as db:
+            stored = await db.scalars(
+                select(Version.semver).filter(Version.asset_id == asset_id)
+            )
+            latest = await db.scalar(
+                select(Asset.latest_semver).filter(Asset.id == asset_id)
+            )
+            return (sorted(stored), latest)
+
+    (stored, latest) = client.portal.call(read_stored)
+    assert stored == sorted(semvers)
+    assert latest == f"0.{COMMITS}"
+
+
+def test_retries_conflicting_commits(monkeypatch):
+    monkeypatch.setattr(util.crud.assets, "VERSION_COMMIT_BACKOFF", 0)
+    db = FakeSession()
+    attempts = []
+
+    async def register(db, value):
+        attempts.append(value)
+        if len(attempts) < 3:
+            raise DBAPIError("COMMIT", {}, PostgresError("40P01"))
+        return value
+
+    assert asyncio.run(retry_version_commit(db, register, "version")) == "version"
+    assert attempts == ["version"] * 3
+    assert db.rollbacks == 2
+
+
+def test_gives_up_after_attempts(monkeypatch):
+    monkeypatch.setattr(util.crud.assets, "VERSION_COMMIT_BACKOFF", 0)
+    db = FakeSession()
+    attempts = []
+
+    async def register(db):
+        attempts.append(None)
+        raise DBAPIError("COMMIT", {}, PostgresError("40001"))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(retry_version_commit(db, register))
+    assert error.value.status_code == 409
+    assert len(attempts) == util.crud.assets.VERSION_COMMIT_ATTEMPTS
+
+
+def test_other_errors_are_not_retried(monkeypatch):
+    db = FakeSession()
+    attempts = []
+
+    async def register(db):
+        attempts.append(None)
+        raise DBAPIError("INSERT", {}, PostgresError("23502"))
+
+    with pytest.raises(DBAPIError):
+        asyncio.run(retry_version_commit(db, register))
+    assert len(attempts) == 1
+    assert db.rollbacks == 1
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import random
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+from tests.archives import make_archive
+from util.zipstream import InvalidArchiveError, ZipStreamReader
+
+FILES = {
+    "model.obj": b"v 0 0 0\n" * 2000,
+    "textures/noise.bin": os.urandom(30000),
+    "empty.txt": b"",
+    "notes/ünïcode.txt": "héllo".encode(),
+}
+
+# (compression, streamed, force_zip64): streamed archives have data descriptors
+VARIANTS = {
+    "stored": (zipfile.ZIP_STORED, False, False),
+    "deflated": (zipfile.ZIP_DEFLATED, False, False),
+    "stored with descriptors": (zipfile.ZIP_STORED, True, False),
+    "deflated with descriptors": (zipfile.ZIP_DEFLATED, True, False),
+    "stored zip64": (zipfile.ZIP_STORED, False, True),
+    "deflated zip64 with descriptors": (zipfile.ZIP_DEFLATED, True, True),
+}
+
+
+def read_archive(archive: bytes, feed_sizes):
+    """
+    Feeds an archive to a reader in pieces of the given sizes (cycled).
+
+    Returns:
+        tuple: A tuple containing the archive as rebuilt from the reader's
+        events, and the members it read.
+    """
+    reader = ZipStreamReader()
+    (rebuilt, members, position) = (bytearray(), [], 0)
+    sizes = iter(feed_sizes)
+    while position < len(archive):
+        size = next(sizes)
+        for event, value in reader.feed(archive[position : position + size]):
+            if event in ("raw", "data"):
+                rebuilt += value
+            elif event == "end":
+                members.append(value)
+        position += size
+    reader.close()
+    return (bytes(rebuilt), members)
+
+
+def cycle(*sizes):
+    while True:
+        yield from sizes
+
+
+def random_sizes(seed: int):
+    generator = random.Random(seed)
+    while True:
+        yield generator.randint(1, 5000)
+
+
+@pytest.mark.parametrize("variant", VARIANTS)
+@pytest.mark.parametrize("feed_sizes", [(1,), (7,), (4096,), (10**9,), "random"])
+def test_round_trip(variant, feed_sizes):
+    archive = make_archive(FILES, *VARIANTS[variant])
+    sizes = random_sizes(len(archive)) if feed_sizes == "random" else cycle(*feed_sizes)
+
+    (rebuilt, members) = read_archive(archive, sizes)
+
+    assert rebuilt == archive
+    assert [member.path for member in members] == list(FILES)
+    for member in members:
+        data = FILES[member.path]
+        assert member.sha256 == hashlib.sha256(data).hexdigest()
+        assert member.crc32 == zlib.crc32(data)
+        assert member.file_size == len(data)
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_fake_descriptor_signature(streamed):
+    # looks like a data descriptor, but its CRC and sizes don't match the data
+    fake = b"PK\x07\x08" + struct.pack("<3L", 0, 3, 3)
+    files = {
+        "a.bin": b"abc" + fake + b"PK\x07\x08" + b"tail",
+        "b.bin": fake * 3,
+        "c.bin": b"PK\x07",
+    }
+    archive = make_archive(files, zipfile.ZIP_STORED, streamed)
+
+    for sizes in [cycle(1), cycle(3), random_sizes(1)]:
+        (rebuilt, members) = read_archive(archive, sizes)
+        assert rebuilt == archive
+        assert {member.path: member.file_size for member in members} == {
+            path: len(data) for path, data in files.items()
+        }
+
+
+def test_truncated_archive():
+    archive = make_archive(FILES)
+    with pytest.raises(InvalidArchiveError):
+        read_archive(archive[: len(archive) // 2], cycle(1000))
+
+
+def test_not_an_archive():
+    with pytest.raises(InvalidArchiveError):
+        read_archive(b"not a zip archive at all", cycle(1000))
+
+
+def test_corrupt_member():
+    archive = bytearray(make_archive({"a.txt": b"a" * 1000}, zipfile.ZIP_STORED))
+    # a byte of the file's data, after the 30 byte header and its name
+    archive[40] ^= 0xFF
+    with pytest.raises(InvalidArchiveError):
+        read_archive(bytes(archive), cycle(1000))
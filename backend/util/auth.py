@@ -1,16 +1,15 @@
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
+from uuid import UUID
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.connection import get_db
-from schemas.models import TokenData
-from settings import SECRET_KEY
-from util.crud.users import read_user
-
-ALGORITHM = "HS256"
+from schemas.models import TokenData, UploadTokenData
+from settings import ALGORITHM, SECRET_KEY
+from util.crud.users import read_cached_user
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/users/token")
 
@@ -26,8 +25,78 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+def create_upload_token(
+    pennkey: str,
+    asset_id: str,
+    file_key: str | None,
+    upload_id: str | None,
+    sha256: str | None,
+    expires_delta: timedelta,
+):
+    """
+    Creates a token binding a presigned upload to the user and asset it was
+    issued for, so it can later be finalized into a version. It deliberately
+    has no `sub` claim, so it can't be used as an access token.
+    """
+    return create_access_token(
+        data={
+            "pennkey": pennkey,
+            "asset_id": asset_id,
+            "file_key": file_key,
+            "upload_id": upload_id,
+            "sha256": sha256,
+        },
+        expires_delta=expires_delta,
+    )
+
+
+def decode_upload_token(token: str) -> UploadTokenData | None:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        return UploadTokenData(
+            pennkey=payload.get("pennkey"),
+            asset_id=payload.get("asset_id"),
+            file_key=payload.get("file_key"),
+            upload_id=payload.get("upload_id"),
+            sha256=payload.get("sha256"),
+        )
+    except (JWTError, ValueError):
+        return None
+
+
+def create_refresh_token(family_id: UUID, generation: int, expires_delta: timedelta):
+    """
+    Creates a long-lived token that can only be exchanged for new tokens, so
+    clients stay logged in without sending the password again. Like upload
+    tokens it has no `sub` claim, so it can't be used as an access token. It is
+    only accepted while `generation` is the latest of its family (see
+    `rotate_refresh_token`).
+    """
+    return create_access_token(
+        data={"refresh": str(family_id), "generation": generation},
+        expires_delta=expires_delta,
+    )
+
+
+def decode_refresh_token(token: str) -> tuple[UUID, int] | None:
+    """
+    Returns:
+        tuple: A tuple containing the id of the refresh token's family and its
+        generation, or `None` if it is invalid or expired.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        family_id = UUID(payload.get("refresh"))
+    except (JWTError, TypeError, ValueError):
+        return None
+    generation = payload.get("generation")
+    if not isinstance(generation, int):
+        return None
+    return (family_id, generation)
+
+
 async def get_current_user(
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
     token: Annotated[str, Depends(oauth2_scheme)],
 ):
     credentials_exception = HTTPException(
@@ -43,7 +112,7 @@ async def get_current_user(
         token_data = TokenData(pennkey=pennkey)
     except JWTError:
         raise credentials_exception
-    user = read_user(db, pennkey=token_data.pennkey)  # type: ignore
+    user = await read_cached_user(db, pennkey=token_data.pennkey)  # type: ignore
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,187 @@
+from collections import OrderedDict
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Generic, Hashable, Sequence, TypeVar
+from pydantic import TypeAdapter
+
+V = TypeVar("V")
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for redis before treating a read as a miss
+REDIS_TIMEOUT = 1
+
+
+class TTLCache(Generic[V]):
+    """
+    Keeps up to `maxsize` values, dropping the least recently used first, and
+    forgets each one `ttl` seconds after it was set. Caches are per process, so
+    `ttl` bounds how stale other workers' copies can be.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: Hashable) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        (expires, value) = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: V):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class MemoryBackend:
+    """
+    Keeps a `ReadThroughCache` in this process. Other processes don't see its
+    invalidations, so their copies are only forgotten once they expire.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries: TTLCache = TTLCache(maxsize, ttl)
+        self.generations: dict[str, int] = {}
+
+    async def get_generations(self, namespaces: Sequence[str]) -> list[int] | None:
+        return [self.generations.get(namespace, 0) for namespace in namespaces]
+
+    async def bump_generations(self, namespaces: Sequence[str]):
+        for namespace in namespaces:
+            self.generations[namespace] = self.generations.get(namespace, 0) + 1
+
+    async def get(self, key: str, adapter: TypeAdapter):
+        return self.entries.get(key)
+
+    async def set(self, key: str, value, adapter: TypeAdapter):
+        self.entries.set(key, value)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """
+    Shares a `ReadThroughCache` between processes through redis, which bounds
+    its size itself. Its `maxmemory-policy` must be a `volatile-*` one, so the
+    generations (which don't expire) are never evicted. While redis can't be
+    reached every read is a miss.
+    """
+
+    PREFIX = "griddle:cache:"
+
+    def __init__(self, url: str, ttl: float):
+        # only installed where a shared cache is used
+        import redis.asyncio
+        import redis.exceptions
+
+        self.redis = redis.asyncio.from_url(
+            url, socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT
+        )
+        self.errors = (redis.exceptions.RedisError, OSError)
+        self.ttl = math.ceil(ttl)
+
+    async def get_generations(self, namespaces: Sequence[str]) -> list[int] | None:
+        try:
+            values = await self.redis.mget(
+                [f"{self.PREFIX}generation:{namespace}" for namespace in namespaces]
+            )
+        except self.errors:
+            logger.warning("Couldn't read cache generations", exc_info=True)
+            return None
+        return [int(value or 0) for value in values]
+
+    async def bump_generations(self, namespaces: Sequence[str]):
+        try:
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for namespace in namespaces:
+                    pipeline.incr(f"{self.PREFIX}generation:{namespace}")
+                await pipeline.execute()
+        except self.errors:
+            # other processes' copies are forgotten once they expire instead
+            logger.warning("Couldn't invalidate cached results", exc_info=True)
+
+    async def get(self, key: str, adapter: TypeAdapter):
+        try:
+            value = await self.redis.get(self.PREFIX + key)
+        except self.errors:
+            logger.warning("Couldn't read a cached result", exc_info=True)
+            return None
+        return None if value is None else adapter.validate_json(value)
+
+    async def set(self, key: str, value, adapter: TypeAdapter):
+        try:
+            await self.redis.set(
+                self.PREFIX + key, adapter.dump_json(value), ex=self.ttl
+            )
+        except self.errors:
+            logger.warning("Couldn't cache a result", exc_info=True)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class ReadThroughCache:
+    """
+    Caches the results of reads in a `MemoryBackend` or `RedisBackend`. Each
+    result belongs to namespaces, and invalidating a namespace moves it to a
+    new generation, so results cached in the old one are never read again.
+    """
+
+    def __init__(self, backend: MemoryBackend | RedisBackend):
+        self.backend = backend
+        # totals since the worker started
+        self.hits = 0
+        self.misses = 0
+
+    async def read(
+        self,
+        namespaces: Sequence[str],
+        key: str,
+        adapter: TypeAdapter,
+        load: Callable[[], Awaitable],
+    ):
+        """
+        Returns the result cached under `key`, or the result of `load()` (which
+        is then cached unless it is `None`). The generations are read first, so
+        a result loaded while its namespaces are invalidated is cached under
+        the old generations.
+        """
+        generations = await self.backend.get_generations(namespaces)
+        if generations is None:
+            self.misses += 1
+            return await load()
+
+        key = ":".join([key, *map(str, generations)])
+        value = await self.backend.get(key, adapter)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = await load()
+        if value is not None:
+            await self.backend.set(key, value, adapter)
+        return value
+
+    async def invalidate(self, *namespaces: str):
+        await self.backend.bump_generations(namespaces)
+
+    async def close(self):
+        await self.backend.close()
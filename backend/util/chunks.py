@@ -0,0 +1,415 @@
+"""
+Storage of version archives as their individual files ("chunks"), each stored
+once in S3 no matter how many versions or assets contain it, and reassembled
+into a zip archive on download.
+"""
+
+from concurrent.futures import Future, wait
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import hashlib
+from typing import AsyncIterator, Callable, Collection, Sequence
+import zlib
+from uuid import uuid4
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from util.files import (
+    DOWNLOAD_CHUNK_SIZE,
+    UPLOAD_PART_SIZE,
+    S3StreamingUpload,
+    delete_s3_objects,
+    etag_matches,
+    if_range_matches,
+    prefetch_s3_objects,
+    resolve_range,
+    upload_executor,
+    write_upload,
+)
+from util.s3 import assets_bucket
+from util.zipstream import (
+    STORED,
+    InvalidArchiveError,
+    ZipMember,
+    ZipStreamReader,
+    build_zip,
+    central_directory_header,
+    data_descriptor,
+    end_of_central_directory,
+    local_file_header,
+)
+
+# files up to this size are buffered and only uploaded once we know they are new;
+# larger ones are streamed into S3 as they arrive, and discarded if they are not
+SMALL_FILE_SIZE = UPLOAD_PART_SIZE
+
+# small files are looked up and uploaded in batches of up to this many bytes or
+# files, so an archive of many small files takes a handful of queries
+FILE_BATCH_SIZE = 2 * UPLOAD_PART_SIZE
+FILE_BATCH_COUNT = 500
+
+
+def new_chunk_key() -> str:
+    return f"chunks/{uuid4()}"
+
+
+class ArchiveFile(BaseModel):
+    member: ZipMember
+    # the archive's bytes before the file's data, i.e. its local file header
+    header: bytes
+    # sha256 of the file's data as stored in the archive
+    chunk_sha256: str
+
+
+class ChunkedArchiveUpload:
+    """
+    Splits a zip archive into its files as it is written, storing the data of
+    each file in S3 (as stored in the archive, i.e. usually compressed) unless
+    identical data is already stored. Everything else in the archive is kept in
+    `files` and `central_directory`, so it can be reassembled byte for byte.
+
+    `read_stored_chunks` is called with batches of sha256 hashes and returns the
+    ones already stored. Chunks stored by this upload are kept in
+    `stored_chunks`, and are deleted again if the upload is aborted.
+    """
+
+    def __init__(
+        self, read_stored_chunks: Callable[[Collection[str]], Collection[str]]
+    ):
+        self.size = 0
+        self.files: list[ArchiveFile] = []
+        self.central_directory = b""
+        # file keys of the chunks uploaded by this upload, by sha256
+        self.stored_chunks: dict[str, str] = {}
+        # set once a version referencing the chunks is committed, after which
+        # they must be kept whatever happens
+        self.committed = False
+        self._read_stored_chunks = read_stored_chunks
+        self._hash = hashlib.sha256()
+        self._reader = ZipStreamReader()
+        self._paths: set[str] = set()
+        self._raw = bytearray()
+        self._header = b""
+        self._chunk_hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._upload: S3StreamingUpload | None = None
+        self._batch: dict[str, bytes] = {}
+        self._batch_size = 0
+        self._puts: list[Future] = []
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, data: bytes):
+        self._hash.update(data)
+        self.size += len(data)
+        try:
+            for event, value in self._reader.feed(data):
+                if event == "raw":
+                    self._raw += value
+                elif event == "start":
+                    self._start_file(value)
+                elif event == "data":
+                    self._write_file(value)
+                else:
+                    self._end_file(value)
+        except InvalidArchiveError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+
+    def complete(self, expected_sha256: str | None = None):
+        """
+        Finishes the upload. If `expected_sha256` is given and doesn't match the
+        archive written, nothing is stored and a 400 error is raised.
+        """
+        try:
+            self._reader.close()
+        except InvalidArchiveError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+        if expected_sha256 is not None and expected_sha256.lower() != self.sha256:
+            raise HTTPException(status_code=400, detail="File checksum mismatch")
+        self.central_directory = bytes(self._raw)
+        self._raw.clear()
+        self._flush_batch()
+        self._wait_puts()
+
+    def abort(self):
+        """
+        Cancels the upload and deletes any chunks it already stored.
+        """
+        self._buffer.clear()
+        self._batch.clear()
+        if self._upload is not None:
+            self._upload.abort()
+            self._upload = None
+        wait(self._puts)
+        self._puts.clear()
+        delete_s3_objects(list(self.stored_chunks.values()))
+        self.stored_chunks.clear()
+
+    def _start_file(self, member: ZipMember):
+        if member.path in self._paths:
+            raise HTTPException(
+                status_code=400, detail=f"Archive contains {member.path} twice"
+            )
+        self._paths.add(member.path)
+        # the raw bytes since the last file's data also include its data descriptor
+        self._header = bytes(self._raw)
+        self._raw.clear()
+        self._chunk_hash = hashlib.sha256()
+
+    def _write_file(self, data: bytes):
+        self._chunk_hash.update(data)
+        if self._upload is not None:
+            self._upload.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) > SMALL_FILE_SIZE:
+            self._upload = S3StreamingUpload(new_chunk_key())
+            self._upload.write(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _end_file(self, member: ZipMember):
+        chunk_sha256 = self._chunk_hash.hexdigest()
+        self.files.append(
+            ArchiveFile(member=member, header=self._header, chunk_sha256=chunk_sha256)
+        )
+        if self._upload is not None:
+            (upload, self._upload) = (self._upload, None)
+            if chunk_sha256 in self.stored_chunks or self._read_stored_chunks(
+                [chunk_sha256]
+            ):
+                upload.abort()
+            else:
+                upload.complete()
+                self.stored_chunks[chunk_sha256] = upload.file_key
+            return
+
+        if chunk_sha256 not in self._batch:
+            self._batch[chunk_sha256] = bytes(self._buffer)
+            self._batch_size += len(self._buffer)
+        self._buffer.clear()
+        if self._batch_size >= FILE_BATCH_SIZE or len(self._batch) >= FILE_BATCH_COUNT:
+            self._flush_batch()
+
+    def _flush_batch(self):
+        batch = {
+            sha256: data
+            for sha256, data in self._batch.items()
+            if sha256 not in self.stored_chunks
+        }
+        self._batch = {}
+        self._batch_size = 0
+        if not batch:
+            return
+        known = set(self._read_stored_chunks(batch.keys()))
+
+        # the previous batch uploads while this one fills, but no further ahead
+        self._wait_puts()
+        for sha256, data in batch.items():
+            if sha256 in known:
+                continue
+            file_key = new_chunk_key()
+            self.stored_chunks[sha256] = file_key
+            self._puts.append(
+                upload_executor.submit(
+                    assets_bucket.meta.client.put_object,
+                    Bucket=assets_bucket.name,
+                    Key=file_key,
+                    Body=data,
+                )
+            )
+
+    def _wait_puts(self):
+        wait(self._puts)
+        for put in self._puts:
+            put.result()
+        self._puts.clear()
+
+
+async def stream_chunked_upload(
+    chunks: AsyncIterator[bytes],
+    read_stored_chunks: Callable[[Collection[str]], Collection[str]],
+    expected_sha256: str | None = None,
+) -> ChunkedArchiveUpload:
+    """
+    Streams a zip archive (e.g. a request body) into S3 file by file as it
+    arrives, skipping files that are already stored. On any failure the chunks
+    stored so far are deleted again.
+
+    Returns:
+        ChunkedArchiveUpload: The finished upload, with its files and the chunks
+        it stored.
+    """
+    upload = ChunkedArchiveUpload(read_stored_chunks)
+    await write_upload(chunks, upload, expected_sha256)
+    return upload
+
+
+def stream_chunked_archive(
+    segments: Sequence[bytes | tuple[str, int]],
+    etag: str,
+    last_modified: datetime,
+    range_header: str | None = None,
+    if_range: str | None = None,
+    if_none_match: str | None = None,
+):
+    """
+    Reassembles an archive stored as its individual files as it is streamed.
+    `segments` are the bytes stored in the database, interleaved with the file
+    key and size of each file's chunk in S3. `Range` requests only read the
+    chunks they overlap.
+
+    Returns:
+        tuple: A tuple containing a chunk iterator and the response headers. The
+        headers include `Content-Range` if only part of the archive is returned.
+    """
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+
+    lengths = [segment_length(segment) for segment in segments]
+    size = sum(lengths)
+
+    byte_range = None
+    if if_range is None or if_range_matches(if_range, etag, last_modified):
+        byte_range = resolve_range(range_header, size)
+    (start, end) = (0, size - 1) if byte_range is None else byte_range
+
+    headers = {
+        "Content-Length": str(end - start + 1),
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Accept-Ranges": "bytes",
+    }
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return (iter_segments(segments, start, end), headers)
+
+
+def stream_chunked_zip(entries: Sequence[tuple[ZipMember, str]]):
+    """
+    Streams a new zip archive of files stored as chunks, e.g. a subset of the
+    files of a version. `entries` are the files in order, with the file key of
+    each one's chunk.
+
+    Returns:
+        tuple: A tuple containing a chunk iterator and the response headers.
+    """
+    segments = build_zip(
+        [(member, (file_key, member.compress_size)) for (member, file_key) in entries]
+    )
+    size = sum(segment_length(segment) for segment in segments)
+    return (iter_segments(segments, 0, size - 1), {"Content-Length": str(size)})
+
+
+def stream_archives_zip(
+    archives: Sequence[tuple[str, datetime, Sequence[bytes | tuple[str, int]]]]
+):
+    """
+    Streams a zip archive containing other archives, e.g. many versions at once.
+    `archives` are the path and date of each archive in the zip, with the
+    segments it is assembled from (see `stream_chunked_archive`; an archive
+    stored whole is a single segment). Chunks are read from S3 ahead of being
+    sent, but only a few at a time, so memory use doesn't grow with the zip.
+
+    Archives are stored in the zip as is, with their CRCs following them, as
+    those are only known once they have been read.
+
+    Returns:
+        tuple: A tuple containing a chunk iterator and the response headers.
+    """
+    # the layout doesn't depend on the CRCs, so the size is known up front
+    (members, offsets, offset) = ([], [], 0)
+    for path, date_time, segments in archives:
+        size = sum(segment_length(segment) for segment in segments)
+        member = ZipMember(
+            path=path,
+            date_time=date_time,
+            compress_type=STORED,
+            compress_size=size,
+            file_size=size,
+        )
+        members.append(member)
+        offsets.append(offset)
+        offset += (
+            len(local_file_header(member, with_descriptor=True)) + member.compress_size
+        )
+        offset += len(data_descriptor(member))
+    central_directory_size = sum(
+        len(central_directory_header(member, member_offset, with_descriptor=True))
+        for (member, member_offset) in zip(members, offsets)
+    )
+    size = offset + central_directory_size
+    size += len(end_of_central_directory(len(members), offset, central_directory_size))
+
+    def iter_zip():
+        objects = prefetch_s3_objects(
+            [
+                segment[0]
+                for (_, _, segments) in archives
+                for segment in segments
+                if not isinstance(segment, bytes)
+            ]
+        )
+        central_directory = bytearray()
+        try:
+            for member, member_offset, (_, _, segments) in zip(
+                members, offsets, archives
+            ):
+                yield local_file_header(member, with_descriptor=True)
+                crc32 = 0
+                for segment in segments:
+                    if isinstance(segment, bytes):
+                        crc32 = zlib.crc32(segment, crc32)
+                        yield segment
+                        continue
+                    read = 0
+                    for chunk in next(objects):
+                        crc32 = zlib.crc32(chunk, crc32)
+                        read += len(chunk)
+                        yield chunk
+                    if read != segment[1]:
+                        raise InvalidArchiveError(f"{segment[0]} has changed size")
+                member.crc32 = crc32
+                yield data_descriptor(member)
+                central_directory += central_directory_header(
+                    member, member_offset, with_descriptor=True
+                )
+            yield bytes(central_directory) + end_of_central_directory(
+                len(members), offset, len(central_directory)
+            )
+        finally:
+            objects.close()
+
+    return (iter_zip(), {"Content-Length": str(size)})
+
+
+def segment_length(segment: bytes | tuple[str, int]) -> int:
+    return len(segment) if isinstance(segment, bytes) else segment[1]
+
+
+def iter_segments(segments: Sequence[bytes | tuple[str, int]], start: int, end: int):
+    """
+    Yields bytes `start` to `end` (inclusive) of the concatenation of `segments`,
+    reading chunks from S3 as they are reached and skipping those out of range.
+    """
+    offset = 0
+    for segment in segments:
+        length = segment_length(segment)
+        (first, last) = (max(start - offset, 0), min(end - offset, length - 1))
+        offset += length
+        if first > last:
+            if offset > end:
+                break
+            continue
+        if isinstance(segment, bytes):
+            yield segment[first : last + 1]
+            continue
+        response = assets_bucket.Object(segment[0]).get(Range=f"bytes={first}-{last}")
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(DOWNLOAD_CHUNK_SIZE)
+        finally:
+            body.close()
@@ -1,92 +1,353 @@
-from pathlib import Path
-from typing import Sequence, Literal
-from uuid import uuid4
-from pydantic import BaseModel
-import semver
-from sqlalchemy import select, delete
-from sqlalchemy.orm import Session
-import csv
+import asyncio
+from collections import Counter, defaultdict
+import json
+import random
+import time
+from typing import AsyncIterator, Collection, Sequence, Literal
+from uuid import UUID
+import anyio
+from anyio import from_thread
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import (
+    ARRAY,
+    Double,
+    Uuid,
+    any_,
+    cast,
+    delete,
+    literal,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+import re
 
 from schemas.models import (
     AssetCreate,
     VersionCreate,
+    VersionDiff,
     Asset as MAsset,
     Version as MVersion,
 )
-from database.models import Asset, Version
+from database.models import (
+    SEARCH_CONFIG,
+    Asset,
+    AssetChanges,
+    AssetKeyword,
+    Blob,
+    Chunk,
+    Version,
+    VersionFile,
+)
 
-from util.files import temp_s3_download
-from util.s3 import assets_bucket
+from settings import CACHE_REDIS_URL, RESPONSE_CACHE_SECONDS, RESPONSE_CACHE_SIZE
+from util.cache import MemoryBackend, ReadThroughCache, RedisBackend
+from util.chunks import (
+    ChunkedArchiveUpload,
+    stream_archives_zip,
+    stream_chunked_archive,
+    stream_chunked_upload,
+    stream_chunked_zip,
+)
+from util.files import delete_s3_objects, s3_object_size, s3_stream_download
+from util.names import NameIndex
+from util.pagination import PAGE_SIZE, read_page
+from util.zipstream import ZipMember
 from sqlalchemy import or_, func
 from sqlalchemy.sql.expression import case
 
 # https://fastapi.tiangolo.com/tutorial/sql-databases/#crud-utils
 
+# most assets a search may select to export at once
+MAX_EXPORT_SIZE = 1000
+
+# how similar (from 0 to 1) a word in an asset's name or keywords must be to a
+# fuzzy search for the asset to match; low enough to tolerate a transposition
+FUZZY_SEARCH_THRESHOLD = 0.3
+
+# most keywords counted for a search
+KEYWORD_FACET_LIMIT = 50
+
+# how many times a version is committed before giving up on concurrent commits
+# conflicting with it, and the delay before the first retry, doubling after it
+VERSION_COMMIT_ATTEMPTS = 5
+VERSION_COMMIT_BACKOFF = 0.05
+
+# postgres errors a retried commit can succeed after: serialization failures,
+# deadlocks, and unique violations by versions numbered concurrently
+RETRYABLE_PGCODES = {"40001", "40P01", "23505"}
+
+# browsing and search results, invalidated by the writes changing them: pages
+# of assets belong to the "assets" namespace, and anything read about a single
+# asset to that asset's
+asset_cache = ReadThroughCache(
+    MemoryBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_SECONDS)
+    if CACHE_REDIS_URL is None
+    else RedisBackend(CACHE_REDIS_URL, RESPONSE_CACHE_SECONDS)
+)
+ASSETS_NAMESPACE = "assets"
+
+
+def asset_namespace(asset_id: str | UUID):
+    try:
+        return f"asset:{UUID(str(asset_id))}"
+    except ValueError:
+        return f"asset:{asset_id}"
+
+
+def asset_cache_key(name: str, params: dict):
+    return json.dumps([name, params], sort_keys=True, default=str)
+
+
+# names of assets, kept up to date as this process changes them
+name_index = NameIndex()
+name_index_lock = asyncio.Lock()
+# seconds between checks for names changed by other processes
+NAME_INDEX_REFRESH_SECONDS = 30
+
 
-def read_asset(db: Session, asset_id: str):
-    return db.execute(select(Asset.filter(Asset.id == asset_id)).limit(1)).first()
+async def forget_asset(asset_id: str | UUID):
+    await asset_cache.invalidate(ASSETS_NAMESPACE, asset_namespace(asset_id))
 
 
-def read_assets(
-    db: Session,
+async def read_asset(db: AsyncSession, asset_id: str):
+    return (
+        await db.execute(select(Asset.filter(Asset.id == asset_id)).limit(1))
+    ).first()
+
+
+def to_search_query(search: str):
+    """
+    Builds a full-text query matching assets with every word of `search` in
+    their name or keywords, also as the start of a longer word (so "tab" finds
+    "table"). A comma-separated search matches any of its parts, like a list of
+    keywords.
+    """
+    parts = [
+        " & ".join(f"{word}:*" for word in re.findall(r"\w+", part))
+        for part in search.split(",")
+    ]
+    return func.to_tsquery(
+        SEARCH_CONFIG, " | ".join(f"({part})" for part in parts if part != "")
+    )
+
+
+async def filter_assets(
+    db: AsyncSession,
+    query,
     search: str | None = None,
-    offset=0,
-    sort: Literal["date_asc", "name_asc", "date_dsc", "name_dsc"] = "date_dsc",
+    fuzzy: bool = False,
+    keywords: str | None = None,
+    keywords_mode: Literal["all", "any"] = "all",
 ):
-    # TODO: figure out the join nonsense
-    # 1. distance between str and asset name should be small
-    # 2. Each word in search are tested against keywords,
-    query = select(Asset)
-    # query = query.join(Version, Asset.id == Version.asset_id, isouter=True)
-    # query = query.distinct(Asset.id)
-    if search is not None:
-        # If search contains commas, split by commas, otherwise split by spaces
-        if "," in search:
-            reader = csv.reader([search], skipinitialspace=True)
-            keywords = next(reader)
-        else:
-            keywords = search.split()
-        # check if asset name contains search
-        asset_name_conditions = []
-        asset_name_conditions.append(
-            or_(
-                *[Asset.asset_name.ilike(f"%{search}%")],
-                *[Asset.asset_name.ilike(f"%{kw}%") for kw in keywords],
+    """
+    Filters a query over assets by a search and by exact keywords.
+
+    Returns:
+        tuple: A tuple containing the filtered query, and the relevance of each
+        asset to the search to order by, or `None` if there is no search.
+    """
+    relevance = None
+    if search is not None and fuzzy:
+        # match assets with words similar to the search in their name or keywords,
+        # using the operator form so the trigram indexes can be used
+        await db.execute(
+            select(
+                func.set_config(
+                    "pg_trgm.word_similarity_threshold",
+                    str(FUZZY_SEARCH_THRESHOLD),
+                    True,
+                )
             )
         )
-        # check if keywords contain search words
         query = query.filter(
             or_(
-                *asset_name_conditions,
-                *[Asset.keywords.ilike(f"%{kw}%") for kw in keywords],
+                Asset.asset_name.bool_op("%>")(search),
+                Asset.keywords.bool_op("%>")(search),
             )
         )
+        relevance = func.greatest(
+            func.word_similarity(search, Asset.asset_name),
+            func.word_similarity(search, Asset.keywords),
+        )
+    elif search is not None:
+        search_query = to_search_query(search)
+        query = query.filter(Asset.search_vector.bool_op("@@")(search_query))
+        relevance = func.ts_rank(Asset.search_vector, search_query)
+
+    if relevance is not None:
+        # postgres returns reals rounded, so page cursors couldn't hold them exactly
+        relevance = cast(relevance, Double)
+    parsed_keywords = [] if keywords is None else parse_keywords(keywords)
+    if parsed_keywords:
+        tagged = select(AssetKeyword.asset_id).filter(
+            AssetKeyword.keyword.in_(parsed_keywords)
+        )
+        if keywords_mode == "all":
+            tagged = tagged.group_by(AssetKeyword.asset_id).having(
+                func.count() == len(parsed_keywords)
+            )
+        query = query.filter(Asset.id.in_(tagged))
+
+    return (query, relevance)
+
+
+async def read_assets(
+    db: AsyncSession,
+    search: str | None = None,
+    offset=0,
+    sort: Literal["date_asc", "name_asc", "date_dsc", "name_dsc"] = "date_dsc",
+    fuzzy: bool = False,
+    keywords: str | None = None,
+    keywords_mode: Literal["all", "any"] = "all",
+    cursor: str | None = None,
+    limit: int = PAGE_SIZE,
+):
+    """
+    Reads a page of assets, continuing after `cursor` if given.
+
+    Returns:
+        tuple: A tuple containing the assets, and the cursor of the next page or
+        `None` if this is the last one.
+    """
+    # TODO: figure out the join nonsense
+    query = select(Asset)
+    # query = query.join(Version, Asset.id == Version.asset_id, isouter=True)
+    # query = query.distinct(Asset.id)
+    (query, relevance) = await filter_assets(
+        db, query, search, fuzzy, keywords, keywords_mode
+    )
 
-    # sort by date or name
-    # if sort == "date_asc":
-    #     query = query.order_by(Version.date.asc())
+    # sort by date or name, always ending with the id so the order is total
     if sort == "name_asc":
-        query = query.order_by(Asset.asset_name.asc())
-    # elif sort == "date_dsc":
-    #     query = query.order_by(Version.date.desc())
+        (order, keys, descending) = (sort, [Asset.asset_name, Asset.id], False)
     elif sort == "name_dsc":
-        query = query.order_by(Asset.asset_name.desc())
+        (order, keys, descending) = (sort, [Asset.asset_name, Asset.id], True)
+    elif relevance is not None:
+        # otherwise show the best matches first
+        (order, keys, descending) = ("relevance", [relevance, Asset.id], True)
+    else:
+        keys = [Asset.latest_version_date, Asset.id]
+        (order, descending) = (sort, sort == "date_dsc")
 
-    # limit and offset query, then return
-    query = query.limit(24).offset(offset)
-    return db.execute(query).scalars().all()
+    # offset is only kept for older clients, cursors don't read earlier pages
+    return await read_page(
+        db, query.offset(offset), order, keys, descending, cursor, limit
+    )
 
 
-def read_assets_names(db: Session):
-    # Select all assets in db
-    query = select(Asset.asset_name)
-    # Execute the query and fetch all results
-    asset_names = db.execute(query).scalars().all()
+ASSET_PAGE = TypeAdapter(tuple[list[MAsset], str | None])
 
-    return asset_names
 
+async def read_cached_assets(db: AsyncSession, **params):
+    """
+    Reads a page of assets like `read_assets`, but from `asset_cache` if it was
+    read since assets last changed.
+    """
 
-def create_asset(db: Session, asset: AssetCreate, author_pennkey: str):
+    async def load():
+        (assets, next_cursor) = await read_assets(db, **params)
+        return ([MAsset.model_validate(asset) for asset in assets], next_cursor)
+
+    return await asset_cache.read(
+        [ASSETS_NAMESPACE], asset_cache_key("assets", params), ASSET_PAGE, load
+    )
+
+
+async def read_keyword_counts(
+    db: AsyncSession,
+    search: str | None = None,
+    fuzzy: bool = False,
+    keywords: str | None = None,
+    keywords_mode: Literal["all", "any"] = "all",
+):
+    """
+    Counts the assets with each keyword among those matching the given filters,
+    most common first.
+    """
+    (assets, _) = await filter_assets(
+        db, select(Asset.id), search, fuzzy, keywords, keywords_mode
+    )
+    query = (
+        select(AssetKeyword.keyword, func.count().label("count"))
+        .filter(AssetKeyword.asset_id.in_(assets))
+        .group_by(AssetKeyword.keyword)
+        .order_by(func.count().desc(), AssetKeyword.keyword)
+        .limit(KEYWORD_FACET_LIMIT)
+    )
+    return (await db.execute(query)).all()
+
+
+async def read_asset_changes(db: AsyncSession):
+    """
+    Returns:
+        tuple: The number of changes to assets committed so far, and when the
+        last one was.
+    """
+    query = select(AssetChanges.counter, AssetChanges.modified).where(
+        AssetChanges.id == 1
+    )
+    return (await db.execute(query)).one()
+
+
+async def read_name_index(db: AsyncSession, counter: int | None = None):
+    """
+    Returns `name_index`, rebuilt first if assets were changed by another
+    process (or outside the API) since it was read. With the `counter` of asset
+    changes read in this session, it is made at least as new as `counter`; otherwise
+    changes are only checked for every NAME_INDEX_REFRESH_SECONDS.
+    """
+    global name_index
+    if counter is None and time.monotonic() < name_index.checked_at + (
+        NAME_INDEX_REFRESH_SECONDS
+    ):
+        return name_index
+
+    async with name_index_lock:
+        if counter is None:
+            (counter, _) = await read_asset_changes(db)
+        # an index newer than `counter`, e.g. one read from a lagging replica,
+        # is kept rather than rebuilt older
+        if name_index.counter is None or counter > name_index.counter:
+            assets = (await db.execute(select(Asset.id, Asset.asset_name))).all()
+            # sorting many names takes a while, so the new index is built
+            # beside the one in use rather than blocking the event loop
+            index = NameIndex()
+            await run_in_threadpool(index.build, assets, counter)
+            name_index = index
+        name_index.checked_at = time.monotonic()
+    return name_index
+
+
+async def update_name_index(db: AsyncSession, asset_id: str, name: str | None):
+    """
+    Applies a change to an asset's name just committed in this session to
+    `name_index`, adding or renaming the asset, or removing it if `name` is
+    `None`. The index then records the count of asset changes after the commit,
+    unless changes it hasn't seen were committed too, in which case it is
+    rebuilt when next read instead.
+    """
+    (counter, _) = await read_asset_changes(db)
+    async with name_index_lock:
+        # the commit counted as one change, which makes `counter` at least one
+        # more than the count before it
+        if name_index.counter != counter - 1:
+            name_index.checked_at = float("-inf")
+            return
+        if name is None:
+            name_index.remove(asset_id)
+        else:
+            name_index.add(asset_id, name)
+        name_index.counter = counter
+
+
+async def create_asset(db: AsyncSession, asset: AssetCreate, author_pennkey: str):
     db_asset = Asset(
         asset_name=asset.asset_name,
         author_pennkey=author_pennkey,
@@ -94,36 +355,121 @@ def create_asset(db: Session, asset: AssetCreate, author_pennkey: str):
         image_uri=asset.image_uri,
     )
     db.add(db_asset)
-    db.commit()
-    db.refresh(db_asset)
+    await db.flush()
+    await set_asset_keywords(db, db_asset.id, asset.keywords)
+    await db.commit()
+    # nothing was read about the new asset, but it is on pages of assets
+    await asset_cache.invalidate(ASSETS_NAMESPACE)
+    await update_name_index(db, str(db_asset.id), db_asset.asset_name)
+    await db.refresh(db_asset)
     return db_asset
 
 
-def update_asset(db: Session, asset_id: str, asset: AssetCreate):
+def parse_keywords(keywords: str):
+    """
+    Splits comma-separated keywords, normalized like the frontend does.
+    """
+    parsed = [keyword.strip().lower() for keyword in keywords.split(",")]
+    return list(dict.fromkeys(keyword for keyword in parsed if keyword != ""))
+
+
+async def set_asset_keywords(db: AsyncSession, asset_id: UUID, keywords: str):
+    """
+    Replaces an asset's keyword rows with the given comma-separated keywords.
+    Does not commit.
+    """
+    await db.execute(delete(AssetKeyword).where(AssetKeyword.asset_id == asset_id))
+    parsed = parse_keywords(keywords)
+    if parsed:
+        await db.execute(
+            insert(AssetKeyword),
+            [{"asset_id": asset_id, "keyword": keyword} for keyword in parsed],
+        )
+
+
+async def update_asset(db: AsyncSession, asset_id: str, asset: AssetCreate):
     db_asset = (
-        db.execute(select(Asset).filter(Asset.id == asset_id).limit(1))
-        .scalars()
-        .first()
-    )
+        await db.scalars(select(Asset).filter(Asset.id == asset_id).limit(1))
+    ).first()
     if db_asset is None:
         return None
     db_asset.asset_name = asset.asset_name
     db_asset.keywords = asset.keywords
     db_asset.image_uri = asset.image_uri
-    db.commit()
-    db.refresh(db_asset)
+    await set_asset_keywords(db, db_asset.id, asset.keywords)
+    await db.commit()
+    await forget_asset(asset_id)
+    await update_name_index(db, str(db_asset.id), db_asset.asset_name)
+    await db.refresh(db_asset)
     return db_asset
 
 
-def remove_asset(db: Session, asset_id: str):
-    db.execute(delete(Asset).where(Asset.id == asset_id))
-    db.commit()
+async def remove_asset(db: AsyncSession, asset_id: str):
+    # release this asset's references to its version files
+    blob_refs = Counter(
+        await db.scalars(
+            select(Version.sha256).filter(
+                Version.asset_id == asset_id,
+                Version.sha256.is_not(None),
+                Version.file_key.is_not(None),
+            )
+        )
+    )
+    for sha256, count in blob_refs.items():
+        await db.execute(
+            update(Blob)
+            .where(Blob.sha256 == sha256)
+            .values(ref_count=Blob.ref_count - count)
+        )
+    chunk_refs = Counter(
+        await db.scalars(
+            select(VersionFile.chunk_sha256).filter(VersionFile.asset_id == asset_id)
+        )
+    )
+    await update_chunk_refs(
+        db, {sha256: -count for sha256, count in chunk_refs.items()}
+    )
 
+    await db.execute(delete(VersionFile).where(VersionFile.asset_id == asset_id))
+    # files uploaded without a hash aren't blobs, and belong to a single version
+    # (see finalize_version_upload)
+    unreferenced_keys = list(
+        await db.scalars(
+            delete(Version)
+            .where(
+                Version.asset_id == asset_id,
+                Version.sha256.is_(None),
+                Version.file_key.is_not(None),
+            )
+            .returning(Version.file_key)
+        )
+    )
+    await db.execute(delete(Version).where(Version.asset_id == asset_id))
+    await db.execute(delete(AssetKeyword).where(AssetKeyword.asset_id == asset_id))
+    await db.execute(delete(Asset).where(Asset.id == asset_id))
+    unreferenced_keys += list(
+        await db.scalars(
+            delete(Blob)
+            .where(Blob.sha256.in_(blob_refs.keys()), Blob.ref_count <= 0)
+            .returning(Blob.file_key)
+        )
+    )
+    unreferenced_keys += await db.scalars(
+        delete(Chunk)
+        .where(Chunk.sha256.in_(chunk_refs.keys()), Chunk.ref_count <= 0)
+        .returning(Chunk.file_key)
+    )
+    await db.commit()
+    await forget_asset(asset_id)
+    await update_name_index(db, str(UUID(asset_id)), None)
 
-def read_asset_exists(db: Session, asset_id: str):
+    await run_in_threadpool(delete_s3_objects, unreferenced_keys)
+
+
+async def read_asset_exists(db: AsyncSession, asset_id: str):
     try:
         query = select(Asset.asset_name).filter(Asset.id == asset_id).limit(1)
-        result = db.execute(query).scalars().first()
+        result = (await db.scalars(query)).first()
         return result is not None
     except Exception as e:
         print(e)
@@ -135,15 +481,20 @@ class AssetInfo(BaseModel):
     versions: Sequence[MVersion]
 
 
-def read_asset_info(db: Session, asset_id: str):
+ASSET_INFO = TypeAdapter(AssetInfo)
+# latest versions included in info about an asset
+ASSET_INFO_VERSIONS = 3
+
+
+async def read_asset_info(db: AsyncSession, asset_id: str):
     query = (
         select(Asset, Version)
         .outerjoin(Version, Version.asset_id == Asset.id)
         .filter(Asset.id == asset_id)
         .order_by(Version.date.desc())
-        .limit(3)
+        .limit(ASSET_INFO_VERSIONS)
     )
-    results = db.execute(query).mappings().all()
+    results = (await db.execute(query)).mappings().all()
 
     if len(results) == 0:
         return None
@@ -155,79 +506,807 @@ def read_asset_info(db: Session, asset_id: str):
     )
 
 
-def read_asset_versions(
-    db: Session, asset_id: str, sort: Literal["asc", "desc"] = "desc", offset=0
-):
-    query = (
-        select(Version)
-        .filter(Version.asset_id == asset_id)
-        .order_by(Version.date.desc() if sort == "desc" else Version.date.asc())
-        .limit(24)
-        .offset(offset)
+async def read_assets_info(db: AsyncSession, asset_ids: Collection[UUID]):
+    """
+    Reads info about many assets like `read_asset_info`, with one query for the
+    assets and one for their latest versions however many there are.
+
+    Returns:
+        dict: The info about each asset that exists, by its id.
+    """
+    ids = literal(list(set(asset_ids)), ARRAY(Uuid))
+    assets = (await db.scalars(select(Asset).filter(Asset.id == any_(ids)))).all()
+
+    # each asset's latest versions, ranked from its index entries only
+    ranked = (
+        select(
+            Version.asset_id,
+            Version.semver,
+            func.row_number()
+            .over(partition_by=Version.asset_id, order_by=Version.date.desc())
+            .label("rank"),
+        )
+        .filter(Version.asset_id == any_(ids))
+        .subquery()
     )
-    return db.execute(query).scalars().all()
+    versions = (
+        await db.scalars(
+            select(Version)
+            .join(
+                ranked,
+                (Version.asset_id == ranked.c.asset_id)
+                & (Version.semver == ranked.c.semver),
+            )
+            .filter(ranked.c.rank <= ASSET_INFO_VERSIONS)
+            .order_by(ranked.c.rank)
+        )
+    ).all()
 
+    versions_by_asset = defaultdict(list)
+    for version in versions:
+        versions_by_asset[version.asset_id].append(version)
+    return {
+        str(asset.id): AssetInfo(asset=asset, versions=versions_by_asset[asset.id])
+        for asset in assets
+    }
 
-def read_version_file(db: Session, asset_id: str, semver: str):
+
+async def read_cached_asset_info(db: AsyncSession, asset_id: str):
+    """
+    Reads info about an asset like `read_asset_info`, but from `asset_cache` if
+    it was read since the asset last changed.
     """
-    Temporarily fetches the specified version file from S3.
+    return await asset_cache.read(
+        [asset_namespace(asset_id)],
+        asset_cache_key("info", {"asset_id": asset_id}),
+        ASSET_INFO,
+        lambda: read_asset_info(db, asset_id),
+    )
+
+
+async def read_asset_versions(
+    db: AsyncSession,
+    asset_id: str,
+    sort: Literal["asc", "desc"] = "desc",
+    offset=0,
+    cursor: str | None = None,
+    limit: int = PAGE_SIZE,
+):
+    """
+    Reads a page of the versions of an asset by date, continuing after `cursor`
+    if given.
 
     Returns:
-        tuple: A tuple containing the file path and a cleanup function.
+        tuple: A tuple containing the versions, and the cursor of the next page
+        or `None` if this is the last one.
     """
+    query = select(Version).filter(Version.asset_id == asset_id).offset(offset)
+    return await read_page(
+        db,
+        query,
+        f"date_{sort}",
+        [Version.date, Version.semver],
+        sort == "desc",
+        cursor,
+        limit,
+    )
 
-    version = (
-        db.execute(
-            select(Version)
-            .filter(Version.asset_id == asset_id, Version.semver == semver)
-            .limit(1)
+
+VERSION_PAGE = TypeAdapter(tuple[list[MVersion], str | None])
+
+
+async def read_cached_asset_versions(db: AsyncSession, asset_id: str, **params):
+    """
+    Reads a page of the versions of an asset like `read_asset_versions`, but
+    from `asset_cache` if it was read since the asset last changed.
+    """
+
+    async def load():
+        (versions, next_cursor) = await read_asset_versions(db, asset_id, **params)
+        return ([MVersion.model_validate(version) for version in versions], next_cursor)
+
+    return await asset_cache.read(
+        [asset_namespace(asset_id)],
+        asset_cache_key("versions", {"asset_id": asset_id, **params}),
+        VERSION_PAGE,
+        load,
+    )
+
+
+async def read_version(db: AsyncSession, asset_id: str, semver: str):
+    return (
+        (
+            await db.execute(
+                select(Version)
+                .filter(Version.asset_id == asset_id, Version.semver == semver)
+                .limit(1)
+            )
         )
         .scalars()
         .first()
     )
+
+
+async def read_versions(db: AsyncSession, refs: Collection[tuple[UUID, str]]):
+    """
+    Reads many versions, given as pairs of asset id and semver, in one query.
+
+    Returns:
+        dict: The versions that exist, by their asset id and then semver.
+    """
+    if not refs:
+        return {}
+    query = select(Version).filter(
+        tuple_(Version.asset_id, Version.semver).in_(list(set(refs)))
+    )
+    versions = defaultdict(dict)
+    for version in await db.scalars(query):
+        versions[str(version.asset_id)][version.semver] = version
+    return versions
+
+
+async def read_version_file(
+    db: AsyncSession,
+    asset_id: str,
+    semver: str,
+    range_header: str | None = None,
+    if_range: str | None = None,
+    if_none_match: str | None = None,
+):
+    """
+    Opens a streaming read of the specified version file (or a byte range of it) from S3.
+    Versions stored as their individual files are reassembled into an archive.
+
+    Returns:
+        tuple: A tuple containing a chunk iterator and the response headers.
+        The iterator is `None` if the version or its file does not exist.
+    """
+
+    version = await read_version(db, asset_id, semver)
     if version is None:
-        return (None, lambda: None)
+        return (None, {})
+
+    if version.file_key is None:
+        return stream_chunked_archive(
+            await read_version_segments(db, version),
+            f'"{version.sha256}"',
+            version.date,
+            range_header,
+            if_range,
+            if_none_match,
+        )
+    return await run_in_threadpool(
+        s3_stream_download,
+        version.file_key,
+        range_header,
+        if_range,
+        if_none_match,
+        version.sha256,
+    )
 
-    return temp_s3_download(version.file_key)
+
+async def read_version_segments(db: AsyncSession, version: Version):
+    """
+    Reads the segments a version stored as its individual files is reassembled
+    from.
+
+    Returns:
+        list: A list of the archive's bytes stored in the database, interleaved
+        with tuples containing the file key and size of each file's chunk.
+    """
+    segments = await read_versions_segments(db, [version])
+    return segments[(str(version.asset_id), version.semver)]
+
+
+async def read_versions_segments(db: AsyncSession, versions: Sequence[Version]):
+    """
+    Reads the segments of many versions stored as their individual files like
+    `read_version_segments`, with one query for their files and one for their
+    central directories.
+
+    Returns:
+        dict: The segments of each version, by its asset id (as a string) and
+        semver.
+    """
+    if not versions:
+        return {}
+    refs = [(version.asset_id, version.semver) for version in versions]
+    query = (
+        select(
+            VersionFile.asset_id,
+            VersionFile.semver,
+            VersionFile.header,
+            Chunk.file_key,
+            Chunk.compress_size,
+        )
+        .join(Chunk, Chunk.sha256 == VersionFile.chunk_sha256)
+        .filter(tuple_(VersionFile.asset_id, VersionFile.semver).in_(refs))
+        .order_by(VersionFile.asset_id, VersionFile.semver, VersionFile.position)
+    )
+    segments = defaultdict(list)
+    for asset_id, semver, header, file_key, size in (await db.execute(query)).all():
+        segments[(str(asset_id), semver)] += [header, (file_key, size)]
+
+    # deferred, and can't be loaded lazily by an async session
+    query = select(Version.asset_id, Version.semver, Version.central_directory).filter(
+        tuple_(Version.asset_id, Version.semver).in_(refs)
+    )
+    for asset_id, semver, central_directory in (await db.execute(query)).all():
+        segments[(str(asset_id), semver)].append(central_directory)
+    return dict(segments)
+
+
+async def read_version_diff(
+    db: AsyncSession, from_version: Version, to_version: Version
+):
+    """
+    Compares the files of two versions stored as their individual files.
+    """
+
+    async def read_file_hashes(version: Version):
+        query = select(VersionFile.path, VersionFile.sha256).filter(
+            VersionFile.asset_id == version.asset_id,
+            VersionFile.semver == version.semver,
+        )
+        return dict((await db.execute(query)).all())
+
+    from_files = await read_file_hashes(from_version)
+    to_files = await read_file_hashes(to_version)
+    return VersionDiff(
+        from_semver=from_version.semver,
+        to_semver=to_version.semver,
+        added=sorted(to_files.keys() - from_files.keys()),
+        removed=sorted(from_files.keys() - to_files.keys()),
+        modified=sorted(
+            path
+            for path in to_files.keys() & from_files.keys()
+            if to_files[path] != from_files[path]
+        ),
+    )
+
+
+async def read_version_patch(
+    db: AsyncSession, from_version: Version, to_version: Version
+):
+    """
+    Opens a streaming read of a zip archive of only the files added or modified
+    in `to_version` since `from_version`, both stored as their individual files.
+
+    Returns:
+        tuple: A tuple containing a chunk iterator and the response headers.
+    """
+    from_file = aliased(VersionFile)
+    query = (
+        select(VersionFile, Chunk)
+        .join(Chunk, Chunk.sha256 == VersionFile.chunk_sha256)
+        .outerjoin(
+            from_file,
+            (from_file.asset_id == from_version.asset_id)
+            & (from_file.semver == from_version.semver)
+            & (from_file.path == VersionFile.path),
+        )
+        .filter(
+            VersionFile.asset_id == to_version.asset_id,
+            VersionFile.semver == to_version.semver,
+            or_(from_file.path.is_(None), from_file.sha256 != VersionFile.sha256),
+        )
+        .order_by(VersionFile.position)
+    )
+    return stream_chunked_zip(
+        [
+            (
+                ZipMember(
+                    path=version_file.path,
+                    date_time=version_file.date_time,
+                    compress_type=chunk.compress_type,
+                    crc32=chunk.crc32,
+                    compress_size=chunk.compress_size,
+                    file_size=chunk.file_size,
+                ),
+                chunk.file_key,
+            )
+            for (version_file, chunk) in (await db.execute(query)).all()
+        ]
+    )
+
+
+async def read_export(
+    db: AsyncSession,
+    search: str | None = None,
+    keywords: str | None = None,
+    keywords_mode: Literal["all", "any"] = "all",
+    asset_ids: Collection[UUID] = (),
+    pinned: dict[str, str] | None = None,
+):
+    """
+    Opens a streaming read of a zip archive containing the version archives of
+    many assets: those matching a search and keywords, and those with the given
+    ids, each at its pinned semver or otherwise its latest version. Assets
+    without versions are left out.
+
+    Returns:
+        tuple: A tuple containing a chunk iterator and the response headers.
+    """
+    if pinned is None:
+        pinned = {}
+    columns = select(Asset.id, Asset.asset_name, Asset.latest_semver)
+    assets = []
+    if search is not None or keywords is not None:
+        (query, _) = await filter_assets(
+            db, columns, search, keywords=keywords, keywords_mode=keywords_mode
+        )
+        assets += (await db.execute(query.limit(MAX_EXPORT_SIZE + 1))).all()
+        if len(assets) > MAX_EXPORT_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"More than {MAX_EXPORT_SIZE} assets match",
+            )
+    ids = {*asset_ids, *(UUID(asset_id) for asset_id in pinned)}
+    if ids:
+        ids = literal(list(ids), ARRAY(Uuid))
+        assets += (await db.execute(columns.filter(Asset.id == any_(ids)))).all()
+
+    if not {*pinned} <= {str(asset_id) for (asset_id, _, _) in assets}:
+        raise HTTPException(status_code=404, detail="Version not found")
+    names = {str(asset_id): name for (asset_id, name, _) in assets}
+    refs = sorted(
+        {
+            (asset_id, pinned.get(str(asset_id), latest_semver))
+            for (asset_id, _, latest_semver) in assets
+            if latest_semver is not None or str(asset_id) in pinned
+        },
+        key=lambda ref: (names[str(ref[0])], ref),
+    )
+    versions_by_asset = await read_versions(db, refs)
+    versions = []
+    for asset_id, semver in refs:
+        version = versions_by_asset.get(str(asset_id), {}).get(semver)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Version not found")
+        versions.append(version)
+
+    # versions stored whole are a single segment of their blob's size
+    stored_whole = [version for version in versions if version.file_key is not None]
+    query = select(Blob.file_key, Blob.size).filter(
+        Blob.sha256.in_([version.sha256 for version in stored_whole])
+    )
+    sizes = dict((await db.execute(query)).all())
+    file_keys = [version.file_key for version in stored_whole]
+    for file_key in file_keys:
+        if file_key not in sizes:
+            # stored before blobs were
+            sizes[file_key] = await run_in_threadpool(s3_object_size, file_key)
+            if sizes[file_key] is None:
+                raise HTTPException(status_code=404, detail="File not found")
+    segments = await read_versions_segments(
+        db, [version for version in versions if version.file_key is None]
+    )
+
+    paths = set()
+    archives = []
+    for version in versions:
+        asset_id = str(version.asset_id)
+        name = re.sub(r"[/\\]", "_", names[asset_id])
+        path = f"{name}_{version.semver}.zip"
+        if path in paths:
+            # assets with the same name
+            path = f"{name}_{asset_id[:8]}_{version.semver}.zip"
+        paths.add(path)
+        archives.append(
+            (
+                path,
+                version.date,
+                (
+                    [(version.file_key, sizes[version.file_key])]
+                    if version.file_key is not None
+                    else segments[(asset_id, version.semver)]
+                ),
+            )
+        )
+    return stream_archives_zip(archives)
+
+
+async def read_version_by_sha256(db: AsyncSession, sha256: str):
+    query = select(Version).filter(Version.sha256 == sha256.lower()).limit(1)
+    return (await db.scalars(query)).first()
+
+
+async def read_blob(db: AsyncSession, sha256: str):
+    query = select(Blob).filter(Blob.sha256 == sha256.lower()).limit(1)
+    return (await db.scalars(query)).first()
 
 
-def create_version(
-    db: Session,
-    filePath: Path,
+async def read_stored_chunks(db: AsyncSession, sha256s: Collection[str]):
+    query = select(Chunk.sha256).filter(Chunk.sha256.in_(sha256s))
+    return (await db.scalars(query)).all()
+
+
+async def read_file_key_exists(db: AsyncSession, file_key: str):
+    query = select(Version.semver).filter(Version.file_key == file_key).limit(1)
+    return (await db.scalars(query)).first() is not None
+
+
+async def create_version(
+    db: AsyncSession,
+    chunks: AsyncIterator[bytes],
     asset_id: str,
     author_pennkey: str,
     info: VersionCreate,
+    sha256: str | None = None,
 ):
-    file_key = f"{uuid4()}"
-    assets_bucket.upload_file(str(filePath.resolve()), file_key)
+    """
+    Streams a new version archive into S3 and registers it as the next version.
 
-    # check for existing version to bump semver
+    The archive is stored as its individual files, each stored once no matter
+    how many versions contain it, so only files that changed are uploaded. If
+    `sha256` is given and an identical archive was already uploaded, nothing is
+    uploaded at all; otherwise the upload is rejected unless the archive
+    matches it.
+    """
+    if sha256 is not None:
+        existing_version = await read_version_by_sha256(db, sha256)
+        if existing_version is not None:
+            return await retry_version_commit(
+                db, copy_version, existing_version, asset_id, author_pennkey, info
+            )
+
+    # the upload is written from a worker thread, which looks chunks up through
+    # the event loop the session belongs to
+    upload = await stream_chunked_upload(
+        chunks,
+        lambda sha256s: from_thread.run(read_stored_chunks, db, sha256s),
+        sha256,
+    )
+    try:
+        (db_version, duplicate_keys) = await retry_version_commit(
+            db, register_chunked_version, upload, asset_id, author_pennkey, info
+        )
+    except BaseException:
+        with anyio.CancelScope(shield=True):
+            await db.rollback()
+            if not upload.committed:
+                await run_in_threadpool(
+                    delete_s3_objects, list(upload.stored_chunks.values())
+                )
+        raise
+
+    # chunks stored meanwhile by a concurrent upload of the same files aren't needed
+    await run_in_threadpool(delete_s3_objects, duplicate_keys)
+    return db_version
+
+
+async def retry_version_commit(db: AsyncSession, register, *args):
+    """
+    Calls `register(db, *args)`, a function adding and committing a version,
+    retrying it with backoff if it fails because of a concurrent commit, e.g. by
+    deadlocking with it on shared chunks.
+    """
+    for attempt in range(VERSION_COMMIT_ATTEMPTS):
+        try:
+            return await register(db, *args)
+        except DBAPIError as e:
+            await db.rollback()
+            if getattr(e.orig, "pgcode", None) not in RETRYABLE_PGCODES:
+                raise
+            if attempt + 1 == VERSION_COMMIT_ATTEMPTS:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Too many concurrent changes to this asset, please retry",
+                )
+        # jittered, so retries of conflicting commits don't conflict again
+        await anyio.sleep(
+            VERSION_COMMIT_BACKOFF * 2**attempt * random.uniform(0.5, 1.5)
+        )
+
+
+async def copy_version(
+    db: AsyncSession,
+    source: Version,
+    asset_id: str,
+    author_pennkey: str,
+    info: VersionCreate,
+):
+    """
+    Registers the next version of an asset with the same contents as `source`,
+    sharing its stored files.
+    """
+    # reloaded, as rolling back a retried commit expires it
+    await db.refresh(
+        source, ["asset_id", "semver", "file_key", "sha256", "central_directory"]
+    )
+    if source.file_key is not None:
+        blob = await read_blob(db, source.sha256)
+        return await register_version(
+            db, source.file_key, asset_id, author_pennkey, info, blob.sha256, blob.size
+        )
+
+    version_files = (
+        await db.scalars(
+            select(VersionFile)
+            .filter(
+                VersionFile.asset_id == source.asset_id,
+                VersionFile.semver == source.semver,
+            )
+            .order_by(VersionFile.position)
+        )
+    ).all()
+    chunk_refs = Counter(version_file.chunk_sha256 for version_file in version_files)
+    # lock the asset before its chunks, so commits to it don't deadlock on them
+    await lock_asset(db, asset_id)
+    if await update_chunk_refs(db, chunk_refs) != len(chunk_refs):
+        raise HTTPException(status_code=409, detail="Version was removed, please retry")
+
+    db_version = await add_next_version(
+        db, asset_id, author_pennkey, info, None, source.sha256
+    )
+    db_version.central_directory = source.central_directory
+    await add_version_files(
+        db,
+        db_version,
+        [
+            {
+                "path": version_file.path,
+                "date_time": version_file.date_time,
+                "sha256": version_file.sha256,
+                "chunk_sha256": version_file.chunk_sha256,
+                "header": version_file.header,
+            }
+            for version_file in version_files
+        ],
+    )
+    await db.commit()
+    await forget_asset(asset_id)
+    await db.refresh(db_version)
+    return db_version
+
+
+async def register_chunked_version(
+    db: AsyncSession,
+    upload: ChunkedArchiveUpload,
+    asset_id: str,
+    author_pennkey: str,
+    info: VersionCreate,
+):
+    """
+    Inserts the next version of an asset from an archive stored as its
+    individual files, adding references to the chunks it is made of.
+
+    Returns:
+        tuple: A tuple containing the new version, and the file keys of chunks
+        the upload stored that turned out to be stored already.
+    """
+    chunk_refs = Counter(file.chunk_sha256 for file in upload.files)
+    # lock the asset before its chunks, so commits to it don't deadlock on them
+    await lock_asset(db, asset_id)
+
+    # chunks this upload didn't store were already stored by an earlier one
+    existing_refs = {
+        sha256: count
+        for sha256, count in chunk_refs.items()
+        if sha256 not in upload.stored_chunks
+    }
+    if await update_chunk_refs(db, existing_refs) != len(existing_refs):
+        raise HTTPException(status_code=409, detail="Files were removed, please retry")
+
+    # the same chunks may have been stored meanwhile, in which case those are kept
+    duplicate_keys = []
+    if upload.stored_chunks:
+        members = {file.chunk_sha256: file.member for file in upload.files}
+        query = insert(Chunk).returning(Chunk.sha256, Chunk.file_key)
+        query = query.on_conflict_do_update(
+            index_elements=[Chunk.sha256],
+            set_={"ref_count": Chunk.ref_count + query.excluded.ref_count},
+        )
+        result = await db.execute(
+            query,
+            [
+                {
+                    "sha256": sha256,
+                    "file_key": file_key,
+                    "compress_type": members[sha256].compress_type,
+                    "compress_size": members[sha256].compress_size,
+                    "file_size": members[sha256].file_size,
+                    "crc32": members[sha256].crc32,
+                    "ref_count": chunk_refs[sha256],
+                }
+                for sha256, file_key in upload.stored_chunks.items()
+            ],
+        )
+        stored_keys = dict(result.all())
+        duplicate_keys = [
+            file_key
+            for sha256, file_key in upload.stored_chunks.items()
+            if stored_keys[sha256] != file_key
+        ]
+
+    db_version = await add_next_version(
+        db, asset_id, author_pennkey, info, None, upload.sha256
+    )
+    db_version.central_directory = upload.central_directory
+    await add_version_files(
+        db,
+        db_version,
+        [
+            {
+                "path": file.member.path,
+                "date_time": file.member.date_time,
+                "sha256": file.member.sha256,
+                "chunk_sha256": file.chunk_sha256,
+                "header": file.header,
+            }
+            for file in upload.files
+        ],
+    )
+    await db.commit()
+    upload.committed = True
+    await forget_asset(asset_id)
+    await db.refresh(db_version)
+    return (db_version, duplicate_keys)
+
+
+async def update_chunk_refs(db: AsyncSession, chunk_refs: dict[str, int]):
+    """
+    Adds the given number of references to each chunk. Does not commit.
+
+    Returns:
+        int: The number of chunks updated, which is less than requested if some
+        no longer exist.
+    """
+    # chunks gaining the same number of references are updated together
+    chunks_by_count = defaultdict(list)
+    for sha256, count in chunk_refs.items():
+        chunks_by_count[count].append(sha256)
+
+    updated = 0
+    for count, sha256s in chunks_by_count.items():
+        result = await db.execute(
+            update(Chunk)
+            .where(Chunk.sha256.in_(sha256s))
+            .values(ref_count=Chunk.ref_count + count)
+            .execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount
+    return updated
+
+
+async def add_version_files(
+    db: AsyncSession, db_version: Version, version_files: list[dict]
+):
+    """
+    Inserts the files of a version stored as its individual files, in archive
+    order. Does not commit.
+    """
+    if not version_files:
+        return
+    await db.execute(
+        insert(VersionFile),
+        [
+            {
+                **version_file,
+                "asset_id": db_version.asset_id,
+                "semver": db_version.semver,
+                "position": position,
+            }
+            for (position, version_file) in enumerate(version_files)
+        ],
+    )
+
+
+async def reference_blob(db: AsyncSession, sha256: str, file_key: str, size: int):
+    """
+    Adds a reference to the blob with the given hash, creating it if needed.
+    Does not commit.
+
+    Returns:
+        str: The file key the blob is stored under, which is that of the
+        existing blob if one was already stored.
+    """
+    query = (
+        insert(Blob)
+        .values(sha256=sha256, file_key=file_key, size=size, ref_count=1)
+        .on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={"ref_count": Blob.ref_count + 1},
+        )
+        .returning(Blob.file_key)
+    )
+    return (await db.execute(query)).scalar_one()
+
+
+async def register_version(
+    db: AsyncSession,
+    file_key: str,
+    asset_id: str,
+    author_pennkey: str,
+    info: VersionCreate,
+    sha256: str | None = None,
+    size: int = 0,
+):
+    """
+    Inserts the next version of an asset, pointing at a file already in S3.
+    If the file's `sha256` is known it is stored as a shared blob.
+    """
+    if sha256 is not None:
+        file_key = await reference_blob(db, sha256, file_key, size)
+
+    db_version = await add_next_version(
+        db, asset_id, author_pennkey, info, file_key, sha256
+    )
+    await db.commit()
+    await forget_asset(asset_id)
+    await db.refresh(db_version)
+    return db_version
+
+
+async def add_next_version(
+    db: AsyncSession,
+    asset_id: str,
+    author_pennkey: str,
+    info: VersionCreate,
+    file_key: str | None,
+    sha256: str | None,
+):
+    """
+    Adds the next version of an asset, bumping the latest version's semver.
+    Does not commit.
+    """
+    # concurrent versions of the asset are numbered one at a time
+    db_asset = await lock_asset(db, asset_id)
+
+    # check for existing version to bump, which only reads the index
     existing_version = (
-        db.execute(
-            select(Version)
+        await db.execute(
+            select(Version.major, Version.minor)
             .filter(Version.asset_id == asset_id)
-            .order_by(Version.semver.desc())
+            .order_by(Version.major.desc(), Version.minor.desc())
             .limit(1)
         )
-        .scalars()
-        .first()
-    )
+    ).first()
 
     # if no existing version, use 0.1
     if existing_version is None:
-        new_semver = "0.1"
+        (major, minor) = (0, 1)
+    elif info.is_major:
+        (major, minor) = (existing_version.major + 1, 0)
     else:
-        ver = semver.Version.parse(f"{existing_version.semver}.0")
-        new_semver = str(ver.next_version("major" if info.is_major else "minor"))[:-2]
+        (major, minor) = (existing_version.major, existing_version.minor + 1)
+    new_semver = f"{major}.{minor}"
 
     db_version = Version(
         asset_id=asset_id,
         semver=new_semver,
+        major=major,
+        minor=minor,
         author_pennkey=author_pennkey,
         file_key=file_key,
+        sha256=sha256,
         message=info.message,
     )
     db.add(db_version)
-    db.commit()
-    db.refresh(db_version)
+    # now() is the same throughout the transaction, i.e. the version's date
+    db_asset.latest_version_date = func.now()
+    db_asset.latest_semver = new_semver
+    await db.flush()
     return db_version
+
+
+async def lock_asset(db: AsyncSession, asset_id: str):
+    """
+    Locks an asset until the end of the transaction, so concurrent changes to
+    it (e.g. adding versions) happen one at a time.
+    """
+    db_asset = (
+        (
+            await db.execute(
+                select(Asset)
+                .filter(Asset.id == asset_id)
+                .with_for_update()
+                .execution_options(populate_existing=True)
+            )
+        )
+        .scalars()
+        .first()
+    )
+    if db_asset is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return db_asset
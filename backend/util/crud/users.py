@@ -1,14 +1,42 @@
-import bcrypt
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
 from fastapi import HTTPException
-from sqlalchemy import or_, select
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, event, func, inspect, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from schemas.models import UserCreate
+from schemas.models import UserCreate, User as MUser
 
-from database.models import User
+from database.models import RefreshTokenFamily, User
+from util.cache import TTLCache
+from util.passwords import check_password, hash_password
 
+# users that requests were authenticated as, so most requests skip the lookup
+USER_CACHE_SIZE = 1024
+USER_CACHE_SECONDS = 60
 
-def read_users(db: Session, query: str | None = None, offset: int = 0):
+user_cache: TTLCache[MUser] = TTLCache(USER_CACHE_SIZE, USER_CACHE_SECONDS)
+
+# seconds a replaced refresh token can still be exchanged (for the latest one),
+# so a client refreshing from several requests at once isn't logged out
+REFRESH_TOKEN_REUSE_SECONDS = 30
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def forget_user(mapper, connection, target: User):
+    # also when changed elsewhere in this process, e.g. through sqladmin
+    user_cache.pop(target.pennkey)
+
+
+@event.listens_for(User, "before_update")
+def revoke_refresh_tokens(mapper, connection, target: User):
+    # a new password logs out everywhere else, wherever it was changed
+    if inspect(target).attrs.hashed_password.history.has_changes():
+        target.token_generation = User.token_generation + 1
+
+
+async def read_users(db: AsyncSession, query: str | None = None, offset: int = 0):
     q = select(User).offset(offset).limit(40)
 
     if query is not None:
@@ -21,15 +49,17 @@ def read_users(db: Session, query: str | None = None, offset: int = 0):
         )
 
     try:
-        return db.execute(q).scalars().all()
+        return (await db.execute(q)).scalars().all()
     except Exception as e:
         raise e
 
 
 # Create User
-def create_user(db: Session, user: UserCreate):
+async def create_user(db: AsyncSession, user: UserCreate):
     print("troll")
-    hashed_password = bcrypt.hashpw(user.password.encode("utf-8"), bcrypt.gensalt())
+    # hashing is slow, so don't keep a pooled connection checked out meanwhile
+    await db.close()
+    hashed_password = await hash_password(user.password)
 
     db_user = User(
         pennkey=user.pennkey,
@@ -41,27 +71,27 @@ def create_user(db: Session, user: UserCreate):
 
     try:
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(e)
         raise HTTPException(status_code=500, detail="User could not be created")
 
     return db_user
 
 
-def read_user_exists(db: Session, pennkey: str):
+async def read_user_exists(db: AsyncSession, pennkey: str):
     query = select(User).filter(User.pennkey == pennkey).limit(1)
-    result = db.execute(query).scalars().first()
+    result = (await db.execute(query)).scalars().first()
 
     return result is not None
 
 
-def read_user(db: Session, pennkey: str):
+async def read_user(db: AsyncSession, pennkey: str):
     query = select(User).filter(User.pennkey == pennkey).limit(1)
-    user = db.execute(query).scalars().first()
+    user = (await db.execute(query)).scalars().first()
 
     if user is None:
         return None
@@ -69,12 +99,93 @@ def read_user(db: Session, pennkey: str):
     return user
 
 
-def authenticate_user(db: Session, pennkey: str, password: str):
-    user = read_user(db, pennkey)
+async def read_cached_user(db: AsyncSession, pennkey: str):
+    """
+    Reads a user like `read_user`, but from `user_cache` if it was read recently.
+    """
+    user = user_cache.get(pennkey)
+    if user is None:
+        db_user = await read_user(db, pennkey)
+        if db_user is None:
+            return None
+        user = MUser.model_validate(db_user)
+        user_cache.set(pennkey, user)
+    return user
+
+
+async def create_refresh_token_family(
+    db: AsyncSession, user: User, lifetime: timedelta
+):
+    """
+    Starts a family of refresh tokens for a new login, dropping the user's
+    families whose latest token is older than `lifetime` (and so expired).
+
+    Returns:
+        RefreshTokenFamily: The new family, at generation 0.
+    """
+    await db.execute(
+        delete(RefreshTokenFamily).where(
+            RefreshTokenFamily.pennkey == user.pennkey,
+            RefreshTokenFamily.issued_at < func.now() - lifetime,
+        )
+    )
+    family = RefreshTokenFamily(
+        pennkey=user.pennkey, user_generation=user.token_generation
+    )
+    db.add(family)
+    await db.commit()
+    return family
+
+
+async def rotate_refresh_token(db: AsyncSession, family_id: UUID, generation: int):
+    """
+    Moves a family of refresh tokens on to its next generation if `generation`
+    is its latest, so each refresh token can be used once. A token replaced in
+    the last REFRESH_TOKEN_REUSE_SECONDS is exchanged for the latest generation
+    again instead. Using any older one revokes the family, as the token was
+    probably stolen.
+
+    Returns:
+        RefreshTokenFamily: The family, or `None` if it was revoked (also by the
+        user changing their password) or its user no longer exists.
+    """
+    query = (
+        select(RefreshTokenFamily)
+        .join(User, User.pennkey == RefreshTokenFamily.pennkey)
+        .where(
+            RefreshTokenFamily.id == family_id,
+            RefreshTokenFamily.user_generation == User.token_generation,
+        )
+        .with_for_update(of=RefreshTokenFamily)
+    )
+    family = (await db.scalars(query)).first()
+    if family is None:
+        await db.rollback()
+        return None
+
+    now = datetime.now(timezone.utc)
+    if generation == family.generation:
+        family.generation += 1
+        family.issued_at = now
+    elif generation != family.generation - 1 or family.issued_at < now - timedelta(
+        seconds=REFRESH_TOKEN_REUSE_SECONDS
+    ):
+        await db.delete(family)
+        await db.commit()
+        return None
+    await db.commit()
+    return family
+
+
+async def authenticate_user(db: AsyncSession, pennkey: str, password: str):
+    user = await read_user(db, pennkey)
     if user is None:
         return None
 
-    if not bcrypt.checkpw(password.encode("utf-8"), user.hashed_password):
+    # checking is slow, so don't keep a pooled connection checked out meanwhile;
+    # closing leaves `user` loaded
+    await db.close()
+    if not await check_password(password, user.hashed_password):
         return None
 
     return user
@@ -1,35 +1,506 @@
-from contextlib import contextmanager
-import os
-from pathlib import Path
-import shutil
-from tempfile import NamedTemporaryFile, TemporaryDirectory, TemporaryFile, gettempdir
-from fastapi import UploadFile
+from base64 import b64encode
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import hashlib
+from queue import Full, Queue
+import re
+from threading import Event
+from typing import AsyncIterator, Iterator, Sequence
+import anyio
+from botocore.exceptions import ClientError
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 
+from settings import PRESIGNED_URL_EXPIRE_SECONDS
 from util.s3 import assets_bucket
-from botocore.exceptions import NoCredentialsError
 
+# size of the chunks read from S3 while streaming a download
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
-def save_upload_file_temp(upload_file: UploadFile) -> Path | None:
-    if (upload_file.filename is None) or (upload_file.filename == ""):
+# when reading many objects in a row, how many are read ahead of the one being
+# sent and how many chunks of each are held at most, which bounds the memory
+# of each read to a handful of chunks
+PREFETCH_OBJECTS = 4
+PREFETCH_CHUNKS = 2
+
+# S3 requires every part of a multipart upload except the last to be >= 5 MiB
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+
+# parts of a single upload that may be in flight to S3 at once; together with
+# the part being filled this bounds memory per upload to a handful of parts
+UPLOAD_MAX_INFLIGHT_PARTS = 4
+
+# shared by all uploads so the total number of S3 connections stays bounded
+upload_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="s3-upload")
+
+# only a single byte range is supported, which is all S3 supports as well
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class S3StreamingUpload:
+    """
+    Uploads data to S3 as it is written, hashing it on the fly.
+
+    Once a full part has been buffered it is sent as part of a multipart upload
+    in the background, so reading the next part overlaps with uploading the
+    previous ones. Files smaller than a single part are sent with one PUT.
+    """
+
+    def __init__(self, file_key: str):
+        self.file_key = file_key
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._upload_id: str | None = None
+        self._parts: list[Future] = []
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, data: bytes):
+        self._hash.update(data)
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= UPLOAD_PART_SIZE:
+            self._submit_part(bytes(self._buffer[:UPLOAD_PART_SIZE]))
+            del self._buffer[:UPLOAD_PART_SIZE]
+
+    def complete(self):
+        """
+        Finishes the upload.
+        """
+        client = assets_bucket.meta.client
+        if self._upload_id is None:
+            client.put_object(
+                Bucket=assets_bucket.name, Key=self.file_key, Body=bytes(self._buffer)
+            )
+            self._buffer.clear()
+            return
+
+        if len(self._buffer) > 0:
+            self._submit_part(bytes(self._buffer))
+            self._buffer.clear()
+        parts = [part.result() for part in self._parts]
+        client.complete_multipart_upload(
+            Bucket=assets_bucket.name,
+            Key=self.file_key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
+    def abort(self):
+        """
+        Cancels the upload and discards any parts already sent to S3.
+        """
+        self._buffer.clear()
+        if self._upload_id is None:
+            return
+        for part in self._parts:
+            part.cancel()
+        wait(self._parts)
+        assets_bucket.meta.client.abort_multipart_upload(
+            Bucket=assets_bucket.name, Key=self.file_key, UploadId=self._upload_id
+        )
+        self._upload_id = None
+
+    def _submit_part(self, data: bytes):
+        if self._upload_id is None:
+            self._upload_id = assets_bucket.meta.client.create_multipart_upload(
+                Bucket=assets_bucket.name, Key=self.file_key
+            )["UploadId"]
+
+        # block until there is room, which bounds how much memory is held in parts
+        in_flight = [part for part in self._parts if not part.done()]
+        while len(in_flight) >= UPLOAD_MAX_INFLIGHT_PARTS:
+            (_, pending) = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight = list(pending)
+        # fail fast if an earlier part couldn't be uploaded
+        for part in self._parts:
+            if part.done():
+                part.result()
+
+        part_number = len(self._parts) + 1
+        self._parts.append(
+            upload_executor.submit(
+                self._upload_part, self._upload_id, part_number, data
+            )
+        )
+
+    def _upload_part(self, upload_id: str, part_number: int, data: bytes):
+        response = assets_bucket.meta.client.upload_part(
+            Bucket=assets_bucket.name,
+            Key=self.file_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+
+async def iter_upload_file(upload_file: UploadFile) -> AsyncIterator[bytes]:
+    try:
+        while chunk := await upload_file.read(UPLOAD_PART_SIZE):
+            yield chunk
+    finally:
+        await upload_file.close()
+
+
+async def write_upload(chunks: AsyncIterator[bytes], upload, *complete_args):
+    """
+    Writes chunks (e.g. a request body) to an upload as they arrive, from a
+    worker thread in batches of about a part. The upload is anything with
+    `write`, `complete` and `abort` methods, and is aborted on any failure.
+    """
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= UPLOAD_PART_SIZE:
+                await run_in_threadpool(upload.write, bytes(buffer))
+                buffer.clear()
+        await run_in_threadpool(upload.write, bytes(buffer))
+        await run_in_threadpool(upload.complete, *complete_args)
+    except BaseException:
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(upload.abort)
+        raise
+
+
+def parse_range_header(range_header: str | None) -> str | None:
+    """
+    Validates a `Range` header for a single byte range.
+
+    Returns:
+        str: The range to forward to S3, or `None` if the header should be
+        ignored and the full object served.
+    """
+    if range_header is None:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+    (start, end) = match.groups()
+    if start == "" and end == "":
+        return None
+    if start != "" and end != "" and int(start) > int(end):
+        return None
+    return f"bytes={start}-{end}"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Checks an `If-None-Match` header against an ETag, using weak comparison.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in tags
+
+
+def get_if_range_condition(if_range: str, etag: str | None = None) -> dict | None:
+    """
+    Maps an `If-Range` header onto the equivalent S3 precondition, so that the
+    ranged GET fails (and we fall back to the full object) if it has changed.
+    If the object's `etag` is already known, ETag validators are checked here.
+
+    Returns:
+        dict: Extra arguments for `GetObject`, or `None` if the validator can
+        never match (e.g. a weak ETag).
+    """
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        if etag is not None:
+            return {} if if_range == etag else None
+        return {"IfMatch": if_range}
+    if if_range.startswith("W/"):
+        return None
+    try:
+        return {"IfUnmodifiedSince": parsedate_to_datetime(if_range)}
+    except (TypeError, ValueError):
+        return None
+
+
+def resolve_range(range_header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Resolves a `Range` header against a file of `size` bytes, for files we
+    serve ourselves rather than straight from S3.
+
+    Returns:
+        tuple: The first and last byte (inclusive) to send, or `None` if the
+        header should be ignored and the full file served.
+    """
+    byte_range = parse_range_header(range_header)
+    if byte_range is None:
         return None
+    (start, end) = RANGE_PATTERN.match(byte_range).groups()
+    if start == "":
+        # suffix range, i.e. the last `end` bytes (of which there must be some)
+        length = int(end)
+        (start, end) = (max(size - length, 0) if length > 0 else size, size - 1)
+    else:
+        (start, end) = (int(start), size - 1 if end == "" else min(int(end), size - 1))
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return (start, end)
+
+
+def if_range_matches(if_range: str, etag: str, last_modified: datetime) -> bool:
+    """
+    Checks an `If-Range` validator against a file we serve ourselves. ETags use
+    strong comparison and dates must match exactly, per RFC 9110.
+    """
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    try:
+        date = parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+    if date.tzinfo is None:
+        return False
+    return date == last_modified.replace(microsecond=0)
+
+
+def s3_stream_download(
+    file_key: str,
+    range_header: str | None = None,
+    if_range: str | None = None,
+    if_none_match: str | None = None,
+    sha256: str | None = None,
+):
+    """
+    Opens a streaming read of an object in S3. Nothing is written to local disk;
+    chunks are yielded as they arrive from S3.
+
+    A single-range `Range` header is mapped onto a ranged S3 `GetObject`, and is
+    only honored if the optional `If-Range` validator still matches. If the
+    object's `sha256` is known it is used as the ETag, so `If-None-Match` can be
+    answered with a 304 without contacting S3 at all.
+
+    Returns:
+        tuple: A tuple containing a chunk iterator and the response headers, or
+        `(None, {})` if the object does not exist. The headers include
+        `Content-Range` if only part of the object is returned.
+    """
+    etag = None if sha256 is None else f'"{sha256}"'
+    if etag is not None and if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+
+    s3_object = assets_bucket.Object(file_key)
+    byte_range = parse_range_header(range_header)
+
+    get_args = {}
+    if etag is None and if_none_match is not None:
+        get_args["IfNoneMatch"] = if_none_match
+    if byte_range is not None:
+        condition = {} if if_range is None else get_if_range_condition(if_range, etag)
+        if condition is not None:
+            get_args.update({"Range": byte_range, **condition})
+
+    try:
+        try:
+            response = s3_object.get(**get_args)
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code == "304":
+                raise HTTPException(status_code=304, headers={"ETag": s3_object.e_tag})
+            if error_code == "InvalidRange":
+                raise HTTPException(
+                    status_code=416,
+                    detail="Requested range not satisfiable",
+                    headers={"Content-Range": f"bytes */{s3_object.content_length}"},
+                )
+            if error_code not in ("PreconditionFailed", "412"):
+                raise
+            # If-Range didn't match, so the whole object is sent instead
+            get_args.pop("Range")
+            get_args.pop("IfMatch", None)
+            get_args.pop("IfUnmodifiedSince", None)
+            response = s3_object.get(**get_args)
+    except assets_bucket.meta.client.exceptions.NoSuchKey:
+        return (None, {})
+
+    body = response["Body"]
+
+    def iter_chunks():
+        try:
+            yield from body.iter_chunks(DOWNLOAD_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    headers = {
+        "Content-Length": str(response["ContentLength"]),
+        "ETag": response["ETag"] if etag is None else etag,
+        "Last-Modified": format_datetime(
+            response["LastModified"].astimezone(timezone.utc), usegmt=True
+        ),
+        "Accept-Ranges": "bytes",
+    }
+    if "ContentRange" in response:
+        headers["Content-Range"] = response["ContentRange"]
+    return (iter_chunks(), headers)
+
+
+def prefetch_s3_objects(file_keys: Sequence[str]) -> Iterator[Iterator[bytes]]:
+    """
+    Reads objects from S3 one after another, with the next few already being
+    read in the background so there is no waiting on S3 between them. Each
+    read has its own threads, so reads can't hold up one another.
+
+    Returns:
+        Iterator: An iterator over an iterator of the chunks of each object,
+        which must be exhausted before moving on to the next object.
+    """
+    stopped = Event()
+    executor = ThreadPoolExecutor(PREFETCH_OBJECTS, thread_name_prefix="s3-prefetch")
+    reads: deque[Queue] = deque()
+    remaining = iter(file_keys)
+
+    def read_next():
+        file_key = next(remaining, None)
+        if file_key is not None:
+            chunks = Queue(PREFETCH_CHUNKS)
+            executor.submit(read_s3_object, file_key, chunks, stopped)
+            reads.append(chunks)
+
+    def iter_chunks(chunks: Queue):
+        while (chunk := chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
     try:
-        suffix = Path(upload_file.filename).suffix
-        with NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            shutil.copyfileobj(upload_file.file, tmp)
-            temp_path = Path(tmp.name)
+        for _ in range(PREFETCH_OBJECTS):
+            read_next()
+        while reads:
+            chunks = reads.popleft()
+            read_next()
+            yield iter_chunks(chunks)
     finally:
-        upload_file.file.close()
-    return temp_path
+        # e.g. the client went away, so stop reading ahead
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
 
+def read_s3_object(file_key: str, chunks: Queue, stopped: Event):
+    """
+    Reads an object into `chunks`, followed by `None` or the error it failed
+    with, until `stopped` is set.
+    """
 
-def temp_s3_download(file_key: str):
-    temp_path = Path(gettempdir()) / file_key
-    assets_bucket.download_file(file_key, str(temp_path))
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
 
-    def cleanup():
+    try:
+        body = assets_bucket.Object(file_key).get()["Body"]
         try:
-            os.remove(temp_path)
-        except FileNotFoundError:
-            pass
+            for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                if not put(chunk):
+                    return
+        finally:
+            body.close()
+    except Exception as e:
+        put(e)
+        return
+    put(None)
+
+
+def presign_download(file_key: str) -> str:
+    return assets_bucket.meta.client.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": assets_bucket.name,
+            "Key": file_key,
+            "ResponseContentType": "application/zip",
+        },
+        ExpiresIn=PRESIGNED_URL_EXPIRE_SECONDS,
+    )
+
+
+def presign_upload(file_key: str, sha256: str | None = None) -> str:
+    """
+    Presigns a single PUT of a file. If `sha256` is given, S3 will reject the
+    upload unless it is sent with a matching `x-amz-checksum-sha256` header.
+    """
+    params = {"Bucket": assets_bucket.name, "Key": file_key}
+    if sha256 is not None:
+        params["ChecksumSHA256"] = b64encode(bytes.fromhex(sha256)).decode()
+    return assets_bucket.meta.client.generate_presigned_url(
+        "put_object",
+        Params=params,
+        ExpiresIn=PRESIGNED_URL_EXPIRE_SECONDS,
+    )
+
+
+def presign_multipart_upload(file_key: str, part_count: int):
+    """
+    Starts a multipart upload and presigns a URL for each of its parts.
+
+    Returns:
+        tuple: A tuple containing the upload id and the list of part URLs.
+    """
+    client = assets_bucket.meta.client
+    response = client.create_multipart_upload(Bucket=assets_bucket.name, Key=file_key)
+    upload_id = response["UploadId"]
+    part_urls = [
+        client.generate_presigned_url(
+            "upload_part",
+            Params={
+                "Bucket": assets_bucket.name,
+                "Key": file_key,
+                "UploadId": upload_id,
+                "PartNumber": part_number,
+            },
+            ExpiresIn=PRESIGNED_URL_EXPIRE_SECONDS,
+        )
+        for part_number in range(1, part_count + 1)
+    ]
+    return (upload_id, part_urls)
+
+
+def complete_multipart_upload(file_key: str, upload_id: str, parts: list[dict]):
+    assets_bucket.meta.client.complete_multipart_upload(
+        Bucket=assets_bucket.name,
+        Key=file_key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": parts},
+    )
+
+
+def s3_object_size(file_key: str) -> int | None:
+    """
+    Returns:
+        int: The size of the object in bytes, or `None` if it does not exist.
+    """
+    try:
+        response = assets_bucket.meta.client.head_object(
+            Bucket=assets_bucket.name, Key=file_key
+        )
+    except ClientError:
+        return None
+    return response["ContentLength"]
+
 
-    return (temp_path, cleanup)
+def delete_s3_objects(file_keys: list[str]):
+    # S3 deletes at most 1000 keys per request
+    for i in range(0, len(file_keys), 1000):
+        assets_bucket.delete_objects(
+            Delete={
+                "Objects": [{"Key": file_key} for file_key in file_keys[i : i + 1000]],
+                "Quiet": True,
+            }
+        )
@@ -0,0 +1,96 @@
+"""
+An in-memory index of asset names, so names can be suggested as they are typed
+without reading every asset. Names are matched by their start, or the start of
+any word in them (including words of camelCase names), case-insensitively.
+"""
+
+from bisect import bisect_left, insort
+import re
+from typing import Iterable
+
+# where words other than the first start: after separators, and at the capital
+# letters of camelCase
+WORD_START_PATTERN = re.compile(r"(?<=[\s_\-.])\w|(?<=[a-z0-9])[A-Z]")
+
+
+class NameIndex:
+    def __init__(self):
+        # (casefolded name, name, asset id), kept sorted
+        self.names: list[tuple[str, str, str]] = []
+        # the same, but of the rest of the name from each word after the first
+        self.words: list[tuple[str, str, str]] = []
+        self.names_by_id: dict[str, str] = {}
+        # the count of asset changes the index was last read at (see
+        # AssetChanges), or `None` if it was never read, and when that count
+        # was last compared with the database's
+        self.counter: int | None = None
+        self.checked_at = float("-inf")
+
+    def build(self, assets: Iterable[tuple[str, str]], counter: int):
+        """
+        Replaces the index with the given asset ids and names.
+        """
+        self.names_by_id = {str(asset_id): name for (asset_id, name) in assets}
+        self.names = sorted(
+            (name.casefold(), name, asset_id)
+            for (asset_id, name) in self.names_by_id.items()
+        )
+        self.words = sorted(
+            entry
+            for (asset_id, name) in self.names_by_id.items()
+            for entry in word_entries(asset_id, name)
+        )
+        self.counter = counter
+
+    def add(self, asset_id: str, name: str):
+        """
+        Adds an asset's name, replacing its previous name if it had one.
+        """
+        self.remove(asset_id)
+        self.names_by_id[asset_id] = name
+        insort(self.names, (name.casefold(), name, asset_id))
+        for entry in word_entries(asset_id, name):
+            insort(self.words, entry)
+
+    def remove(self, asset_id: str):
+        name = self.names_by_id.pop(asset_id, None)
+        if name is None:
+            return
+        for entries, entry in [
+            (self.names, (name.casefold(), name, asset_id)),
+            *((self.words, entry) for entry in word_entries(asset_id, name)),
+        ]:
+            i = bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+
+    def suggest(self, prefix: str, limit: int) -> list[tuple[str, str]]:
+        """
+        Returns:
+            list: The ids and names of up to `limit` assets whose names start
+            with `prefix`, alphabetically, followed by those with a word
+            starting with it.
+        """
+        prefix = prefix.casefold()
+        matches: dict[str, str] = {}
+        for entries in (self.names, self.words):
+            i = bisect_left(entries, (prefix,))
+            while (
+                len(matches) < limit
+                and i < len(entries)
+                and entries[i][0].startswith(prefix)
+            ):
+                (_, name, asset_id) = entries[i]
+                matches.setdefault(asset_id, name)
+                i += 1
+        return list(matches.items())
+
+    def sorted_names(self) -> list[str]:
+        return [name for (_, name, _) in self.names]
+
+
+def word_entries(asset_id: str, name: str):
+    return [
+        (name[match.start() :].casefold(), name, asset_id)
+        for match in WORD_START_PATTERN.finditer(name)
+    ]
@@ -0,0 +1,109 @@
+"""
+Keyset ("cursor") pagination: each page continues after the sort key of the
+last row of the previous one, so reading a page costs the same however deep
+it is, and pages don't shift as rows are added before them.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+import json
+from uuid import UUID
+from fastapi import HTTPException
+from sqlalchemy import literal, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# page size unless one is requested, and the largest that can be
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(order: str, values) -> str:
+    def encode(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, UUID):
+            return str(value)
+        return value
+
+    data = json.dumps([order, [encode(value) for value in values]])
+    return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, order: str, count: int) -> list:
+    try:
+        data = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        (cursor_order, values) = json.loads(data)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_order != order or len(values) != count:
+        # e.g. a cursor from the same listing with a different sort
+        raise HTTPException(status_code=400, detail="Cursor does not match sort")
+    return values
+
+
+def decode_value(column, value):
+    """
+    Turns a value from a cursor back into the type of its column, which asyncpg
+    needs to bind it.
+    """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    try:
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type is UUID:
+            return UUID(value)
+        if python_type is float:
+            return float(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(value, python_type):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value
+
+
+async def read_page(
+    db: AsyncSession,
+    query,
+    order: str,
+    keys: list,
+    descending: bool = False,
+    cursor: str | None = None,
+    limit: int = PAGE_SIZE,
+):
+    """
+    Reads a page of `query`, ordered by the `keys` columns (the last of which
+    must be unique, e.g. a primary key) and starting after `cursor`. `order`
+    names the ordering, so cursors can't be used with a different one. Any
+    offset of `query` only applies to the first page, as after `cursor` it would
+    skip rows.
+
+    Returns:
+        tuple: A tuple containing the rows of the page, and the cursor of the
+        next page or `None` if this is the last one.
+    """
+    query = query.add_columns(*keys)
+    if cursor is not None:
+        values = decode_cursor(cursor, order, len(keys))
+        query = query.offset(None)
+        key = tuple_(*keys)
+        after = tuple_(
+            *(
+                literal(decode_value(column, value), column.type)
+                for (column, value) in zip(keys, values)
+            )
+        )
+        query = query.filter(key < after if descending else key > after)
+    query = query.order_by(
+        *(column.desc() if descending else column.asc() for column in keys)
+    )
+    # one more row than the page tells whether there is a next page
+    rows = (await db.execute(query.limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(order, rows[-1][1:])
+    return ([row[0] for row in rows], next_cursor)
@@ -0,0 +1,59 @@
+"""
+Password hashing, which is slow on purpose and so runs in a separate pool of
+processes, where it neither blocks the event loop nor holds the GIL.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import bcrypt
+
+from settings import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawned rather than forked, as the server has threads running
+        _executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_lower_priority,
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def _lower_priority():
+    # when CPUs are scarce, requests get them before logins do
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+
+def _hash_password(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(password: bytes, hashed_password: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed_password)
+
+
+async def hash_password(password: str) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), _hash_password, password.encode("utf-8"), BCRYPT_ROUNDS
+    )
+
+
+async def check_password(password: str, hashed_password: bytes) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), _check_password, password.encode("utf-8"), hashed_password
+    )
@@ -0,0 +1,528 @@
+"""
+Streaming reading and writing of zip archives, one member at a time and
+without ever holding (or seeking in) the whole archive.
+
+See https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT for the format.
+"""
+
+from datetime import datetime
+import hashlib
+import struct
+from typing import Iterator, Sequence, TypeVar
+import zlib
+
+from pydantic import BaseModel
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+ZIP64_END_SIGNATURE = b"PK\x06\x06"
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+END_SIGNATURE = b"PK\x05\x06"
+
+# signature, version, flags, method, time, date, crc, sizes, name & extra lengths
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+# signature, versions, flags, method, time, date, crc, sizes, name, extra &
+# comment lengths, disk, internal & external attributes, local header offset
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+ZIP64_END = struct.Struct("<4sQ2H2L4Q")
+ZIP64_LOCATOR = struct.Struct("<4sLQL")
+END = struct.Struct("<4s4H2LH")
+EXTRA_HEADER = struct.Struct("<2H")
+
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+FLAG_ENCRYPTED = 0x0001
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8 = 0x0800
+
+STORED = 0
+DEFLATED = 8
+
+# zip spec versions needed to extract
+DEFAULT_VERSION = 20
+ZIP64_VERSION = 45
+
+# MS-DOS directory attribute
+DIRECTORY_ATTRIBUTE = 0x10
+
+# bound on the decompressed data held at once while hashing a member
+DECOMPRESS_BUFFER_SIZE = 1024 * 1024
+
+
+class InvalidArchiveError(Exception):
+    pass
+
+
+class ZipMember(BaseModel):
+    path: str
+    date_time: datetime
+    compress_type: int
+    crc32: int = 0
+    compress_size: int = 0
+    file_size: int = 0
+    # sha256 of the uncompressed contents, known once the member has been read
+    sha256: str | None = None
+
+
+def from_dos_datetime(dos_date: int, dos_time: int) -> datetime:
+    return datetime(
+        1980 + (dos_date >> 9),
+        max((dos_date >> 5) & 0xF, 1),
+        max(dos_date & 0x1F, 1),
+        min(dos_time >> 11, 23),
+        min((dos_time >> 5) & 0x3F, 59),
+        min((dos_time & 0x1F) * 2, 59),
+    )
+
+
+def to_dos_datetime(date_time: datetime) -> tuple[int, int]:
+    """
+    Returns:
+        tuple: A tuple containing the MS-DOS date and time.
+    """
+    if date_time.year < 1980:
+        date_time = datetime(1980, 1, 1)
+    dos_date = (date_time.year - 1980) << 9 | date_time.month << 5 | date_time.day
+    dos_time = date_time.hour << 11 | date_time.minute << 5 | date_time.second // 2
+    return (dos_date, dos_time)
+
+
+class ZipStreamReader:
+    """
+    Incrementally parses a zip archive from its local file headers as its bytes
+    arrive, rather than from the central directory at its end.
+
+    `feed` yields `("start", member)`, then `("data", bytes)` with the member's
+    compressed data as stored in the archive, then `("end", member)` once its
+    CRC, sizes and sha256 are known. All other bytes of the archive (headers,
+    data descriptors and everything from the central directory on) are yielded
+    as `("raw", bytes)`, so the archive can be rebuilt byte for byte. Only stored and deflated members are
+    supported. Members written with data descriptors (i.e. by a streaming zip
+    writer) are delimited by decompressing them, or for stored members by
+    scanning for a descriptor that matches the data read so far.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._buffer = bytearray()
+        self._state = "header"
+        self._member: ZipMember | None = None
+        self._flags = 0
+        self._zip64 = False
+        self._remaining = 0
+
+    def feed(self, data: bytes) -> Iterator[tuple[str, ZipMember | bytes]]:
+        if self.done:
+            if len(data) > 0:
+                yield ("raw", data)
+            return
+        self._buffer += data
+        position = 0
+        try:
+            while not self.done:
+                state = self._state
+                if state == "header":
+                    (new_position, events) = self._read_header(position)
+                elif state == "data":
+                    (new_position, events) = self._read_data(position)
+                else:
+                    (new_position, events) = self._read_descriptor(position)
+                yield from events
+                if new_position == position and self._state == state and not events:
+                    # more data is needed
+                    break
+                position = new_position
+        finally:
+            del self._buffer[:position]
+            if self.done:
+                self._buffer.clear()
+
+    def close(self):
+        if not self.done:
+            raise InvalidArchiveError("Archive is truncated")
+
+    def _read_header(self, position: int):
+        buffer = self._buffer
+        if len(buffer) - position < 4:
+            return (position, [])
+
+        signature = bytes(buffer[position : position + 4])
+        if signature in (CENTRAL_HEADER_SIGNATURE, ZIP64_END_SIGNATURE, END_SIGNATURE):
+            # all members have been read, and the central directory isn't needed
+            self.done = True
+            return (len(buffer), [("raw", bytes(buffer[position:]))])
+        if signature != LOCAL_HEADER_SIGNATURE:
+            raise InvalidArchiveError("Not a zip archive")
+
+        if len(buffer) - position < LOCAL_HEADER.size:
+            return (position, [])
+        (
+            _,
+            _,
+            flags,
+            compress_type,
+            dos_time,
+            dos_date,
+            crc32,
+            compress_size,
+            file_size,
+            name_length,
+            extra_length,
+        ) = LOCAL_HEADER.unpack_from(buffer, position)
+        header_end = position + LOCAL_HEADER.size + name_length + extra_length
+        if len(buffer) < header_end:
+            return (position, [])
+
+        if flags & FLAG_ENCRYPTED:
+            raise InvalidArchiveError("Encrypted archives are not supported")
+        if compress_type not in (STORED, DEFLATED):
+            raise InvalidArchiveError("Only stored and deflated files are supported")
+
+        name_start = position + LOCAL_HEADER.size
+        name = bytes(buffer[name_start : name_start + name_length])
+        extra = bytes(buffer[name_start + name_length : header_end])
+
+        self._zip64 = False
+        for field_id, field in iter_extra_fields(extra):
+            if field_id == ZIP64_EXTRA_ID:
+                self._zip64 = True
+                if file_size == ZIP64_LIMIT and len(field) >= 8:
+                    (file_size,) = struct.unpack_from("<Q", field)
+                    field = field[8:]
+                if compress_size == ZIP64_LIMIT and len(field) >= 8:
+                    (compress_size,) = struct.unpack_from("<Q", field)
+
+        self._flags = flags
+        self._member = ZipMember(
+            path=name.decode("utf-8" if flags & FLAG_UTF8 else "cp437"),
+            date_time=from_dos_datetime(dos_date, dos_time),
+            compress_type=compress_type,
+            crc32=crc32,
+            compress_size=compress_size,
+            file_size=file_size,
+        )
+        self._remaining = compress_size
+        self._crc = 0
+        self._hash = hashlib.sha256()
+        self._read_compress_size = 0
+        self._read_file_size = 0
+        self._decompressor = (
+            zlib.decompressobj(-zlib.MAX_WBITS) if compress_type == DEFLATED else None
+        )
+
+        self._state = "data"
+        return (
+            header_end,
+            [("raw", bytes(buffer[position:header_end])), ("start", self._member)],
+        )
+
+    def _read_data(self, position: int):
+        buffer = self._buffer
+        has_descriptor = bool(self._flags & FLAG_DATA_DESCRIPTOR)
+
+        if not has_descriptor:
+            length = min(self._remaining, len(buffer) - position)
+            data = bytes(buffer[position : position + length])
+            self._consume(data)
+            self._remaining -= length
+            finished = self._remaining == 0
+        elif self._decompressor is not None:
+            # the end of the deflate stream marks the end of the member
+            data = self._consume(bytes(buffer[position:]))
+            finished = self._decompressor.eof
+        else:
+            (data, finished) = self._scan_stored(position)
+
+        events = []
+        if len(data) > 0:
+            events.append(("data", data))
+        if finished and has_descriptor:
+            self._state = "descriptor"
+        elif finished:
+            events.append(("end", self._finish_member()))
+            self._state = "header"
+        return (position + len(data), events)
+
+    def _scan_stored(self, position: int):
+        """
+        Finds the end of a stored member with a data descriptor, by looking for
+        a descriptor whose CRC and sizes match the data read up to it.
+
+        Returns:
+            tuple: A tuple containing the member data that was read, and
+            whether the end of the member was found.
+        """
+        buffer = self._buffer
+        start = position
+        while True:
+            index = buffer.find(DATA_DESCRIPTOR_SIGNATURE, position)
+            if index == -1:
+                # keep back a partial signature that may continue in the next feed
+                end = max(position, len(buffer) - (len(DATA_DESCRIPTOR_SIGNATURE) - 1))
+                self._consume(bytes(buffer[position:end]))
+                return (bytes(buffer[start:end]), False)
+
+            self._consume(bytes(buffer[position:index]))
+            position = index
+            if len(buffer) - index < 24:
+                return (bytes(buffer[start:index]), False)
+
+            (crc32, compress_size, file_size) = struct.unpack_from(
+                "<3L", buffer, index + 4
+            )
+            (_, zip64_compress_size, zip64_file_size) = struct.unpack_from(
+                "<LQQ", buffer, index + 4
+            )
+            size = self._read_file_size
+            if crc32 == self._crc and (
+                (compress_size, file_size) == (size, size)
+                or (zip64_compress_size, zip64_file_size) == (size, size)
+            ):
+                return (bytes(buffer[start:index]), True)
+
+            # not a descriptor, just data that happens to look like one
+            self._consume(DATA_DESCRIPTOR_SIGNATURE)
+            position = index + len(DATA_DESCRIPTOR_SIGNATURE)
+
+    def _read_descriptor(self, position: int):
+        buffer = self._buffer
+        if len(buffer) - position < 4:
+            return (position, [])
+        offset = (
+            4 if buffer[position : position + 4] == DATA_DESCRIPTOR_SIGNATURE else 0
+        )
+        zip64 = (
+            self._zip64
+            or self._read_compress_size >= ZIP64_LIMIT
+            or self._read_file_size >= ZIP64_LIMIT
+        )
+        size_format = "<LQQ" if zip64 else "<3L"
+        length = offset + struct.calcsize(size_format)
+        if len(buffer) - position < length:
+            return (position, [])
+
+        (crc32, compress_size, file_size) = struct.unpack_from(
+            size_format, buffer, position + offset
+        )
+        self._member.crc32 = crc32
+        self._member.compress_size = compress_size
+        self._member.file_size = file_size
+        self._state = "header"
+        return (
+            position + length,
+            [
+                ("raw", bytes(buffer[position : position + length])),
+                ("end", self._finish_member()),
+            ],
+        )
+
+    def _consume(self, data: bytes) -> bytes:
+        """
+        Decompresses and hashes member data.
+
+        Returns:
+            bytes: The part of `data` that belongs to the member, which is all of
+            it unless the end of a deflate stream was reached.
+        """
+        if self._decompressor is None:
+            self._update(data)
+            self._read_compress_size += len(data)
+            return data
+
+        pending = data
+        while pending and not self._decompressor.eof:
+            self._update(self._decompressor.decompress(pending, DECOMPRESS_BUFFER_SIZE))
+            pending = self._decompressor.unconsumed_tail
+        if self._decompressor.eof:
+            data = data[: len(data) - len(self._decompressor.unused_data)]
+        self._read_compress_size += len(data)
+        return data
+
+    def _update(self, data: bytes):
+        self._crc = zlib.crc32(data, self._crc)
+        self._hash.update(data)
+        self._read_file_size += len(data)
+
+    def _finish_member(self) -> ZipMember:
+        member = self._member
+        self._member = None
+        if self._decompressor is not None and not self._decompressor.eof:
+            raise InvalidArchiveError(f"{member.path} is corrupt")
+        if (
+            member.crc32 != self._crc
+            or member.compress_size != self._read_compress_size
+            or member.file_size != self._read_file_size
+        ):
+            raise InvalidArchiveError(f"{member.path} is corrupt")
+        member.sha256 = self._hash.hexdigest()
+        return member
+
+
+def iter_extra_fields(extra: bytes) -> Iterator[tuple[int, bytes]]:
+    position = 0
+    while position + EXTRA_HEADER.size <= len(extra):
+        (field_id, length) = EXTRA_HEADER.unpack_from(extra, position)
+        position += EXTRA_HEADER.size
+        yield (field_id, extra[position : position + length])
+        position += length
+
+
+def encode_path(path: str) -> tuple[bytes, int]:
+    """
+    Returns:
+        tuple: A tuple containing the encoded path and the flags it needs.
+    """
+    try:
+        return (path.encode("ascii"), 0)
+    except UnicodeEncodeError:
+        return (path.encode("utf-8"), FLAG_UTF8)
+
+
+def local_file_header(member: ZipMember, with_descriptor: bool = False) -> bytes:
+    """
+    With `with_descriptor`, the member's CRC and sizes are left out, to follow
+    its data in `data_descriptor(member)` instead (e.g. once it has been read).
+    """
+    (name, flags) = encode_path(member.path)
+    (dos_date, dos_time) = to_dos_datetime(member.date_time)
+    zip64 = member.compress_size >= ZIP64_LIMIT or member.file_size >= ZIP64_LIMIT
+    (crc32, compress_size, file_size) = (
+        (0, 0, 0)
+        if with_descriptor
+        else (member.crc32, member.compress_size, member.file_size)
+    )
+    extra = b""
+    if zip64:
+        extra = EXTRA_HEADER.pack(ZIP64_EXTRA_ID, 16) + struct.pack(
+            "<2Q", file_size, compress_size
+        )
+    header = LOCAL_HEADER.pack(
+        LOCAL_HEADER_SIGNATURE,
+        ZIP64_VERSION if zip64 else DEFAULT_VERSION,
+        flags | (FLAG_DATA_DESCRIPTOR if with_descriptor else 0),
+        member.compress_type,
+        dos_time,
+        dos_date,
+        crc32,
+        ZIP64_LIMIT if zip64 else compress_size,
+        ZIP64_LIMIT if zip64 else file_size,
+        len(name),
+        len(extra),
+    )
+    return header + name + extra
+
+
+def data_descriptor(member: ZipMember) -> bytes:
+    zip64 = member.compress_size >= ZIP64_LIMIT or member.file_size >= ZIP64_LIMIT
+    return DATA_DESCRIPTOR_SIGNATURE + struct.pack(
+        "<LQQ" if zip64 else "<3L",
+        member.crc32,
+        member.compress_size,
+        member.file_size,
+    )
+
+
+def central_directory_header(
+    member: ZipMember, offset: int, with_descriptor: bool = False
+) -> bytes:
+    (name, flags) = encode_path(member.path)
+    if with_descriptor:
+        flags |= FLAG_DATA_DESCRIPTOR
+    (dos_date, dos_time) = to_dos_datetime(member.date_time)
+
+    # only the fields that overflow go in the zip64 extra field, in this order
+    zip64_fields = []
+    file_size = member.file_size
+    if file_size >= ZIP64_LIMIT:
+        zip64_fields.append(file_size)
+        file_size = ZIP64_LIMIT
+    compress_size = member.compress_size
+    if compress_size >= ZIP64_LIMIT:
+        zip64_fields.append(compress_size)
+        compress_size = ZIP64_LIMIT
+    if offset >= ZIP64_LIMIT:
+        zip64_fields.append(offset)
+        offset = ZIP64_LIMIT
+
+    extra = b""
+    if zip64_fields:
+        extra = EXTRA_HEADER.pack(ZIP64_EXTRA_ID, 8 * len(zip64_fields)) + struct.pack(
+            f"<{len(zip64_fields)}Q", *zip64_fields
+        )
+    version = ZIP64_VERSION if zip64_fields else DEFAULT_VERSION
+    header = CENTRAL_HEADER.pack(
+        CENTRAL_HEADER_SIGNATURE,
+        version,
+        version,
+        flags,
+        member.compress_type,
+        dos_time,
+        dos_date,
+        member.crc32,
+        compress_size,
+        file_size,
+        len(name),
+        len(extra),
+        0,
+        0,
+        0,
+        DIRECTORY_ATTRIBUTE if member.path.endswith("/") else 0,
+        offset,
+    )
+    return header + name + extra
+
+
+def end_of_central_directory(count: int, offset: int, size: int) -> bytes:
+    end = b""
+    if count >= ZIP64_COUNT_LIMIT or offset >= ZIP64_LIMIT or size >= ZIP64_LIMIT:
+        end += ZIP64_END.pack(
+            ZIP64_END_SIGNATURE,
+            ZIP64_END.size - 12,
+            ZIP64_VERSION,
+            ZIP64_VERSION,
+            0,
+            0,
+            count,
+            count,
+            size,
+            offset,
+        )
+        end += ZIP64_LOCATOR.pack(ZIP64_LOCATOR_SIGNATURE, 0, offset + size, 1)
+        (count, offset, size) = (
+            min(count, ZIP64_COUNT_LIMIT),
+            min(offset, ZIP64_LIMIT),
+            min(size, ZIP64_LIMIT),
+        )
+    return end + END.pack(END_SIGNATURE, 0, 0, count, count, size, offset, 0)
+
+
+T = TypeVar("T")
+
+
+def build_zip(entries: Sequence[tuple[ZipMember, T]]) -> list[bytes | T]:
+    """
+    Lays out a zip archive of members whose compressed data is stored elsewhere.
+
+    Returns:
+        list: The archive as a list of segments: either rendered headers, or the
+        placeholder given with each member for its compressed data, which is
+        `member.compress_size` bytes long.
+    """
+    segments: list[bytes | T] = []
+    central_directory = bytearray()
+    offset = 0
+    for member, data in entries:
+        header = local_file_header(member)
+        segments.append(header)
+        segments.append(data)
+        central_directory += central_directory_header(member, offset)
+        offset += len(header) + member.compress_size
+
+    segments.append(
+        bytes(central_directory)
+        + end_of_central_directory(len(entries), offset, len(central_directory))
+    )
+    return segments